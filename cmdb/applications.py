@@ -20,9 +20,12 @@ from libs.sync_utils_set import (
     async_vswitch_cloud_region_id,
     async_cmdb_to_jms_with_enterprise,
     async_jms_orgs_to_cmdb,
+    async_tree_count,
+    async_search_index,
+    async_dynamic_group_members,
 )
 from domain.cloud_domain import async_domain_info
-from libs.consul_registry import async_consul_info
+from libs.consul_registry import async_consul_info, async_consul_changes
 from libs.asset_change import init_cmdb_change_tasks
 from libs.scheduled_tasks import init_scheduled_tasks
 from cmp.handlers import urls as order_urls
@@ -34,10 +37,14 @@ class Application(myApplication, ABC):
         # 同步业务
         biz_callback = PeriodicCallback(async_biz_info, 180000)  # 180000 3分钟
         biz_callback.start()
-        # 同步consul 信息
+        # 同步consul 信息，资产/服务树变化后10秒内同步，全量对账兜底
+        consul_changes_callback = PeriodicCallback(
+            async_consul_changes, 10000
+        )  # 10秒
+        consul_changes_callback.start()
         consul_callback = PeriodicCallback(
-            async_consul_info, 120000
-        )  # 120000 2分钟
+            async_consul_info, 3600000
+        )  # 1小时
         consul_callback.start()
         # 同步agent 状态信息
         agent_callback = PeriodicCallback(async_agent, 180000)  # 180000 3分钟
@@ -63,6 +70,21 @@ class Application(myApplication, ABC):
             async_jms_orgs_to_cmdb, 600000
         )  # 10分钟
         jms_org_callback.start()
+        # 服务树数量缓存对账
+        tree_count_callback = PeriodicCallback(
+            async_tree_count, 1800000
+        )  # 30分钟
+        tree_count_callback.start()
+        # 全局搜索索引、IP索引全量重建，补齐手工录入/域名等非同步写入的数据
+        search_index_callback = PeriodicCallback(
+            async_search_index, 3600000
+        )  # 1小时
+        search_index_callback.start()
+        # 动态分组成员对账，兜底未走增量维护的写入
+        dynamic_group_callback = PeriodicCallback(
+            async_dynamic_group_members, 1800000
+        )  # 30分钟
+        dynamic_group_callback.start()
         urls.extend(domain_urls)
         urls.extend(order_urls)
         # self.settings = settings
@@ -6,15 +6,58 @@ Author  : shenshuo
 Date    : 2023年4月7日
 """
 
+import asyncio
+import json
 from abc import ABC
+from functools import partial
+
+from tornado.ioloop import IOLoop
+
 from libs.base_handler import BaseHandler
-from services.search_service import get_asset_list
+from services.search_service import get_asset_list, submit_search_sources, search_index_ready, \
+    SEARCH_SOURCE_TIMEOUT
 
 
 class SearchHandler(BaseHandler, ABC):
-    def get(self):
-        res = get_asset_list(**self.params)
-        return self.write(res)
+    async def get(self):
+        value = self.params.get('searchValue') if "searchValue" in self.params else self.params.get('searchVal')
+        if self.params.get('stream') not in ('1', 'true', 'yes') or not value:
+            res = await IOLoop.current().run_in_executor(None, partial(get_asset_list, **self.params))
+            return self.write(res)
+
+        # 流式返回，每个数据源查询完成即输出一行JSON
+        self.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+        io_loop = IOLoop.current()
+        if await io_loop.run_in_executor(None, search_index_ready):
+            # 已有搜索索引时一次查询即可返回全部数据源
+            res = await io_loop.run_in_executor(None, partial(get_asset_list, **self.params))
+            for source, data in res.items():
+                if source.endswith('_data'):
+                    self.write(json.dumps(dict(code=0, source=source, data=data), ensure_ascii=False,
+                                          default=str) + "\n")
+            return self.finish()
+
+        futures = {asyncio.wrap_future(future): source
+                   for source, future in submit_search_sources(value, limit=10).items()}
+        done, pending = set(), set(futures)
+        deadline = io_loop.time() + SEARCH_SOURCE_TIMEOUT
+        while pending:
+            timeout = deadline - io_loop.time()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                source = futures[future]
+                try:
+                    line = dict(code=0, source=source, data=future.result())
+                except Exception as err:
+                    line = dict(code=-1, source=source, msg=f"查询出错 {err}", data=[])
+                self.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+                await self.flush()
+        for future in pending:
+            self.write(json.dumps(dict(code=-1, source=futures[future], msg="查询超时", data=[]),
+                                  ensure_ascii=False) + "\n")
+        self.finish()
 
 
 search_urls = [
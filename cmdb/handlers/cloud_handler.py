@@ -21,9 +21,12 @@ from apscheduler.schedulers.tornado import TornadoScheduler
 
 from libs.base_handler import BaseHandler
 from models.models_utils import get_all_cloud_interval
-from services.cloud_service import opt_obj, get_cloud_settings, get_cloud_sync_log, update_cloud_settings
+from services.cloud_service import opt_obj, get_cloud_settings, get_cloud_sync_log, update_cloud_settings, \
+    get_cloud_sync_audit
 from libs.mycrypt import mc
 from libs.thread_pool import global_executors
+from libs.rate_limit import rate_limiter
+from libs.sync_worker import enqueue_sync_job, is_queue_mode
 
 
 
@@ -106,6 +109,10 @@ class CloudService:
 
 def get_job_func(cloud_name, account_id, _executors):
     def job_func():
+        # 队列模式下只入队，由Worker进程执行
+        if is_queue_mode():
+            enqueue_sync_job(cloud_name, account_id)
+            return
         sync_func = cloud_loader.get_sync_function(cloud_name)
         if sync_func:
             try:
@@ -131,6 +138,8 @@ def add_cloud_jobs():
             "interval",
             minutes=item.get("interval", 30),
             replace_existing=True,
+            coalesce=True,  # 错过的多次执行合并为一次
+            max_instances=1,  # 上一轮未结束时不重叠执行
             id=item.get("account_id"),
             name=str(item),
             # kwargs=dict(account_id=item['account_id'])
@@ -201,6 +210,25 @@ class SyncLogHandler(BaseHandler, ABC):
         return self.write(res)
 
 
+class SyncAuditHandler(BaseHandler, ABC):
+    def get(self):
+        """每次同步(代数)新增/变更/消失的资产数"""
+        res = get_cloud_sync_audit(**self.params)
+        return self.write(res)
+
+
+class CloudRateLimitHandler(BaseHandler, ABC):
+    def get(self):
+        """云厂商API调用/限流/重试计数"""
+        return self.write({"code": 0, "msg": "获取成功", "data": rate_limiter.stats()})
+
+
+class CloudSchedulerStatsHandler(BaseHandler, ABC):
+    def get(self):
+        """云资源同步调度队列深度、等待时长"""
+        return self.write({"code": 0, "msg": "获取成功", "data": global_executors.cloud_executor.stats()})
+
+
 class CloudSyncHandler(BaseHandler, ABC):
     _thread_pool = ThreadPoolExecutor(3)
 
@@ -236,6 +264,10 @@ class CloudSyncHandler(BaseHandler, ABC):
         if not self.cloud_service.get_sync_function(cloud_name):
             return self.write({"code": 1, "msg": "不支持的云厂商"})
 
+        if is_queue_mode():
+            enqueue_sync_job(cloud_name, account_id, resources)
+            return self.write({"code": 0, "msg": "已加入同步队列"})
+
         IOLoop.current().add_callback(self.asset_sync_main, cloud_name, account_id, resources)
 
         # await self.asset_sync_main(cloud_name, account_id, resources)
@@ -250,5 +282,20 @@ cloud_urls = [
         SyncLogHandler,
         {"handle_name": "配置平台-多云配置-查看同步日志", "method": ["GET"]},
     ),
+    (
+        r"/api/v2/cmdb/cloud/sync/audit/",
+        SyncAuditHandler,
+        {"handle_name": "配置平台-多云配置-同步审计", "method": ["GET"]},
+    ),
     (r"/api/v2/cmdb/cloud/sync/", CloudSyncHandler, {"handle_name": "配置平台-多云配置-资产同步", "method": ["ALL"]}),
+    (
+        r"/api/v2/cmdb/cloud/sync/rate_limit/",
+        CloudRateLimitHandler,
+        {"handle_name": "配置平台-多云配置-API限流统计", "method": ["GET"]},
+    ),
+    (
+        r"/api/v2/cmdb/cloud/sync/scheduler/",
+        CloudSchedulerStatsHandler,
+        {"handle_name": "配置平台-多云配置-同步调度统计", "method": ["GET"]},
+    ),
 ]
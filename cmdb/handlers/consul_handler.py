@@ -9,7 +9,7 @@ Desc:  Consul
 import json
 from abc import ABC
 from libs.base_handler import BaseHandler
-from libs.consul_registry import ConsulOpt
+from libs.consul_registry import ConsulOpt, get_consul_sync_summary
 from concurrent.futures import ThreadPoolExecutor
 from tornado.concurrent import run_on_executor
 
@@ -54,9 +54,17 @@ class ConsulInstanceHandlers(BaseHandler, ABC):
         return self.write(res)
 
 
+class ConsulSyncSummaryHandlers(BaseHandler, ABC):
+    def get(self):
+        """最近一次同步的新增/变更/注销/未变化数量"""
+        return self.write(get_consul_sync_summary())
+
+
 consul_urls = [
     (r"/api/v2/cmdb/consul/service/", ConsulServiceHandlers,
      {"handle_name": "配置平台-监控-consul服务列表", "method": ["ALL"]}),
     (r"/api/v2/cmdb/consul/instance/", ConsulInstanceHandlers,
      {"handle_name": "配置平台-监控-consul发现管理", "method": ["ALL"]}),
+    (r"/api/v2/cmdb/consul/sync/summary/", ConsulSyncSummaryHandlers,
+     {"handle_name": "配置平台-监控-consul同步统计", "method": ["GET"]}),
 ]
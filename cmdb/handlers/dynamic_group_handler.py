@@ -10,8 +10,8 @@ Desc    : 动态分组API
 import json
 from abc import ABC
 from libs.base_handler import BaseHandler
-from services.dynamic_group_service import get_dynamic_group, opt_obj, preview_dynamic_group_for_api, \
-    update_dynamic_group_for_api, add_dynamic_group_for_api, get_dynamic_group_for_use_api
+from services.dynamic_group_service import get_dynamic_group, preview_dynamic_group_for_api, \
+    update_dynamic_group_for_api, add_dynamic_group_for_api, get_dynamic_group_for_use_api, del_dynamic_group_for_api
 
 
 class DynamicGroupHandlers(BaseHandler, ABC):
@@ -34,7 +34,7 @@ class DynamicGroupHandlers(BaseHandler, ABC):
 
     def delete(self):
         data = json.loads(self.request.body.decode("utf-8"))
-        res = opt_obj.handle_delete(data)
+        res = del_dynamic_group_for_api(data)
 
         return self.write(res)
 
@@ -8,6 +8,7 @@ import json
 from websdk2.cache_context import cache_conn
 
 from libs.base_handler import BaseHandler
+from libs.api_gateway.jumpserver.base import jms_metrics
 
 
 class JmsHandler(BaseHandler, ABC):
@@ -24,6 +25,14 @@ class JmsHandler(BaseHandler, ABC):
         return self.write(res)
 
 
+class JmsMetricsHandler(BaseHandler, ABC):
+
+    def get(self):
+        """本进程内各接口的请求次数、错误数、耗时"""
+        return self.write(dict(msg='获取成功', code=0, data=jms_metrics.stats()))
+
+
 jms_urls = [
     (r"/api/v2/cmdb/jms/orgs/list/", JmsHandler, {"handle_name": "配置平台-堡垒机组织列表", "method": ["GET"]}),
+    (r"/api/v2/cmdb/jms/metrics/", JmsMetricsHandler, {"handle_name": "配置平台-堡垒机接口统计", "method": ["GET"]}),
 ]
@@ -15,6 +15,7 @@ from websdk2.db_context import DBContext
 from models.asset import AssetUserFieldModels
 from services.asset_server_service import add_server_batch, patch_server_batch, add_server, delete_server, mark_server, \
     get_server_list, bind_main_agent
+from services.ip_index_service import get_assets_in_subnet_by_api
 
 
 class AssetServerHandler(BaseHandler, ABC):
@@ -120,6 +121,14 @@ class ServerBindMainAgentHandler(BaseHandler, ABC):
         res = bind_main_agent(data)
         return self.write(res)
 
+
+class AssetSubnetHandler(BaseHandler, ABC):
+    def get(self):
+        """查询网段内的资产 ?cidr=10.0.0.0/24&asset_type=server&ip_type=inner"""
+        res = get_assets_in_subnet_by_api(**self.params)
+        self.write(res)
+
+
 server_urls = [
     (r"/api/v2/cmdb/server/", AssetServerHandler, {"handle_name": "配置平台-云商-主机管理", "method": ["ALL"]}),
     (r"/api/v2/cmdb/server/batch/", AssetServerBatchHandler,
@@ -128,4 +137,6 @@ server_urls = [
      {"handle_name": "配置平台-基础功能-用户字段配置", "method": ["ALL"]}),
     (r"/api/v2/cmdb/server/main_agent/", ServerBindMainAgentHandler,
      {"handle_name": "配置平台-云商-主机绑定主Agent", "method": ["POST"]}),
+    (r"/api/v2/cmdb/asset/subnet/", AssetSubnetHandler,
+     {"handle_name": "配置平台-基础功能-网段资产查询", "method": ["GET"]}),
 ]
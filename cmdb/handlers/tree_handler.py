@@ -20,7 +20,7 @@ from models.tree import TreeModels, TreeAssetModels
 from websdk2.db_context import DBContext
 from websdk2.model_utils import queryset_to_list
 from services.tree_service import get_biz_name, get_tree_by_api, add_tree_by_api, put_tree_by_api, patch_tree_by_api, \
-    del_tree_by_api, get_tree_info_by_api
+    del_tree_by_api, get_tree_info_by_api, get_tree_etag_by_api
 from services.tree_asset_service import get_tree_env_list, get_tree_form_env_list, get_tree_form_module_list, \
     get_tree_form_set_list, register_asset, del_tree_asset, get_tree_asset_by_api, add_tree_asset_by_api, \
     update_tree_asset_by_api, get_server_tree_for_api, get_tree_module_list, update_tree_leaf, del_tree_leaf,\
@@ -31,6 +31,13 @@ from models import asset_mapping as mapping
 
 class TreeHandler(BaseHandler, ABC):
     def get(self):
+        # 树未变化时返回304，前端轮询不用重新下载整棵树
+        etag = get_tree_etag_by_api(**self.params)
+        if etag:
+            self.set_header("Etag", f'"{etag}"')
+            if self.check_etag_header():
+                self.set_status(304)
+                return
         res = get_tree_by_api(**self.params)
         return self.write(res)
 
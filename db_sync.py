@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.engine.url import URL
+from sqlalchemy.schema import CreateColumn
 
 from models.business import Base as BusinessBase
 from models.base import Base as ABase
@@ -51,6 +52,36 @@ def create():
     AgentBase.metadata.create_all(engine)
     CbbAreaBase.metadata.create_all(engine)
     print('[Success] 表结构创建成功!')
+    upgrade()
+
+
+def upgrade():
+    """
+    已有表补充模型中新增的字段及其索引，create_all只创建新表，不会给已有表加字段
+    """
+    inspector = inspect(engine)
+    bases = [ABase, CloudBase, ServerBase, EventBase, BusinessBase, TagBase, TreeBase, CloudRegionBase, DomainBase,
+             OrderBase, AuditBase, EnvBase, SecretBase, AgentBase, CbbAreaBase]
+    tables = {table.name: table for base in bases for table in base.metadata.sorted_tables}
+    for table_name, table in tables.items():
+        if not inspector.has_table(table_name):
+            continue
+        exist_columns = {column['name'] for column in inspector.get_columns(table_name)}
+        missing = [column for column in table.columns if column.name not in exist_columns]
+        if not missing:
+            continue
+        missing_names = {column.name for column in missing}
+        try:
+            with engine.begin() as conn:
+                for column in missing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+                for index in table.indexes:
+                    if missing_names & {column.name for column in index.columns}:
+                        index.create(conn)
+            print(f'[Success] {table_name} 新增字段: {", ".join(sorted(missing_names))}')
+        except Exception as err:
+            print(f'[Error] {table_name} 新增字段失败: {err}')
 
 
 def drop():
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# @Date: 2026/10/18
+# @Description: Agent注册表缓存，进程内 + Redis 两级缓存，按版本号增量刷新
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from websdk2.api_set import api_set
+from websdk2.cache_context import cache_conn
+from websdk2.client import AcsClient
+from websdk2.tools import convert
+
+AGENT_REGISTRY_DATA_KEY = "cmdb:agent_registry:data"
+AGENT_REGISTRY_VERSION_KEY = "cmdb:agent_registry:version"
+AGENT_REGISTRY_FETCH_LOCK_KEY = "cmdb:agent_registry:fetch_lock"  # 跨进程只允许一个调用方拉取
+FETCH_LOCK_TTL = 30  # 拉取锁有效期(秒)，拉取方异常退出后自动释放
+FETCH_WAIT = 10  # 未拿到拉取锁时等待其他调用方写入Redis的最长时间(秒)
+LOCAL_TTL = 30  # 进程内缓存有效期(秒)，过期后先比对Redis版本号
+REDIS_TTL = 180  # Redis缓存有效期(秒)，过期后重新拉取Agent列表
+
+
+class AgentRegistry:
+    """
+    Agent列表缓存，主机写入和Agent状态同步共用
+    进程内缓存过期时只读取Redis版本号，版本号未变化不重新加载数据
+    """
+
+    def __init__(self, local_ttl: int = LOCAL_TTL, redis_ttl: int = REDIS_TTL):
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self._data: Dict[str, dict] = {}
+        self._version: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    @staticmethod
+    def fetch() -> Optional[dict]:
+        """从Agent服务拉取全量列表，失败返回None"""
+        try:
+            client = AcsClient()
+            resp = client.do_action_v2(**api_set.get_agent_list)
+            if resp.status_code != 200:
+                logging.error(f"获取agent列表失败，状态码={resp.status_code}")
+                return None
+            return resp.json()
+        except Exception as err:
+            logging.error(f"获取agent列表失败，{err}")
+            return None
+
+    @staticmethod
+    def get_version(data: dict) -> str:
+        return hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _load_from_redis(self) -> bool:
+        """Redis版本号与进程内一致时直接复用，否则加载Redis中的数据"""
+        redis_conn = cache_conn()
+        version = redis_conn.get(AGENT_REGISTRY_VERSION_KEY)
+        if not version:
+            return False
+        version = convert(version)
+        if version != self._version:
+            data = redis_conn.get(AGENT_REGISTRY_DATA_KEY)
+            if not data:
+                return False
+            self._data, self._version = json.loads(convert(data)), version
+        return True
+
+    def _save(self, data: dict) -> None:
+        version = self.get_version(data)
+        self._data, self._version = data, version
+        try:
+            redis_conn = cache_conn()
+            pipe = redis_conn.pipeline()
+            # 版本号未变化时只续期，不重写数据
+            if convert(redis_conn.get(AGENT_REGISTRY_VERSION_KEY) or '') == version:
+                pipe.expire(AGENT_REGISTRY_DATA_KEY, self.redis_ttl)
+            else:
+                pipe.set(AGENT_REGISTRY_DATA_KEY, json.dumps(data), ex=self.redis_ttl)
+            pipe.set(AGENT_REGISTRY_VERSION_KEY, version, ex=self.redis_ttl)
+            pipe.execute()
+        except Exception as err:
+            logging.error(f"写入agent缓存失败，{err}")
+
+    def _get_cached(self) -> Optional[Dict[str, dict]]:
+        """进程内缓存未过期或Redis中有数据时返回，否则返回None"""
+        with self._lock:
+            if self._version and time.time() - self._checked_at < self.local_ttl:
+                return self._data
+            try:
+                if self._load_from_redis():
+                    self._checked_at = time.time()
+                    return self._data
+            except Exception as err:
+                logging.error(f"读取agent缓存失败，{err}")
+        return None
+
+    def _wait_for_redis(self) -> Optional[Dict[str, dict]]:
+        """其他进程正在拉取，等待其写入Redis"""
+        deadline = time.time() + FETCH_WAIT
+        while time.time() < deadline:
+            time.sleep(0.2)
+            data = self._get_cached()
+            if data is not None:
+                return data
+        return None
+
+    def get_all(self) -> Dict[str, dict]:
+        """获取全部Agent信息 agent_id -> agent_info
+        缓存失效时单飞拉取：进程内同一时刻只有一个线程拉取，跨进程通过Redis SET NX 锁只有一个调用方拉取，
+        其他调用方等待其写入Redis后直接读取
+        """
+        data = self._get_cached()
+        if data is not None:
+            return data
+        with self._fetch_lock:
+            # 等锁期间其他线程可能已刷新
+            data = self._get_cached()
+            if data is not None:
+                return data
+            try:
+                redis_conn = cache_conn()
+                token = f"{threading.get_ident()}:{time.time()}"
+                locked = redis_conn.set(AGENT_REGISTRY_FETCH_LOCK_KEY, token, nx=True, ex=FETCH_LOCK_TTL)
+            except Exception as err:
+                logging.error(f"获取agent拉取锁失败，{err}")
+                redis_conn, locked = None, True
+            if not locked:
+                data = self._wait_for_redis()
+                if data is not None:
+                    return data
+                logging.warning("等待agent缓存超时，自行拉取")
+            try:
+                data = self.refresh()
+            finally:
+                if locked and redis_conn is not None:
+                    try:
+                        if convert(redis_conn.get(AGENT_REGISTRY_FETCH_LOCK_KEY) or '') == token:
+                            redis_conn.delete(AGENT_REGISTRY_FETCH_LOCK_KEY)
+                    except Exception as err:
+                        logging.error(f"释放agent拉取锁失败，{err}")
+        return self._data if data is None else data
+
+    def refresh(self) -> Optional[Dict[str, dict]]:
+        """强制拉取并更新缓存，拉取失败返回None"""
+        data = self.fetch()
+        with self._lock:
+            self._checked_at = time.time()
+            if data is None:
+                return None
+            self._save(data)
+            return data
+
+
+agent_registry = AgentRegistry()
+
+
+if __name__ == '__main__':
+    pass
@@ -12,7 +12,9 @@ import logging
 from typing import *
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkecs.request.v20140526.DescribeInstancesRequest import DescribeInstancesRequest
-from models.models_utils import server_task, mark_expired, server_task_batch, mark_expired_by_sync
+from libs.rate_limit import rate_limiter
+from models.models_utils import server_task, mark_expired, server_task_batch, mark_expired_by_sync, \
+    stream_upsert_task
 
 
 def get_run_type(val: str) -> str:
@@ -79,7 +81,8 @@ class AliyunEcsClient:
             # request.set_accept_format('json')
             request.set_PageNumber(self.page_number)
             request.set_PageSize(self.page_size)
-            response = self.__client.do_action_with_exception(request)
+            response = rate_limiter.call('aliyun', self._accountID, 'DescribeInstances',
+                                         self.__client.do_action_with_exception, request)
             response_data = json.loads(str(response, encoding="utf8"))
         except Exception as err:
             logging.error(f'获取ECS信息失败:{err}')
@@ -148,7 +151,10 @@ class AliyunEcsClient:
         self.page_number = 1
         while True:
             data = self.get_describe_info()
-            if not data or 'Instance' not in data: break
+            # 请求失败时中断同步，避免分页被截断后误标记过期
+            if data is None:
+                raise RuntimeError(f'获取ECS信息失败, 页码={self.page_number}')
+            if 'Instance' not in data: break
             if not data['Instance']: break
             self.page_number += 1
             row = data['Instance']
@@ -161,24 +167,9 @@ class AliyunEcsClient:
         同步CMDB
         :return:
         """
-        # 所有的ECS对象，是一个迭代器
-        all_ecs: Generator[map] = self.get_all_ecs()
-        # 处理到一个List里面
-        all_server_list: List[dict] = []
-        for _server_map in all_ecs:
-            all_server_list.extend(list(_server_map))
-
-        if not all_server_list: return False, "ECS列表为空"
-        # 更新资源
-        # ret_state, ret_msg = server_task(account_id=self._accountID, cloud_name=cloud_name, rows=all_server_list)
-        # 标记过期
-        # mark_expired(resource_type=resource_type, account_id=self._accountID)
-        ret_state, ret_msg = server_task_batch(account_id=self._accountID, cloud_name=cloud_name, rows=all_server_list)
-        instance_ids = [row['instance_id'] for row in all_server_list]
-        mark_expired_by_sync(cloud_name=cloud_name, account_id=self._accountID, resource_type=resource_type,
-                             instance_ids=instance_ids, region=self._region)
-
-        return ret_state, ret_msg
+        # 所有的ECS对象，是一个迭代器，逐页入库
+        all_ecs: Generator[map, None, None] = self.get_all_ecs()
+        return stream_upsert_task(resource_type, 'ECS', cloud_name, self._accountID, all_ecs, region=self._region)
 
 
 if __name__ == '__main__':
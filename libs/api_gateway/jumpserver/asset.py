@@ -31,6 +31,15 @@ class AssetAPI(JumpServerBaseAPI):
             return [item for item in result if item['full_value'] == name]
         return result
 
+    def list_all(self, org_id: str = None, page_size: int = 1000) -> Optional[List[dict]]:
+        """
+        分页获取组织下全部节点
+        :param org_id: 组织id
+        :param page_size: 每页数量
+        :return: 请求失败返回None
+        """
+        return super().list_all(url=f'{self.base_url}/api/v1/assets/nodes/', org_id=org_id, page_size=page_size)
+
     def create(self, name: str = None, parent_id: str = None, org_id: str = None) -> List[dict]:
         """
         创建节点
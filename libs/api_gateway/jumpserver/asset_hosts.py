@@ -32,6 +32,15 @@ class AssetHostsAPI(JumpServerBaseAPI):
                                  url=f'{self.base_url}/api/v1/assets/hosts/',
                                  params=params, org_id=org_id)
 
+    def list_all(self, org_id: str = None, page_size: int = 1000) -> Optional[List[dict]]:
+        """
+        分页获取组织下全部主机资产
+        :param org_id: 组织id
+        :param page_size: 每页数量
+        :return: 请求失败返回None
+        """
+        return super().list_all(url=f'{self.base_url}/api/v1/assets/hosts/', org_id=org_id, page_size=page_size)
+
     def create(self, **kwargs):
         """
         创建主机资产
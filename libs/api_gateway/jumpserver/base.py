@@ -4,17 +4,28 @@
 # @Description: Description
 
 from datetime import datetime
+import asyncio
 import logging
+import re
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from typing import Type, Tuple
+from typing import Dict, Type, Tuple, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 from httpsig import requests_auth
 from websdk2.consts import const
 
 from settings import settings as app_settings
 
+# 每个组织一个连接池，保持长连接复用
+JMS_POOL_SIZE = int(app_settings.get('jms_pool_size') or 20)
+# 路径中的资源ID归一化，按接口统计
+_ID_PATTERN = re.compile(r'/([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+)(?=/|$)')
+
 
 def retry_on_exception(retries=2, delay=0.5, exceptions: Tuple[Type[Exception]] = (requests.RequestException,), ):
     def decorator(func):
@@ -33,6 +44,74 @@ def retry_on_exception(retries=2, delay=0.5, exceptions: Tuple[Type[Exception]]
     return decorator
 
 
+class JumpServerMetrics:
+    """按接口统计JumpServer请求次数、错误数、耗时"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: dict(calls=0, errors=0, total_seconds=0.0, max_seconds=0.0))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_endpoint(method: str, url: str) -> str:
+        path = requests.utils.urlparse(url).path
+        return f"{method.upper()} {_ID_PATTERN.sub('/:id', path)}"
+
+    def record(self, endpoint: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            stat = self._stats[endpoint]
+            stat['calls'] += 1
+            stat['errors'] += int(error)
+            stat['total_seconds'] += seconds
+            stat['max_seconds'] = max(stat['max_seconds'], seconds)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                endpoint: dict(value, avg_seconds=round(value['total_seconds'] / value['calls'], 4),
+                               total_seconds=round(value['total_seconds'], 4),
+                               max_seconds=round(value['max_seconds'], 4))
+                for endpoint, value in self._stats.items() if value['calls']
+            }
+
+
+jms_metrics = JumpServerMetrics()
+
+
+class JumpServerSessionPool:
+    """按组织共享 requests.Session，复用 TCP/TLS 连接"""
+
+    def __init__(self, pool_size: int = JMS_POOL_SIZE):
+        self.pool_size = pool_size
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get(self, org_id: str) -> requests.Session:
+        session = self._sessions.get(org_id)
+        if session is not None:
+            return session
+        with self._lock:
+            if org_id not in self._sessions:
+                session = requests.Session()
+                # 重试由 retry_on_exception 处理，连接池只负责复用
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[org_id] = session
+            return self._sessions[org_id]
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+jms_session_pool = JumpServerSessionPool()
+# 异步请求使用的线程池，与连接池大小一致
+jms_async_executor = ThreadPoolExecutor(max_workers=JMS_POOL_SIZE, thread_name_prefix='jms-api')
+
+
 class JumpServerBaseAPI:
 
     DEFAULT_ORG_ID = '00000000-0000-0000-0000-000000000002'
@@ -46,12 +125,16 @@ class JumpServerBaseAPI:
         self.secret = self.jms_dict[const.DEFAULT_JMS_KEY][const.JMS_API_KEY_SECRET]
         self.timeout = timeout
         self.org_id = org_id or self.DEFAULT_ORG_ID
+        self._auth = None
 
     @property
     def auth(self):
-        signature_headers = ['(request-target)', 'accept', 'date']
-        return requests_auth.HTTPSignatureAuth(key_id=self.key_id, secret=self.secret, algorithm='hmac-sha256',
-                                               headers=signature_headers)
+        # 签名在每次请求时计算，认证对象可以复用
+        if self._auth is None:
+            signature_headers = ['(request-target)', 'accept', 'date']
+            self._auth = requests_auth.HTTPSignatureAuth(key_id=self.key_id, secret=self.secret,
+                                                         algorithm='hmac-sha256', headers=signature_headers)
+        return self._auth
 
     @property
     def headers(self):
@@ -74,10 +157,43 @@ class JumpServerBaseAPI:
         if org_id is not None:
             headers['X-JMS-ORG'] = org_id
 
+        endpoint = jms_metrics.get_endpoint(method, url)
+        start = time.monotonic()
         try:
-            response = getattr(requests, method.lower())(url=url, params=params, headers=headers, auth=auth, json=data,
-                                                         timeout=self.timeout)
+            session = jms_session_pool.get(headers.get('X-JMS-ORG', self.org_id))
+            response = session.request(method=method.upper(), url=url, params=params, headers=headers, auth=auth,
+                                       json=data, timeout=self.timeout)
+            jms_metrics.record(endpoint, time.monotonic() - start, error=response.status_code >= 400)
             return response.json() if response.status_code != 204 else response.ok
         except requests.RequestException as e:
+            jms_metrics.record(endpoint, time.monotonic() - start, error=True)
             logging.error(f"请求JumpSever发生异常: {e}, url: {url}, params:{params}, data:{data}, method: {method}")
             raise
+
+    async def async_send_request(self, method, url, params=None, data=None, headers=None, auth=None, org_id=None):
+        """
+        异步请求，在独立线程池中执行 send_request，多个请求可以 asyncio.gather 并发
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            jms_async_executor, lambda: self.send_request(method, url, params=params, data=data, headers=headers,
+                                                          auth=auth, org_id=org_id))
+
+    def list_all(self, url: str, params: dict = None, org_id: str = None, page_size: int = 1000) -> Optional[list]:
+        """
+        按 limit/offset 分页拉取全量数据，请求失败返回None
+        """
+        results, offset = [], 0
+        while True:
+            page = self.send_request(method='get', url=url, org_id=org_id,
+                                     params={**(params or {}), 'limit': page_size, 'offset': offset})
+            if page is False or page is None:
+                return None
+            # 不支持分页的接口直接返回全量列表
+            if isinstance(page, list):
+                return page
+            items = page.get('results') or []
+            results.extend(items)
+            offset += len(items)
+            if not items or offset >= page.get('count', 0):
+                return results
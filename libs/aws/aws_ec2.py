@@ -9,9 +9,12 @@ Docs    : https://boto3.amazonaws.com/v1/documentation/api/latest/reference/serv
 """
 
 import logging
+import datetime
 import boto3
 from typing import *
-from models.models_utils import server_task, mark_expired, mark_expired_by_sync, server_task_batch
+from libs.rate_limit import rate_limiter
+from models.models_utils import server_task, mark_expired, mark_expired_by_sync, server_task_batch, \
+    stream_upsert_task
 
 
 def get_run_type(val):
@@ -72,34 +75,78 @@ class AwsEc2Client:
 
         return res
 
-    def get_all_ec2(self) -> List[dict]:
-        response = self.__client.describe_instances()
-        reservations: List[dict] = response['Reservations']
-        if not reservations:
-            logging.error("获取EC2 Instances信息失败")
-            return []
-        # 所有EC2
-        all_ec2_list: List[Dict[str, str]] = []
-        for ret in reservations:
-            for server_data in ret['Instances']:
-                res = self.format_data(server_data)
-                all_ec2_list.append(res)
-        return all_ec2_list
+    def get_all_ec2(self) -> Generator[List[dict], None, None]:
+        """
+        按NextToken分页获取EC2，每次返回一页
+        """
+        params = dict(MaxResults=500)
+        while True:
+            page = rate_limiter.call('aws', self._accountID, 'DescribeInstances',
+                                     self.__client.describe_instances, **params)
+            yield [self.format_data(server_data) for ret in page['Reservations'] for server_data in ret['Instances']]
+            if not page.get('NextToken'):
+                break
+            params['NextToken'] = page['NextToken']
+
+    def get_changed_instance_ids(self, since: datetime.datetime) -> Set[str]:
+        """
+        通过CloudTrail获取since之后有变更事件的EC2实例ID
+        不带时区的since按UTC处理(与同步水位一致)
+        """
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        trail_client = boto3.client(
+            'cloudtrail', region_name=self._region,
+            aws_access_key_id=self._access_id,
+            aws_secret_access_key=self._access_key
+        )
+        params = dict(LookupAttributes=[{'AttributeKey': 'ResourceType', 'AttributeValue': 'AWS::EC2::Instance'}],
+                      StartTime=since)
+        instance_ids = set()
+        while True:
+            page = rate_limiter.call('aws', self._accountID, 'LookupEvents', trail_client.lookup_events, **params)
+            for event in page.get('Events', []):
+                instance_ids.update(res['ResourceName'] for res in event.get('Resources', [])
+                                    if res.get('ResourceType') == 'AWS::EC2::Instance' and res.get('ResourceName'))
+            if not page.get('NextToken'):
+                break
+            params['NextToken'] = page['NextToken']
+        return instance_ids
+
+    def get_ec2_by_ids(self, instance_ids: List[str]) -> List[dict]:
+        """按实例ID获取EC2，已删除的实例不会报错"""
+        rows = []
+        for i in range(0, len(instance_ids), 100):
+            params = dict(Filters=[{'Name': 'instance-id', 'Values': instance_ids[i:i + 100]}])
+            while True:
+                page = rate_limiter.call('aws', self._accountID, 'DescribeInstances',
+                                         self.__client.describe_instances, **params)
+                rows.extend(self.format_data(server_data) for ret in page['Reservations']
+                            for server_data in ret['Instances'])
+                if not page.get('NextToken'):
+                    break
+                params['NextToken'] = page['NextToken']
+        return rows
+
+    def sync_cmdb_incremental(self, since: datetime.datetime, cloud_name: Optional[str] = 'aws') -> Tuple[bool, str]:
+        """
+        增量同步，只拉取since之后有变更的实例，不标记过期(由全量对账处理)
+        """
+        try:
+            instance_ids = self.get_changed_instance_ids(since)
+            if not instance_ids:
+                return True, f"EC2增量同步，{since}之后无变更"
+            rows = self.get_ec2_by_ids(sorted(instance_ids))
+        except Exception as err:
+            return False, f"EC2增量同步失败: {err}"
+        ret_state, ret_msg = server_task_batch(account_id=self._accountID, cloud_name=cloud_name, rows=rows)
+        return ret_state, f"增量同步 {ret_msg}"
 
     def sync_cmdb(self, cloud_name: Optional[str] = 'aws', resource_type: Optional[str] = 'server') -> Tuple[
         bool, str]:
-        # 所有EC2数据
-        all_ec2_list: List[dict] = self.get_all_ec2()
-        if not all_ec2_list: return False, "EC2列表为空"
-        # 更新资源
-        ret_state, ret_msg = server_task_batch(account_id=self._accountID, cloud_name=cloud_name, rows=all_ec2_list)
-        # 标记过期
-        # mark_expired(resource_type=resource_type, account_id=self._accountID)
-        instance_ids = [row['instance_id'] for row in all_ec2_list]
-        mark_expired_by_sync(cloud_name=cloud_name, account_id=self._accountID, resource_type=resource_type,
-                             instance_ids=instance_ids, region=self._region)
-
-        return ret_state, ret_msg
+        # 所有EC2数据，逐页入库
+        return stream_upsert_task(resource_type, 'EC2', cloud_name, self._accountID, self.get_all_ec2(),
+                                  region=self._region)
 
 
 if __name__ == '__main__':
@@ -12,49 +12,67 @@ import time
 from typing import *
 import concurrent
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from websdk2.tools import RedisLock
-from models.models_utils import get_cloud_config, sync_log_task
+from models.models_utils import get_cloud_config, sync_log_task, sync_with_watermark
 from libs import deco
-from libs.qcloud import mapping, DEFAULT_CLOUD_NAME
+from libs.aws import mapping, DEFAULT_CLOUD_NAME
+from libs.thread_pool import run_region_tasks, get_region_concurrency
 from libs.mycrypt import mc
 
 
 def sync(data: Dict[str, Any]):
     """
-    阿里云统一资产入库，云厂商用for，产品用并发，地区用for
+    AWS统一资产入库，云厂商用for，产品用并发，地区按账号配置并发
     """
     # 参数
-    obj, cloud_type, account_id = data.get('obj'), data.get('type'), data.get('account_id')
+    obj, cloud_type, account_id = data.get("obj"), data.get("type"), data.get("account_id")
+
     # 获取AK SK配置信息
     cloud_configs: List[Dict[str, str]] = get_cloud_config(cloud_name=DEFAULT_CLOUD_NAME, account_id=account_id)
+    if not cloud_configs:
+        return
 
-    if not cloud_configs: return
     # 考虑到多个region的情况
     for conf in cloud_configs:
-        region_list = conf['region'].split(',')
-        for region in region_list:
-            logging.info(f'同步开始, 信息：「{DEFAULT_CLOUD_NAME}」-「{cloud_type}」-「{region}」.')
-            # 开始时间
-            the_start_time = time.time()
-            # Ps:这里有个小坑： 编辑器识别不出来obj是那个Class,所以就算是参数传错了也不会有提示，可以自己用AliyunEventClient替换测试下
-            is_succ, msg = obj(
-                access_id=conf['access_id'], access_key=mc.my_decrypt(conf['access_key']),
-                account_id=conf['account_id'], region=region
-            ).sync_cmdb()
-            # 结束时间
-            the_end_time = time.time() - the_start_time
-            sync_consum = '%.2f' % the_end_time
-            sync_state = 'success' if is_succ else 'failed'
-            # 记录同步信息入库
-            sync_log_task(
-                dict(
-                    name=conf['name'], cloud_name=DEFAULT_CLOUD_NAME, sync_type=cloud_type,
-                    account_id=conf['account_id'], sync_region=region, sync_state=sync_state,
-                    sync_consum=sync_consum, loginfo=str(msg)
-                )
-            )
-            logging.info(f'同步结束, 信息：「{DEFAULT_CLOUD_NAME}」-「{cloud_type}」-「{region}」.')
-            continue
+        run_region_tasks(
+            partial(sync_region, conf, obj=obj, cloud_type=cloud_type),
+            conf["region"].split(","),
+            max_workers=get_region_concurrency(conf),
+        )
+
+
+def sync_region(conf: Dict[str, str], region: str, obj: Callable, cloud_type: str) -> None:
+    logging.info(f"同步开始, 信息：「{DEFAULT_CLOUD_NAME}」-「{cloud_type}」-「{region}」.")
+    # 开始时间
+    the_start_time = time.time()
+    # Ps:这里有个小坑： 编辑器识别不出来obj是那个Class,所以就算是参数传错了也不会有提示，可以自己用AliyunEventClient替换测试下
+    client = obj(
+        access_id=conf["access_id"],
+        access_key=mc.my_decrypt(conf["access_key"]),
+        account_id=conf["account_id"],
+        region=region,
+    )
+    # 支持增量的资源按水位增量同步，每N次做一次全量对账
+    is_succ, msg = sync_with_watermark(client, conf, DEFAULT_CLOUD_NAME, cloud_type, region)
+    # 结束时间
+    the_end_time = time.time() - the_start_time
+    sync_consum = "%.2f" % the_end_time
+    sync_state = "success" if is_succ else "failed"
+    # 记录同步信息入库
+    sync_log_task(
+        dict(
+            name=conf["name"],
+            cloud_name=DEFAULT_CLOUD_NAME,
+            sync_type=cloud_type,
+            account_id=conf["account_id"],
+            sync_region=region,
+            sync_state=sync_state,
+            sync_consum=sync_consum,
+            loginfo=str(msg),
+        )
+    )
+    logging.info(f"同步结束, 信息：「{DEFAULT_CLOUD_NAME}」-「{cloud_type}」-「{region}」.")
 
 
 # @deco(RedisLock("async_aws_to_cmdb_redis_lock_key"))
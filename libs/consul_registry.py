@@ -8,18 +8,22 @@ Desc    : consul 注册
 """
 
 import datetime
+import hashlib
 import json
 import logging
+import time
+from typing import *
 import consul
 import requests
 from settings import settings
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from websdk2.consts import const
 from websdk2.tools import RedisLock, convert
 from websdk2.configs import configs
 from websdk2.db_context import DBContextV2 as DBContext
-from websdk2.model_utils import model_to_dict
 from websdk2.cache_context import cache_conn
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
 from models.tree import TreeAssetModels
 from models import asset_mapping
 from libs.thread_pool import global_executors
@@ -42,47 +46,76 @@ def deco(cls, release=False):
     return _deco
 
 
+CONSUL_STATE_KEY = "cmdb:consul:state"  # service_id -> 最近一次下发的注册数据指纹
+CONSUL_SUMMARY_KEY = "cmdb:consul:last_sync"  # 最近一次同步的差异统计
+CONSUL_SYNC_CONCURRENCY = 16  # 同时向consul发起的注册/注销请求数
+CONSUL_STATE_CHUNK_SIZE = 1000
+CONSUL_YIELD_SIZE = 2000  # 生成注册数据时每批读取的行数
+CONSUL_DIRTY_KEY = "cmdb:consul:dirty"  # 服务树/资产变化后标记，由变更检查任务触发同步
+
+
 def sync_consul():
     @deco(RedisLock("async_asset_to_consul_lock_key"), release=True)
     def index():
         logging.info(f'同步数据到consul开始 ！！！')
-        c = ConsulOpt()
-        server_info = c.get_services()
-        if server_info.get('code') != 0:
-            logging.error(f'访问consul失败 ！！！ {server_info.get("msg")}')
-            return
-        for asset_type in ['server', 'mysql', 'redis', 'domain']:
+        exporters = get_consul_exporters()
+        biz_info_map = get_biz_info_map()
+        sources = [
+            ({f'{asset_type}-exporter' for asset_type in exporters}, get_registry_targets(exporters, biz_info_map)),
+            ({'domain-exporter'}, get_registry_domain_info(biz_info_map)),
+        ]
+        desired, service_names = {}, set()
+        for names, targets in sources:
+            source_desired = {}
             try:
-                cmdb_ins = []
-                for server in consul_sync_factory(asset_type):
-                    cmdb_ins.append(server[1])
-                    c.create_or_update_service(*server)
-
-                for ins in c.get_instances(f'{asset_type}-exporter').get('data'):
-                    if ins.get('ServiceID') not in cmdb_ins:
-                        c.deregister_service(ins.get('ServiceID'))
+                for register_data in targets:
+                    source_desired[register_data[1]] = register_data
             except Exception as err:
-                logging.error(f'sync to consul {asset_type} error,{err} {datetime.datetime.now()}')
+                # 生成失败的类型不参与对账，避免误注销
+                logging.error(f'sync to consul {names} error,{err} {datetime.datetime.now()}')
+                continue
+            desired.update(source_desired)
+            service_names.update(names)
 
-        logging.info('同步数据到consul结束 ！！！')
+        try:
+            summary = ConsulReconciler(ConsulOpt()).reconcile(desired, service_names)
+        except Exception as err:
+            logging.error(f'访问consul失败 ！！！ {err}')
+            return
+        logging.info(f'同步数据到consul结束 ！！！ {summary}')
 
-    index()
+    return index()
 
 
-def consul_sync_factory(asset_type):
-    if asset_type == 'server':
-        return get_registry_server_info()
+def mark_consul_dirty(reason: str = '') -> None:
+    """资产/服务树变化后标记consul待同步，只写一个key，不阻塞写入流程"""
+    try:
+        cache_conn().set(CONSUL_DIRTY_KEY, json.dumps(dict(reason=reason, time=time.time())))
+    except Exception as err:
+        logging.error(f'标记consul待同步失败 {err}')
 
-    elif asset_type == 'mysql':
-        return get_registry_mysql_info()
 
-    elif asset_type == 'redis':
-        return get_registry_redis_info()
+def sync_consul_changes():
+    """有变化时才同步，同步开始前清除标记，同步期间的新变化留到下一轮"""
+    redis_conn = cache_conn()
+    dirty = redis_conn.get(CONSUL_DIRTY_KEY)
+    if not dirty:
+        return
+    redis_conn.delete(CONSUL_DIRTY_KEY)
+    logging.info(f'资产变化触发consul同步 {convert(dirty)}')
+    # 其他进程正在同步时未拿到锁，重新标记
+    if sync_consul() is False:
+        redis_conn.set(CONSUL_DIRTY_KEY, dirty)
+
+
+def get_register_hash(register_data: tuple) -> str:
+    return hashlib.md5(json.dumps(register_data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
-    elif asset_type == 'domain':
-        return get_registry_domain_info()
-    else:
-        return None
+
+def get_consul_sync_summary() -> dict:
+    """最近一次consul同步的差异统计"""
+    summary = cache_conn().get(CONSUL_SUMMARY_KEY)
+    return dict(code=0, msg='获取成功', data=json.loads(convert(summary)) if summary else {})
 
 
 class ConsulOpt(object):
@@ -115,6 +148,10 @@ class ConsulOpt(object):
         # 健康检查ip端口，检查时间：5,超时时间：30，注销时间：300s
         # check = consul.Check().tcp(host, port, "5s", "30s", "300s")
 
+    def get_agent_services(self) -> dict:
+        """当前agent上注册的全部服务 service_id -> 服务信息，一次请求"""
+        return self._consul.agent.services()
+
     def deregister_service(self, service_id):
         self._consul.agent.service.deregister(service_id=service_id)
 
@@ -181,31 +218,91 @@ class ConsulOpt(object):
         return {'code': 0, 'msg': '成功', 'data': instances, 'count': len(instances)}
 
 
-def get_registry_server_info():
-    redis_conn = cache_conn()
-    asset_type = 'server'
-    port = 9100
-    __model = asset_mapping[asset_type]
-    with DBContext('r') as session:
-        __info = session.query(TreeAssetModels, __model.instance_id, __model.name,
-                               __model.inner_ip).outerjoin(__model, __model.id == TreeAssetModels.asset_id).filter(
-            TreeAssetModels.asset_type == asset_type).all()
-
-    biz_info_str = redis_conn.get("BIZ_INFO_STR")
-    biz_info_map = convert(biz_info_str) if biz_info_str else {}
-    if isinstance(biz_info_map, str): biz_info_map = json.loads(biz_info_map)
-    for i in __info:
-        data = model_to_dict(i[0])
-        if not i[3]:
-            continue
-        inner_ip = i[3]
-        biz_id = data['biz_id']
-        node_meta = dict(biz_id=biz_id, biz_cn_name=biz_info_map.get(biz_id, biz_id), env_name=data['env_name'],
-                         region_name=data['region_name'], module_name=data['module_name'])
-        server_name = f"{asset_type}-exporter"
-        register_data = (server_name, f"{server_name}-{biz_id}-{inner_ip}-{port}", inner_ip, port,
-                         [data['biz_id']], node_meta)
-        yield register_data
+class ConsulReconciler:
+    """
+    按差异同步consul
+    1. 记录每个service_id最近一次下发的注册数据指纹，指纹未变化且consul中仍存在的服务不再注册
+    2. 只注册新增/变化的服务，注销consul中多余的服务，请求并发数受限
+    """
+
+    def __init__(self, consul_opt: ConsulOpt, concurrency: int = CONSUL_SYNC_CONCURRENCY):
+        self.consul_opt = consul_opt
+        self.concurrency = concurrency
+
+    def register(self, register_data: tuple, registered: Optional[dict]) -> None:
+        """注册服务，已存在的服务保留其他来源写入的 meta"""
+        name, service_id, host, port, tags, meta = register_data
+        current_meta = dict((registered or {}).get('Meta') or {})
+        current_meta.update(meta)
+        self.consul_opt.register_service(name, service_id, host, port, tags, current_meta)
+
+    def run(self, tasks: list) -> Tuple[list, int]:
+        """并发执行注册/注销，返回成功的任务和失败数"""
+        done, failed = [], 0
+        if not tasks:
+            return done, failed
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(func, *args): task for task, func, args in tasks}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    done.append(futures[future])
+                except Exception as err:
+                    failed += 1
+                    logging.error(f'consul {futures[future][0]} {futures[future][1]} 失败 {err}')
+        return done, failed
+
+    def reconcile(self, desired: Dict[str, tuple], service_names: set) -> dict:
+        """
+        :param desired: service_id -> 注册数据
+        :param service_names: 参与对账的服务名，只注销这些服务下多余的实例
+        """
+        start = time.time()
+        redis_conn = cache_conn()
+        registered = {service_id: info for service_id, info in self.consul_opt.get_agent_services().items()
+                      if info.get('Service') in service_names}
+        state = {convert(k): convert(v) for k, v in redis_conn.hgetall(CONSUL_STATE_KEY).items()}
+
+        tasks, unchanged = [], 0
+        for service_id, register_data in desired.items():
+            fingerprint = get_register_hash(register_data)
+            if service_id in registered and state.get(service_id) == fingerprint:
+                unchanged += 1
+                continue
+            action = 'update' if service_id in registered else 'add'
+            tasks.append(((action, service_id, fingerprint), self.register,
+                          (register_data, registered.get(service_id))))
+        for service_id in registered:
+            if service_id not in desired:
+                tasks.append((('remove', service_id, None), self.consul_opt.deregister_service, (service_id,)))
+
+        done, failed = self.run(tasks)
+        counts = dict(add=0, update=0, remove=0)
+        applied = {}
+        for action, service_id, fingerprint in done:
+            counts[action] += 1
+            if fingerprint:
+                applied[service_id] = fingerprint
+
+        # 失败的不记录指纹，下一轮重试；已不在期望状态中的指纹清理掉
+        prefixes = tuple(f'{name}-' for name in service_names)
+        stale = [service_id for service_id in state if service_id not in desired and service_id.startswith(prefixes)]
+        applied_items = list(applied.items())
+        pipe = redis_conn.pipeline()
+        for i in range(0, len(applied_items), CONSUL_STATE_CHUNK_SIZE):
+            pipe.hset(CONSUL_STATE_KEY, mapping=dict(applied_items[i:i + CONSUL_STATE_CHUNK_SIZE]))
+        for i in range(0, len(stale), CONSUL_STATE_CHUNK_SIZE):
+            pipe.hdel(CONSUL_STATE_KEY, *stale[i:i + CONSUL_STATE_CHUNK_SIZE])
+        summary = dict(desired=len(desired), added=counts['add'], updated=counts['update'], removed=counts['remove'],
+                       unchanged=unchanged, failed=failed, elapsed=round(time.time() - start, 2),
+                       sync_time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        pipe.set(CONSUL_SUMMARY_KEY, json.dumps(summary))
+        pipe.execute()
+        return summary
+
+
+def extract_column_address(value: str, port: int) -> tuple:
+    return value, port
 
 
 def get_items_ip(db_address, port) -> tuple:
@@ -219,85 +316,110 @@ def get_items_ip(db_address, port) -> tuple:
     return inner_ip, port
 
 
-def get_registry_mysql_info():
-    redis_conn = cache_conn()
-    asset_type = 'mysql'
-    __model = asset_mapping[asset_type]
-    with DBContext('r') as session:
-        __info = session.query(TreeAssetModels, __model.instance_id, __model.name,
-                               __model.db_address).outerjoin(__model, __model.id == TreeAssetModels.asset_id).filter(
-            TreeAssetModels.asset_type == asset_type).all()
-
-    biz_info_str = redis_conn.get("BIZ_INFO_STR")
-    biz_info_map = convert(biz_info_str) if biz_info_str else {}
-    if isinstance(biz_info_map, str): biz_info_map = json.loads(biz_info_map)
+# 地址提取方式 column: 字段值即IP，items: JSON地址列表 {"items": [{"type": "private", "ip": "", "port": ""}]}
+consul_address_extractors = {
+    'column': extract_column_address,
+    'items': get_items_ip,
+}
+
+# 关联服务树的exporter类型，address: 地址提取方式，field: 地址字段，port: 默认端口
+DEFAULT_CONSUL_EXPORTERS = {
+    'server': dict(address='column', field='inner_ip', port=9100),
+    'mysql': dict(address='items', field='db_address', port=3306),
+    'redis': dict(address='items', field='instance_address', port=6379),
+}
+
+
+def get_consul_exporters() -> Dict[str, dict]:
+    """
+    内置类型 + 配置项 consul_exporters 扩展/覆盖，新增类型只需要配置，例如
+    {"mongodb": {"address": "items", "field": "db_address", "port": 27017},
+     "lb": {"address": "column", "field": "lb_vip", "port": 9100}}
+    """
+    exporters = {asset_type: dict(conf) for asset_type, conf in DEFAULT_CONSUL_EXPORTERS.items()}
+    extra = configs.get('consul_exporters') or {}
+    if isinstance(extra, str):
+        try:
+            extra = json.loads(extra)
+        except ValueError as err:
+            logging.error(f'consul_exporters 配置格式错误 {err}')
+            extra = {}
 
-    for i in __info:
-        data = model_to_dict(i[0])
-        biz_id = data['biz_id']
-        if not i[3]:
+    for asset_type, conf in extra.items():
+        if not isinstance(conf, dict):
             continue
-        inner_ip, port = get_items_ip(i[3], 3306)
+        conf = {**exporters.get(asset_type, {}), **conf}
+        model = asset_mapping.get(asset_type)
+        if model is None or asset_type == 'domain' or conf.get('address') not in consul_address_extractors \
+                or not hasattr(model, conf.get('field') or ''):
+            logging.error(f'consul_exporters 配置错误 {asset_type} {conf}')
+            continue
+        exporters[asset_type] = conf
+    return exporters
 
-        node_meta = dict(biz_id=biz_id, biz_cn_name=biz_info_map.get(biz_id, biz_id), env_name=data['env_name'],
-                         region_name=data['region_name'], module_name=data['module_name'])
-        server_name = f"{asset_type}-exporter"
-        register_data = (server_name, f"{server_name}-{biz_id}-{inner_ip}-{port}", inner_ip, port, [biz_id], node_meta)
-        yield register_data
 
+CONSUL_ASSET_TYPES = [*get_consul_exporters(), 'domain']
 
-def get_registry_redis_info():
-    redis_conn = cache_conn()
-    asset_type = 'redis'
-    __model = asset_mapping[asset_type]
-    with DBContext('r') as session:
-        __info = session.query(TreeAssetModels, __model.instance_id, __model.name,
-                               __model.instance_address).outerjoin(__model,
-                                                                   __model.id == TreeAssetModels.asset_id).filter(
-            TreeAssetModels.asset_type == asset_type).all()
 
-    biz_info_str = redis_conn.get("BIZ_INFO_STR")
+def get_biz_info_map() -> dict:
+    """业务ID -> 业务名称，每轮同步只解析一次"""
+    biz_info_str = cache_conn().get("BIZ_INFO_STR")
     biz_info_map = convert(biz_info_str) if biz_info_str else {}
-    if isinstance(biz_info_map, str): biz_info_map = json.loads(biz_info_map)
+    if isinstance(biz_info_map, str):
+        biz_info_map = json.loads(biz_info_map)
+    return biz_info_map
 
-    for i in __info:
-        data = model_to_dict(i[0])
-        biz_id = data['biz_id']
-        if not i[3]:
-            logging.error(f"{asset_type} {data} {i[1]} {i[2]} err")
-            continue
-        inner_ip, port = get_items_ip(i[3], 6379)
-        node_meta = dict(biz_id=biz_id, biz_cn_name=biz_info_map.get(biz_id, biz_id), env_name=data['env_name'],
-                         region_name=data['region_name'], module_name=data['module_name'])
-        server_name = f"{asset_type}-exporter"
-        register_data = (server_name, f"{server_name}-{biz_id}-{inner_ip}-{port}", inner_ip, port, [biz_id], node_meta)
-        yield register_data
+
+def get_registry_targets(exporters: Dict[str, dict], biz_info_map: dict) -> Generator[tuple, None, None]:
+    """
+    一条SQL生成全部关联服务树的exporter注册数据
+    服务树按资产类型分别左连接各资产表，只查询需要的字段，流式读取
+    """
+    asset_types = list(exporters)
+    models = {asset_type: aliased(asset_mapping[asset_type]) for asset_type in asset_types}
+    with DBContext('r') as session:
+        query = session.query(
+            TreeAssetModels.asset_type, TreeAssetModels.biz_id, TreeAssetModels.env_name,
+            TreeAssetModels.region_name, TreeAssetModels.module_name,
+            *[getattr(models[asset_type], exporters[asset_type]['field']) for asset_type in asset_types]
+        ).select_from(TreeAssetModels)
+        for asset_type in asset_types:
+            model = models[asset_type]
+            query = query.outerjoin(model, and_(TreeAssetModels.asset_type == asset_type,
+                                                model.id == TreeAssetModels.asset_id))
+        query = query.filter(TreeAssetModels.asset_type.in_(asset_types)).yield_per(CONSUL_YIELD_SIZE)
+
+        for row in query:
+            asset_type, biz_id, env_name, region_name, module_name = row[:5]
+            conf = exporters[asset_type]
+            address = row[5 + asset_types.index(asset_type)]
+            if not address:
+                continue
+            try:
+                inner_ip, port = consul_address_extractors[conf['address']](address, conf['port'])
+            except (KeyError, TypeError, AttributeError) as err:
+                logging.error(f"{asset_type} {biz_id} 地址解析失败 {address} {err}")
+                continue
+            node_meta = dict(biz_id=biz_id, biz_cn_name=biz_info_map.get(biz_id, biz_id), env_name=env_name,
+                             region_name=region_name, module_name=module_name)
+            server_name = f"{asset_type}-exporter"
+            yield server_name, f"{server_name}-{biz_id}-{inner_ip}-{port}", inner_ip, port, [biz_id], node_meta
 
 
-def get_registry_domain_info():
+def get_registry_domain_info(biz_info_map: dict) -> Generator[tuple, None, None]:
     # 暂时没有和服务树关联
-    redis_conn = cache_conn()
     asset_type = 'domain'
     __model = asset_mapping[asset_type]
+    biz_id = "504"
+    server_name = f"{asset_type}-exporter"
     with DBContext('r') as session:
-        __info = session.query(__model).all()
-
-    biz_info_str = redis_conn.get("BIZ_INFO_STR")
-    biz_info_map = convert(biz_info_str) if biz_info_str else {}
-    if isinstance(biz_info_map, str):
-        biz_info_map = json.loads(biz_info_map)
-
-    for i in __info:
-        data = model_to_dict(i)
-        biz_id = "504"
-        inner_ip, port = f"{data.get('domain_rr')}.{data.get('domain_name')}", 443
-        node_meta = dict(biz_id=biz_id, biz_cn_name=biz_info_map.get(biz_id, biz_id), env_name='prod',
-                         domain_type=data.get('domain_type'))
-        server_name = f"{asset_type}-exporter"
-        register_data = (
-            server_name, f"{server_name}-{biz_id}-{data.get('record_id')}-{inner_ip}", inner_ip, port, [biz_id],
-            node_meta)
-        yield register_data
+        query = session.query(__model.record_id, __model.domain_rr, __model.domain_name,
+                              __model.domain_type).yield_per(CONSUL_YIELD_SIZE)
+        for record_id, domain_rr, domain_name, domain_type in query:
+            inner_ip, port = f"{domain_rr}.{domain_name}", 443
+            node_meta = dict(biz_id=biz_id, biz_cn_name=biz_info_map.get(biz_id, biz_id), env_name='prod',
+                             domain_type=domain_type)
+            yield server_name, f"{server_name}-{biz_id}-{record_id}-{inner_ip}", inner_ip, port, [biz_id], node_meta
 
 
 def async_consul_info():
@@ -305,5 +427,10 @@ def async_consul_info():
     executor.submit(sync_consul)
 
 
+def async_consul_changes():
+    executor = global_executors.general_executor
+    executor.submit(sync_consul_changes)
+
+
 if __name__ == '__main__':
     pass
@@ -12,6 +12,7 @@ from typing import *
 from google.oauth2 import service_account
 from google.cloud import compute_v1
 
+from libs.rate_limit import rate_limiter
 from models.models_utils import server_task, mark_expired, mark_expired_by_sync, server_task_batch
 
 
@@ -64,12 +65,17 @@ class GCPECS:
         # Use the `max_results` parameter to limit the number of results that the API returns per response page.
         request.max_results = self.page_size
 
-        agg_list = instance_client.aggregated_list(request=request)
-
+        # 按page_token逐页请求，每页都走限流；直接迭代pager时后续页会绕过限流懒加载
         ecs_list = []
-        for zone, response in agg_list:
-            if response.instances:
-                ecs_list.extend(map(self.format_data, response.instances))
+        while True:
+            page = rate_limiter.call(self.cloud_name, self._account_id, 'AggregatedListInstances',
+                                     instance_client.aggregated_list, request=request)
+            for zone, response in page.items.items():
+                if response.instances:
+                    ecs_list.extend(map(self.format_data, response.instances))
+            if not page.next_page_token:
+                break
+            request.page_token = page.next_page_token
 
         return ecs_list
 
@@ -134,7 +140,8 @@ class GCPECS:
             machine_type_request.machine_type = machine_type
 
             # 获取machine_type的详细信息
-            machine_type_info = self.machine_type_client.get(request=machine_type_request)
+            machine_type_info = rate_limiter.call(self.cloud_name, self._account_id, 'GetMachineType',
+                                                  self.machine_type_client.get, request=machine_type_request)
 
             res['instance_id'] = str(data.id)
             res['vpc_id'] = vpc_id
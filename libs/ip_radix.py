@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# @Date: 2026/10/18
+# @Description: IP地址基数树，按字节分层(256叉)，支持精确查询和网段包含查询
+
+import ipaddress
+from typing import Any, Dict, List, Optional, Union
+
+_VALUES = "_v"  # 叶子节点上保存值的key
+
+
+def parse_ip(value: str) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    try:
+        return ipaddress.ip_address(value.strip())
+    except (ValueError, AttributeError):
+        return None
+
+
+class IPRadixTree:
+    """
+    每层一个字节，IPv4深度4、IPv6深度16
+    网段查询先按整字节下钻，剩余位在下一层按取值范围筛选子树
+    """
+
+    def __init__(self):
+        self._roots: Dict[int, dict] = {4: {}, 6: {}}
+        self.size = 0
+
+    def insert(self, ip: str, value: Any) -> bool:
+        ip_obj = parse_ip(ip)
+        if not ip_obj:
+            return False
+        node = self._roots[ip_obj.version]
+        for byte in ip_obj.packed:
+            node = node.setdefault(byte, {})
+        node.setdefault(_VALUES, []).append(value)
+        self.size += 1
+        return True
+
+    def exact(self, ip: str) -> List[Any]:
+        ip_obj = parse_ip(ip)
+        if not ip_obj:
+            return []
+        node = self._roots[ip_obj.version]
+        for byte in ip_obj.packed:
+            node = node.get(byte)
+            if node is None:
+                return []
+        return list(node.get(_VALUES, []))
+
+    def in_network(self, cidr: str) -> List[Any]:
+        """网段内的所有值"""
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+        packed = network.network_address.packed
+        full_bytes, rest_bits = divmod(network.prefixlen, 8)
+
+        node = self._roots[network.version]
+        for byte in packed[:full_bytes]:
+            node = node.get(byte)
+            if node is None:
+                return []
+
+        if rest_bits and full_bytes < len(packed):
+            start = packed[full_bytes]
+            end = start + (1 << (8 - rest_bits)) - 1
+            stack = [child for byte, child in node.items() if byte != _VALUES and start <= byte <= end]
+        else:
+            stack = [node]
+
+        values = []
+        while stack:
+            current = stack.pop()
+            for key, child in current.items():
+                if key == _VALUES:
+                    values.extend(child)
+                else:
+                    stack.append(child)
+        return values
+
+
+if __name__ == '__main__':
+    pass
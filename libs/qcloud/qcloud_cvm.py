@@ -11,7 +11,9 @@ import logging
 from typing import *
 from tencentcloud.common import credential
 from tencentcloud.cvm.v20170312 import cvm_client, models
-from models.models_utils import server_task, mark_expired, mark_expired_by_sync,  server_task_batch
+from libs.rate_limit import rate_limiter
+from models.models_utils import server_task, mark_expired, mark_expired_by_sync,  server_task_batch, \
+    stream_upsert_task
 
 
 def get_run_type(val):
@@ -49,30 +51,26 @@ class QCloudCVM:
         # self.q_network_obj = QCloudNetwork(region=self._region, access_id=access_id, access_key=access_key,
         #                                    account_id=self._account_id)
 
-    def get_all_cvm(self):
-
-        cvm_list = []
-        limit = self._limit
+    def get_all_cvm(self) -> Generator[List[dict], None, None]:
+        """
+        分页获取CVM，每次返回一页，请求异常直接抛出
+        """
         offset = self._offset
         req = models.DescribeInstancesRequest()
-        try:
-            while True:
-                params = {
-                    "Offset": offset,
-                    "Limit": limit
-                }
-                req.from_json_string(json.dumps(params))
-                resp = self.client.DescribeInstances(req)
-                if not resp.InstanceSet:
-                    break
-                cvm_list.extend(map(self.format_data, resp.InstanceSet))
-                offset += self._limit
-                if resp.TotalCount < self._limit:
-                    break
-            return cvm_list
-        except Exception as err:
-            logging.error(f"腾讯云CVM  get all cvm {self._account_id} {err}")
-            return []
+        while True:
+            params = {
+                "Offset": offset,
+                "Limit": self._limit
+            }
+            req.from_json_string(json.dumps(params))
+            resp = rate_limiter.call(self.cloud_name, self._account_id, 'DescribeInstances',
+                                     self.client.DescribeInstances, req)
+            if not resp.InstanceSet:
+                break
+            yield list(map(self.format_data, resp.InstanceSet))
+            offset += self._limit
+            if offset >= resp.TotalCount:
+                break
 
     @staticmethod
     def get_os_type(os_name):
@@ -180,17 +178,8 @@ class QCloudCVM:
         资产信息更新到DB
         :return:
         """
-        all_cvm_list: List[dict] = self.get_all_cvm()
-        if not all_cvm_list: return False, "CVM列表为空"
-        # 更新资源
-        ret_state, ret_msg = server_task_batch(account_id=self._account_id, cloud_name=cloud_name, rows=all_cvm_list)
-        # 标记过期
-        # mark_expired(resource_type=resource_type, account_id=self._account_id)
-        instance_ids = [cvm['instance_id'] for cvm in all_cvm_list]
-        mark_expired_by_sync(cloud_name=cloud_name, account_id=self._account_id, resource_type=resource_type,
-                             instance_ids=instance_ids, region=self._region)
-
-        return ret_state, ret_msg
+        return stream_upsert_task(resource_type, 'CVM', cloud_name, self._account_id, self.get_all_cvm(),
+                                  region=self._region)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# @Date: 2026/10/18
+# @Description: 云厂商API限流器，按(云厂商, 账号, API)令牌桶限速，限流错误自动退避重试
+
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# 各云厂商默认速率：(每秒请求数, 突发容量)
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "aliyun": (10, 20),
+    "qcloud": (10, 20),
+    "aws": (10, 20),
+    "volc": (5, 10),
+    "gcp": (10, 20),
+}
+FALLBACK_RATE_LIMIT = (5, 10)
+# 单独限速的API：(云厂商, API) -> (每秒请求数, 突发容量)
+API_RATE_LIMITS: Dict[Tuple[str, str], Tuple[float, int]] = {
+    ("aws", "LookupEvents"): (2, 2),
+}
+
+# 各云厂商限流错误码
+THROTTLE_CODES: Dict[str, set] = {
+    "aliyun": {"Throttling", "Throttling.User", "Throttling.Api", "Throttling.Resource", "ServiceUnavailable"},
+    "qcloud": {"RequestLimitExceeded", "RequestLimitExceeded.UinLimitExceeded",
+               "RequestLimitExceeded.GlobalRegionUinLimitExceeded", "RequestLimitExceeded.IPLimitExceeded"},
+    "aws": {"Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException"},
+    "volc": {"429", "FlowLimitExceeded", "AccountFlowLimitExceeded", "RequestLimitExceeded"},
+    "gcp": {"429", "rateLimitExceeded", "RESOURCE_EXHAUSTED"},
+}
+
+MAX_RETRIES = 3  # 限流后最大重试次数
+BACKOFF_BASE = 0.5  # 退避基数(秒)
+BACKOFF_MAX = 10  # 单次退避上限(秒)
+
+
+class TokenBucket:
+    """令牌桶，被限流时速率减半，成功后逐步恢复到初始速率"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self) -> float:
+        """获取一个令牌，返回等待时长"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self.rate = max(self.base_rate / 8, self.rate / 2)
+            self._tokens = 0
+
+    def recover(self) -> None:
+        with self._lock:
+            if self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate * 1.1)
+
+
+def get_error_code(err: Exception) -> str:
+    """兼容各云厂商SDK异常，提取错误码"""
+    for method in ("get_error_code", "get_code"):
+        if callable(getattr(err, method, None)):
+            return str(getattr(err, method)())
+    response = getattr(err, "response", None)
+    if isinstance(response, dict):
+        return str(response.get("Error", {}).get("Code", ""))
+    # 火山云ApiException / 谷歌云api_core异常
+    # 谷歌云的code为HTTPStatus，先转为int，否则Python3.9下为 "HTTPStatus.TOO_MANY_REQUESTS"
+    for attr in ("code", "status"):
+        code = getattr(err, attr, None)
+        if code is not None:
+            return str(int(code)) if isinstance(code, int) else str(code)
+    return ""
+
+
+class RateLimiter:
+    """全局API限流器"""
+
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str, str], TokenBucket] = {}
+        self._stats: Dict[Tuple[str, str, str], Dict[str, float]] = defaultdict(
+            lambda: dict(calls=0, throttled=0, retried=0, failed=0, wait_seconds=0.0))
+        self._lock = threading.Lock()
+
+    def get_bucket(self, cloud_name: str, account_id: str, api: str) -> TokenBucket:
+        key = (cloud_name, account_id, api)
+        with self._lock:
+            if key not in self._buckets:
+                limit = API_RATE_LIMITS.get((cloud_name, api))
+                if not limit:
+                    limit = DEFAULT_RATE_LIMITS.get(cloud_name, FALLBACK_RATE_LIMIT)
+                self._buckets[key] = TokenBucket(*limit)
+            return self._buckets[key]
+
+    def is_throttled(self, cloud_name: str, err: Exception) -> bool:
+        code = get_error_code(err)
+        return bool(code) and code in THROTTLE_CODES.get(cloud_name, set())
+
+    def _incr(self, key: Tuple[str, str, str], field: str, value: float = 1) -> None:
+        with self._lock:
+            self._stats[key][field] += value
+
+    def call(self, cloud_name: str, account_id: Optional[str], api: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        限速调用云厂商API，限流错误按指数退避+随机抖动重试，其他异常直接抛出
+        :param cloud_name: 云厂商
+        :param account_id: 账号ID
+        :param api: API名称
+        :param func: 实际调用的SDK方法
+        """
+        key = (cloud_name, account_id or "", api)
+        bucket = self.get_bucket(*key)
+        for attempt in range(MAX_RETRIES + 1):
+            self._incr(key, "wait_seconds", bucket.acquire())
+            self._incr(key, "calls")
+            try:
+                result = func(*args, **kwargs)
+                bucket.recover()
+                return result
+            except Exception as err:
+                if not self.is_throttled(cloud_name, err):
+                    self._incr(key, "failed")
+                    raise
+                self._incr(key, "throttled")
+                bucket.slow_down()
+                if attempt >= MAX_RETRIES:
+                    self._incr(key, "failed")
+                    raise
+                backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                logging.warning(f"{cloud_name}-{account_id}-{api} 被限流，{backoff:.2f}s后第{attempt + 1}次重试: {err}")
+                self._incr(key, "retried")
+                time.sleep(backoff)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """各API调用/限流/重试计数"""
+        with self._lock:
+            return {
+                ":".join(key): dict(value, rate=round(self._buckets[key].rate, 2))
+                for key, value in self._stats.items() if key in self._buckets
+            }
+
+
+rate_limiter = RateLimiter()
+
+
+if __name__ == '__main__':
+    pass
@@ -21,6 +21,7 @@ from models.agent import AgentModels
 from models.asset import AgentBindStatus, AssetServerModels
 from services.asset_server_service import get_unique_servers
 from services.cloud_region_service import get_servers_by_cloud_region_id
+from services.ip_index_service import split_ips
 from settings import settings
 
 if configs.can_import:
@@ -105,7 +106,7 @@ def find_matched_server(agent: AgentModels, unique_servers: Dict[str, AssetServe
     # 查找云区域关联的云主机, 且云主机没有设置主agent，已绑定主agent的云主机不再绑定
     servers = get_servers_by_cloud_region_id(agent.proxy_id)
     for server in servers:
-        if server.inner_ip == agent.ip and server.state == "运行中" and not server.has_main_agent:
+        if agent.ip in split_ips(server.inner_ip) and server.state == "运行中" and not server.has_main_agent:
             return server
 
     # 若 servers 没匹配到，则在 unique_servers 里找
@@ -9,14 +9,15 @@ Desc    : 同步数据专用
 """
 
 import datetime
+import ipaddress
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import *
 from typing import List
 
 from shortuuid import uuid
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from websdk2.api_set import api_set
 from websdk2.cache_context import cache_conn
 from websdk2.client import AcsClient
@@ -25,7 +26,7 @@ from websdk2.configs import configs
 ##
 from websdk2.db_context import DBContextV2 as DBContext
 from websdk2.model_utils import insert_or_update
-from websdk2.tools import RedisLock
+from websdk2.tools import RedisLock, convert
 
 from libs.api_gateway.jumpserver.asset import jms_asset_api
 from libs.api_gateway.jumpserver.asset_accounts import (
@@ -37,17 +38,23 @@ from libs.api_gateway.jumpserver.org import jms_org_api
 from libs.api_gateway.jumpserver.user import jms_user_api
 from libs.api_gateway.jumpserver.user_group import jms_user_group_api
 from libs.thread_pool import global_executors
+from libs.agent_registry import agent_registry
 
 from models.asset import AssetServerModels, AssetVSwitchModels
 from models.business import BizModels, PermissionGroupModels
+from models.tree import TreeAssetModels
 from models.cloud import SyncLogModels
 from models.cloud_region import CloudRegionModels
 from services.cloud_region_service import (
     update_server_agent_id_by_cloud_region_rules,
 )
 from services.perm_group_service import preview_perm_group_for_api
-from services.tree_asset_service import get_tree_assets
 from services.tree_service import get_tree_by_api
+from services.tree_count_service import reconcile_tree_counts
+from services.search_index_service import rebuild_search_index
+from services.ip_index_service import rebuild_ip_index, split_ips
+from services.dynamic_group_service import update_dynamic_group_members_by_agents, rebuild_dynamic_group_members
+from libs.consul_registry import mark_consul_dirty
 from settings import settings
 
 if configs.can_import:
@@ -116,7 +123,11 @@ def biz_sync():
 
             biz_info_map = json.dumps(biz_info_map)
             redis_conn = cache_conn()
+            old_biz_info = redis_conn.get("BIZ_INFO_STR")
             redis_conn.set("BIZ_INFO_STR", biz_info_map)
+            # 业务名称写在exporter的meta中
+            if convert(old_biz_info or '') != biz_info_map:
+                mark_consul_dirty("biz")
 
         except Exception as err:
             logging.error(f"同步业务信息到配置平台出错 2 {err}")
@@ -127,46 +138,108 @@ def biz_sync():
     index()
 
 
+AGENT_ONLINE_SET_KEY = "cmdb:agent_online_set"  # 上一轮在线的agent_id集合
+AGENT_STATUS_CHANNEL = "cmdb:agent_status_events"  # agent上下线事件
+AGENT_STATUS_FULL_CYCLES = 20  # 每隔多少轮做一次全量对账，覆盖期间新绑定的主机
+AGENT_STATUS_CHUNK_SIZE = 1000
+
+
+def get_agent_status_filter(agent_status: str):
+    """上线只匹配离线/空状态的行，离线只匹配在线的行"""
+    if agent_status == "1":
+        return or_(AssetServerModels.agent_status != "1", AssetServerModels.agent_status.is_(None))
+    return AssetServerModels.agent_status == "1"
+
+
+def get_unsynced_online_agents(session, online: Set[str]) -> Set[str]:
+    """在线Agent中绑定主机状态不是在线的，如新绑定到已在线Agent的主机"""
+    status_filter = get_agent_status_filter("1")
+    online = list(online)
+    unsynced = set()
+    for i in range(0, len(online), AGENT_STATUS_CHUNK_SIZE):
+        unsynced.update(agent_id for agent_id, in session.query(AssetServerModels.agent_id).filter(
+            AssetServerModels.agent_id.in_(online[i:i + AGENT_STATUS_CHUNK_SIZE]), status_filter
+        ).distinct())
+    return unsynced
+
+
+def update_agent_status(session, agent_ids: Iterable[str], agent_status: str) -> int:
+    """按agent_id集合更新状态，上线更新离线/空状态的行，离线只更新在线的行"""
+    status_filter = get_agent_status_filter(agent_status)
+    count = 0
+    agent_ids = list(agent_ids)
+    for i in range(0, len(agent_ids), AGENT_STATUS_CHUNK_SIZE):
+        count += session.query(AssetServerModels).filter(
+            AssetServerModels.agent_id.in_(agent_ids[i:i + AGENT_STATUS_CHUNK_SIZE]), status_filter
+        ).update({AssetServerModels.agent_status: agent_status}, synchronize_session=False)
+    return count
+
+
+def publish_agent_transitions(redis_conn, came_online: Set[str], went_offline: Set[str]) -> None:
+    """发布agent上下线事件，下游订阅即可，无需轮询"""
+    if not came_online and not went_offline:
+        return
+    event_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    pipe = redis_conn.pipeline()
+    for status, agent_ids in (("online", came_online), ("offline", went_offline)):
+        for agent_id in agent_ids:
+            pipe.publish(AGENT_STATUS_CHANNEL, json.dumps(dict(agent_id=agent_id, status=status, time=event_time)))
+    pipe.execute()
+
+
+def save_agent_online_set(redis_conn, online: Set[str]) -> None:
+    """写入临时key后rename，保证读到的总是完整集合"""
+    tmp_key = f"{AGENT_ONLINE_SET_KEY}:tmp"
+    pipe = redis_conn.pipeline()
+    pipe.delete(tmp_key)
+    online = list(online)
+    for i in range(0, len(online), AGENT_STATUS_CHUNK_SIZE):
+        pipe.sadd(tmp_key, *online[i:i + AGENT_STATUS_CHUNK_SIZE])
+    if online:
+        pipe.rename(tmp_key, AGENT_ONLINE_SET_KEY)
+    else:
+        pipe.delete(AGENT_ONLINE_SET_KEY)
+    pipe.incr(f"{AGENT_ONLINE_SET_KEY}:cycles")
+    pipe.execute()
+
+
 def sync_agent_status():
     @deco(RedisLock("async_agent_status_redis_lock_key"),  release=True)
     def index():
         logging.info("开始同步agent状态到配置平台")
-        # 实例化client
-        client = AcsClient()
-        get_agent_list = dict(
-            method="GET",
-            url="/api/agent/v1/agent/info",
-            description="获取Agent List",
-        )
-        res = client.do_action_v2(**get_agent_list)
-        if res.status_code != 200:
+        # 强制刷新Agent缓存，主机写入同时复用
+        data = agent_registry.refresh()
+        if data is None:
             return
-        data = res.json()
-        agent_list = data.keys()
-        the_model = AssetServerModels
-        with DBContext("w", None, True) as session:
-            __info = session.query(
-                the_model.id, the_model.agent_id, the_model.agent_status
-            ).all()
-            all_info = [
-                dict(id=asset_id, agent_status="2")
-                if agent_status == "1" and agent_id not in agent_list
-                else dict(id=asset_id, agent_status="1")
-                if (agent_status == "2" or not agent_status)
-                and agent_id in agent_list
-                else None
-                for asset_id, agent_id, agent_status in __info
-            ]
-
-            all_info = list(filter(None, all_info))
+        online = set(data.keys())
+        redis_conn = cache_conn()
+        prev_online = {convert(i) for i in redis_conn.smembers(AGENT_ONLINE_SET_KEY)}
+        cycles = int(convert(redis_conn.get(f"{AGENT_ONLINE_SET_KEY}:cycles") or 0))
+        came_online, went_offline = online - prev_online, prev_online - online
 
-            for info in all_info:
-                logging.info(
-                    f"{info['id']} 改为{'在线' if info['agent_status'] == '1' else '离线'} "
-                )
+        with DBContext("w", None, True) as session:
+            # 在线集合未变化的Agent也可能有状态不一致的主机(如新绑定到已在线Agent)，每轮一并修正
+            unsynced_online = get_unsynced_online_agents(session, online - came_online)
+            changed_agents = came_online | went_offline | unsynced_online
+            online_count = update_agent_status(session, came_online | unsynced_online, "1")
+            if not prev_online or cycles % AGENT_STATUS_FULL_CYCLES == 0:
+                # 全量对账：当前为在线但不在集合中的置为离线
+                stale_online = {
+                    agent_id for agent_id, in session.query(AssetServerModels.agent_id).filter(
+                        AssetServerModels.agent_status == "1").distinct()
+                } - online
+                offline_count = update_agent_status(session, stale_online, "2")
+                changed_agents |= stale_online
+            else:
+                offline_count = update_agent_status(session, went_offline, "2")
+            session.commit()
 
-            session.bulk_update_mappings(the_model, all_info)
-        logging.info(f"同步agent状态到配置平台 结束 {datetime.datetime.now()}")
+        save_agent_online_set(redis_conn, online)
+        publish_agent_transitions(redis_conn, came_online if prev_online else set(), went_offline)
+        if online_count or offline_count:
+            update_dynamic_group_members_by_agents(changed_agents)
+        logging.info(f"同步agent状态到配置平台 结束 上线:{online_count} 离线:{offline_count} "
+                     f"{datetime.datetime.now()}")
 
     try:
         index()
@@ -195,6 +268,55 @@ def async_agent():
     executor.submit(sync_agent_status)
 
 
+def sync_tree_count():
+    @deco(RedisLock("sync_tree_count_redis_lock_key"), release=True)
+    def index():
+        reconcile_tree_counts()
+
+    try:
+        index()
+    except Exception as err:
+        logging.error(f"服务树数量缓存对账出错 {str(err)}")
+
+
+def sync_search_index():
+    @deco(RedisLock("sync_search_index_redis_lock_key"), release=True, key_timeout=1800, func_timeout=1800)
+    def index():
+        rebuild_search_index()
+        rebuild_ip_index()
+
+    try:
+        index()
+    except Exception as err:
+        logging.error(f"重建搜索/IP索引出错 {str(err)}")
+
+
+def sync_dynamic_group_members():
+    @deco(RedisLock("sync_dynamic_group_members_redis_lock_key"), release=True, key_timeout=1800, func_timeout=1800)
+    def index():
+        rebuild_dynamic_group_members()
+
+    try:
+        index()
+    except Exception as err:
+        logging.error(f"动态分组成员对账出错 {str(err)}")
+
+
+def async_dynamic_group_members():
+    executor = global_executors.general_executor
+    executor.submit(sync_dynamic_group_members)
+
+
+def async_search_index():
+    executor = global_executors.general_executor
+    executor.submit(sync_search_index)
+
+
+def async_tree_count():
+    executor = global_executors.general_executor
+    executor.submit(sync_tree_count)
+
+
 def async_biz_info():
     executor = global_executors.general_executor
     executor.submit(biz_sync)
@@ -480,141 +602,93 @@ def sync_service_tree(biz_id=None, org_id=None):
     index()
 
 
-def sync_service_tree_assets(biz_id=None, org_id=None):
-    # 同步服务树主机资产
+JMS_SYNC_CONCURRENCY = 8  # 同时向JumpServer创建资产的请求数
+JMS_DOMAIN_NETWORK = ipaddress.ip_network("10.0.0.0/8")  # 该网段内的主机需要指定网域
 
-    def add_full_name_to_assets(assets, org_name="/Default/"):
-        """
-        :param assets:
-        :param org_name:
-        :return:
-        """
-        # 确保 org_name 以斜杠结尾
-        if not org_name.endswith("/"):
-            org_name += "/"
-
-        # 获取所有需要的 biz_id 列表
-        biz_ids = {asset["biz_id"] for asset in assets}
 
-        # 批量查询所有业务对象
-        with DBContext("w", None, True) as session:
-            biz_objs = (
-                session.query(BizModels)
-                .filter(BizModels.biz_id.in_(biz_ids))
-                .all()
-            )
+def get_jms_tree_servers(biz_id=None) -> List[dict]:
+    """服务树主机，只查询同步堡垒机需要的字段"""
+    with DBContext("r") as session:
+        query = session.query(
+            TreeAssetModels.biz_id, BizModels.biz_cn_name, TreeAssetModels.env_name, TreeAssetModels.region_name,
+            TreeAssetModels.module_name, AssetServerModels.name, AssetServerModels.inner_ip, AssetServerModels.agent_id
+        ).join(AssetServerModels, AssetServerModels.id == TreeAssetModels.asset_id).join(
+            BizModels, BizModels.biz_id == TreeAssetModels.biz_id
+        ).filter(TreeAssetModels.asset_type == "server")
+        if biz_id:
+            query = query.filter(TreeAssetModels.biz_id == biz_id)
+        return [row._asdict() for row in query]
 
-            # 创建一个 biz_id 到 biz_cn_name 的映射
-            biz_id_to_name = {biz.biz_id: biz.biz_cn_name for biz in biz_objs}
-
-        def _add_full_name():
-            for asset in assets:
-                biz_cn_name = biz_id_to_name.get(asset["biz_id"])
-                if not biz_cn_name:
-                    continue
-                env_name = asset["env_name"]
-                region_name = asset["region_name"]
-                module_name = asset["module_name"]
-                full_name = f"{org_name}{biz_cn_name}/{env_name}/{region_name}/{module_name}"
-                asset.update(biz_cn_name=biz_cn_name, full_name=full_name)
-                yield asset
-
-        return list(_add_full_name())
-
-    def is_ip_in_subnet(ip: str, subnet: str = "10.0.0.0/8") -> bool:
-        """
-        判断ip是否在网段内
-        :param ip: ip地址
-        :param subnet: 网段
-        :return: bool
-        """
-        import ipaddress
 
-        try:
-            ip_obj = ipaddress.ip_address(ip)
-            subnet_obj = ipaddress.IPv4Network(subnet)
-            return ip_obj in subnet_obj
-        except ValueError:
-            return False
+def sync_service_tree_assets(biz_id=None, org_id=None):
+    """
+    同步服务树主机资产
+    1. 云区域、堡垒机主机和节点一次性拉取
+    2. 本地比对得到需要创建的主机
+    3. 并发创建，并发数受限
+    """
 
-    def _sync_main(asset: dict, org_name: str = "/Default/") -> None:
+    def get_cloud_regions() -> Dict[str, tuple]:
+        """云区域ID -> (网域ID, 特权账号模板ID)"""
+        with DBContext("r") as session:
+            return {
+                cloud_region_id: (jms_domain_id, jms_account_template)
+                for cloud_region_id, jms_domain_id, jms_account_template in session.query(
+                    CloudRegionModels.cloud_region_id, CloudRegionModels.jms_domain_id,
+                    CloudRegionModels.jms_account_template)
+            }
+
+    def build_host(asset: dict, org_name: str, cloud_regions: Dict[str, tuple],
+                   node_ids: Dict[str, str]) -> Optional[dict]:
         """
-        创建资产
-        :param asset:
-        :return:
+        生成待创建的主机资产，不满足条件返回None
         """
-        name = asset["name"]
-        inner_ip = asset["inner_ip"]
-        full_name = asset.get("full_name")
-        biz_cn_name = asset.get("biz_cn_name")
-        biz_id = asset.get("biz_id")
-        agent_id = asset.get("agent_id")
-        if not agent_id or (":" in agent_id and agent_id.split(":")[1] == "0"):
-            logging.debug(
-                f"资产没有划分到云区域, 业务: {biz_cn_name}, INNER_IP: {inner_ip}"
-            )
-            return
-        if not full_name:
-            return
-
-        # accounts = []
-        # 获取网域和特权账号模板ID
-        # with (DBContext('w', None, True) as session):
-        #     perm_mapping_obj = session.query(PermissionToJMS) \
-        #         .filter(PermissionToJMS.biz_id == biz_id).first()
-        #     if not perm_mapping_obj:
-        #         logging.info(f"没有配置权限分组和堡垒机账号映射, 业务: {biz_cn_name}")
-        #         return
+        name, agent_id = asset["name"], asset["agent_id"]
+        biz_cn_name = asset["biz_cn_name"]
+        # 多网卡主机取第一个合法的内网IP
+        inner_ips = split_ips(asset["inner_ip"])
+        if not inner_ips:
+            logging.debug(f"资产没有合法的内网IP, 业务: {biz_cn_name}, 主机: {name}")
+            return None
+        inner_ip = inner_ips[0]
+        if not agent_id or ":" not in agent_id or agent_id.split(":")[1] == "0":
+            logging.debug(f"资产没有划分到云区域, 业务: {biz_cn_name}, INNER_IP: {inner_ip}")
+            return None
 
         cloud_region_id = agent_id.split(":")[1]
-        with DBContext("w", None, True) as session:
-            cloud_region_obj = (
-                session.query(CloudRegionModels)
-                .filter(CloudRegionModels.cloud_region_id == cloud_region_id)
-                .first()
-            )
-            if not cloud_region_obj:
-                logging.debug(f"云区域不存在, 云区域ID: {cloud_region_id}")
-                return
+        if cloud_region_id not in cloud_regions:
+            logging.debug(f"云区域不存在, 云区域ID: {cloud_region_id}")
+            return None
+        jms_domain_id, jms_account_template_id = cloud_regions[cloud_region_id]
 
+        # 10.0.0.0/8 在这个内网网段的主机，需要指定网域
+        if ipaddress.ip_address(inner_ip) not in JMS_DOMAIN_NETWORK:
             jms_domain_id = None
-            # 10.0.0.0/8 在这个内网网段的主机，需要指定网域
-            if is_ip_in_subnet(inner_ip):
-                jms_domain_id = cloud_region_obj.jms_domain_id
-                if not jms_domain_id:
-                    logging.debug(f"没有配置网域ID, 业务: {biz_cn_name}")
-                    return
-
-            jms_account_template_id = cloud_region_obj.jms_account_template
-            if not jms_account_template_id:
-                logging.debug(f"没有配置特权账号模板ID, 业务: {biz_cn_name}")
-                return
-
-            accounts = [{"template": jms_account_template_id}]
-
-        asset_name = full_name.split(org_name)[1] + f"/{name}-{inner_ip}"
-        jms_asset_host_obj = jms_asset_host_api.get(
-            name=asset_name, address=inner_ip, org_id=org_id
+        elif not jms_domain_id:
+            logging.debug(f"没有配置网域ID, 业务: {biz_cn_name}")
+            return None
+
+        if not jms_account_template_id:
+            logging.debug(f"没有配置特权账号模板ID, 业务: {biz_cn_name}")
+            return None
+
+        full_name = f"{org_name}{biz_cn_name}/{asset['env_name']}/{asset['region_name']}/{asset['module_name']}"
+        node_id = node_ids.get(full_name)
+        if not node_id:
+            logging.debug(f"堡垒机节点不存在: {full_name}")
+            return None
+
+        return dict(
+            name=full_name.split(org_name)[1] + f"/{name}-{inner_ip}",
+            address=inner_ip,
+            nodes=[node_id],
+            domain=jms_domain_id,
+            accounts=[{"template": jms_account_template_id}],
+            org_id=org_id,
         )
-        if jms_asset_host_obj:
-            # 主机资产已存在
-            # todo 更新资产
-            logging.debug(f"资产已存在: {asset_name}")
-            return
 
-        # 查找节点，创建主机资产
-        jump_server_node_obj = jms_asset_api.get(name=full_name, org_id=org_id)
-        if jump_server_node_obj:
-            node_id = jump_server_node_obj[0]["id"]
-            jms_asset_host_obj = jms_asset_host_api.create(
-                name=asset_name,
-                address=inner_ip,
-                nodes=[node_id],
-                domain=jms_domain_id,
-                accounts=accounts,
-                org_id=org_id,
-            )
-            logging.info(f"资产创建结果:{bool(jms_asset_host_obj)}")
+    def create_host(host: dict) -> bool:
+        return bool(jms_asset_host_api.create(**host))
 
     def index():
         logging.info("开始同步服务树主机资产到JumpServer")
@@ -622,17 +696,45 @@ def sync_service_tree_assets(biz_id=None, org_id=None):
         parent_name = get_jms_parent_name_by_org_id(org_id)
         if not parent_name:
             return
+        # 确保 org_name 以斜杠结尾
+        if not parent_name.endswith("/"):
+            parent_name += "/"
+
+        jms_hosts = jms_asset_host_api.list_all(org_id=org_id)
+        jms_nodes = jms_asset_api.list_all(org_id=org_id)
+        if jms_hosts is None or jms_nodes is None:
+            # 拉取失败时不创建，避免重复资产
+            logging.error("获取JumpServer主机/节点失败，跳过本次同步")
+            return
 
-        if not biz_id:
-            assets, count = get_tree_assets(params={"page_size": 9999})
-        else:
-            assets, count = get_tree_assets(
-                params={"page_size": 9999, "biz_id": biz_id}
-            )
-        assets = add_full_name_to_assets(assets=assets, org_name=parent_name)
-        for asset in assets:
-            _sync_main(asset, org_name=parent_name)
-        logging.info("同步服务树主机资产到JumpServer结束")
+        exist_hosts = {(host.get("name"), host.get("address")) for host in jms_hosts}
+        node_ids = {node.get("full_value"): node.get("id") for node in jms_nodes}
+        cloud_regions = get_cloud_regions()
+
+        to_create, exists, skipped = {}, 0, 0
+        for asset in get_jms_tree_servers(biz_id):
+            host = build_host(asset, parent_name, cloud_regions, node_ids)
+            if not host:
+                skipped += 1
+            elif (host["name"], host["address"]) in exist_hosts:
+                logging.debug(f"资产已存在: {host['name']}")
+                exists += 1
+            else:
+                to_create[(host["name"], host["address"])] = host
+
+        created, failed = 0, 0
+        with ThreadPoolExecutor(max_workers=JMS_SYNC_CONCURRENCY) as executor:
+            futures = {executor.submit(create_host, host): key for key, host in to_create.items()}
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        created += 1
+                        continue
+                except Exception as err:
+                    logging.error(f"资产创建失败 {futures[future]} {err}")
+                failed += 1
+
+        logging.info(f"同步服务树主机资产到JumpServer结束 新建:{created} 失败:{failed} 已存在:{exists} 跳过:{skipped}")
 
     try:
         index()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# @Date: 2026/10/18
+# @Description: 云资源同步Worker，API节点只负责入队，Worker进程从Redis队列消费同步任务
+
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+import threading
+import time
+from typing import List, Optional
+
+from websdk2.cache_context import cache_conn
+from websdk2.configs import configs
+
+from settings import settings
+
+if configs.can_import:
+    configs.import_dict(**settings)
+
+SYNC_QUEUE_KEY = "cmdb:cloud_sync:queue"  # 待执行的同步任务
+SYNC_PENDING_KEY = "cmdb:cloud_sync:pending"  # 排队中的任务，用于去重
+SYNC_PROCESSING_PREFIX = "cmdb:cloud_sync:processing:"  # 每个Worker执行中的任务，执行完成后确认移除
+SYNC_HEARTBEAT_PREFIX = "cmdb:cloud_sync:heartbeat:"  # Worker存活标记，过期视为Worker已退出
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TTL = 60
+
+
+def is_queue_mode() -> bool:
+    """是否由独立Worker执行云资源同步"""
+    return str(configs.get("sync_mode", "local")).lower() == "queue"
+
+
+def get_job_key(cloud_name: str, account_id: Optional[str], resources: Optional[List[str]] = None) -> str:
+    return f"{cloud_name}:{account_id or 'all'}:{','.join(sorted(resources)) if resources else 'all'}"
+
+
+def enqueue_sync_job(cloud_name: str, account_id: Optional[str] = None, resources: Optional[List[str]] = None) -> bool:
+    """
+    同步任务入队，同一任务排队中时不重复入队
+    :return: 是否新入队
+    """
+    redis_conn = cache_conn()
+    job_key = get_job_key(cloud_name, account_id, resources)
+    if not redis_conn.sadd(SYNC_PENDING_KEY, job_key):
+        logging.info(f"同步任务已在队列中 {job_key}")
+        return False
+    job = dict(cloud_name=cloud_name, account_id=account_id, resources=resources, enqueue_time=time.time())
+    redis_conn.lpush(SYNC_QUEUE_KEY, json.dumps(job))
+    return True
+
+
+def run_sync_job(job: dict) -> None:
+    # 延迟导入，避免与handler互相引用
+    from cmdb.handlers.cloud_handler import cloud_loader
+    from libs.thread_pool import global_executors
+
+    cloud_name, account_id = job.get("cloud_name"), job.get("account_id")
+    sync_func = cloud_loader.get_sync_function(cloud_name)
+    if not sync_func:
+        logging.error(f"不支持的云厂商 {cloud_name}")
+        return
+    queued = time.time() - job.get('enqueue_time', time.time())
+    logging.info(f"开始执行同步任务 {cloud_name}-{account_id}, 排队 {queued:.2f}s")
+    sync_func(account_id=account_id, resources=job.get("resources"), executors=global_executors.cloud_executor)
+
+
+def get_worker_name(worker_id: int) -> str:
+    """主机名+序号，Worker重启后仍能找回自己的执行中列表"""
+    return f"{socket.gethostname()}:{worker_id}"
+
+
+def requeue_orphan_jobs(worker_name: str) -> int:
+    """
+    执行中的任务放回队列：本Worker上次退出时未确认的，以及心跳已过期的其他Worker的
+    :return: 放回的任务数
+    """
+    redis_conn = cache_conn()
+    count = 0
+    for processing_key in redis_conn.scan_iter(match=f"{SYNC_PROCESSING_PREFIX}*"):
+        if isinstance(processing_key, bytes):
+            processing_key = processing_key.decode()
+        owner = processing_key[len(SYNC_PROCESSING_PREFIX):]
+        if owner != worker_name and redis_conn.exists(f"{SYNC_HEARTBEAT_PREFIX}{owner}"):
+            continue
+        # 逐条原子移动，多个Worker同时启动也不会重复放回
+        while True:
+            raw = redis_conn.rpoplpush(processing_key, SYNC_QUEUE_KEY)
+            if raw is None:
+                break
+            job = json.loads(raw)
+            redis_conn.sadd(SYNC_PENDING_KEY, get_job_key(job.get("cloud_name"), job.get("account_id"),
+                                                          job.get("resources")))
+            count += 1
+    if count:
+        logging.warning(f"[Sync Worker] {worker_name} 放回未完成的同步任务 {count} 个")
+    return count
+
+
+def keep_heartbeat(worker_name: str, stopped: list) -> None:
+    redis_conn = cache_conn()
+    while not stopped:
+        try:
+            redis_conn.set(f"{SYNC_HEARTBEAT_PREFIX}{worker_name}", int(time.time()), ex=HEARTBEAT_TTL)
+        except Exception as err:
+            logging.error(f"[Sync Worker] {worker_name} 更新心跳失败: {err}")
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def worker_loop(worker_id: int) -> None:
+    """单个Worker进程，阻塞消费队列
+    任务出队时原子移入本Worker的执行中列表，执行结束后确认移除；进程异常退出时任务留在列表中，
+    由重启后的Worker或其他Worker启动时放回队列
+    """
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda *_: stopped.append(True))
+    redis_conn = cache_conn()
+    worker_name = get_worker_name(worker_id)
+    processing_key = f"{SYNC_PROCESSING_PREFIX}{worker_name}"
+    threading.Thread(target=keep_heartbeat, args=(worker_name, stopped), daemon=True).start()
+    try:
+        requeue_orphan_jobs(worker_name)
+    except Exception as err:
+        logging.error(f"[Sync Worker] {worker_name} 放回未完成任务失败: {err}")
+    logging.info(f"[Sync Worker] worker-{worker_id} started.")
+    while not stopped:
+        raw = None
+        try:
+            raw = redis_conn.brpoplpush(SYNC_QUEUE_KEY, processing_key, timeout=5)
+            if not raw:
+                continue
+            job = json.loads(raw)
+            # 出队即移除去重标记，执行期间允许同一任务再次排队一次
+            redis_conn.srem(SYNC_PENDING_KEY, get_job_key(job.get("cloud_name"), job.get("account_id"),
+                                                          job.get("resources")))
+            run_sync_job(job)
+        except Exception as err:
+            logging.error(f"[Sync Worker] worker-{worker_id} 执行同步任务出错: {err}")
+            time.sleep(1)
+        finally:
+            # 执行失败同样确认，避免异常任务反复重试；只有进程退出才会留在执行中列表
+            if raw:
+                try:
+                    redis_conn.lrem(processing_key, 1, raw)
+                except Exception as err:
+                    logging.error(f"[Sync Worker] worker-{worker_id} 确认同步任务失败: {err}")
+    redis_conn.delete(f"{SYNC_HEARTBEAT_PREFIX}{worker_name}")
+    logging.info(f"[Sync Worker] worker-{worker_id} stopped.")
+
+
+class SyncWorker:
+    def __init__(self, **kwargs):
+        self.processes = int(configs.get("sync_worker_processes", 2))
+
+    def start_server(self):
+        # spawn启动，子进程各自初始化线程池和数据库连接
+        ctx = multiprocessing.get_context("spawn")
+        workers = [ctx.Process(target=worker_loop, args=(i,), name=f"sync-worker-{i}")
+                   for i in range(self.processes)]
+        for p in workers:
+            p.start()
+        logging.info(f"[Sync Worker] {self.processes} worker processes started.")
+        try:
+            for p in workers:
+                p.join()
+        except (KeyboardInterrupt, SystemExit):
+            for p in workers:
+                p.terminate()
+            for p in workers:
+                p.join()
+
+
+if __name__ == '__main__':
+    pass
@@ -4,8 +4,152 @@
 # @Description: 全局线程池
 
 
+import logging
 import threading
+import time
+from collections import deque
+from concurrent.futures import Future, as_completed
 from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# 区域级并发的默认上限，账号可通过 region_concurrency 覆盖
+DEFAULT_REGION_CONCURRENCY = 5
+
+
+# 云资源同步的工作线程数
+CLOUD_SYNC_WORKERS = 10
+
+
+class _SyncJob:
+    __slots__ = ("key", "account", "fn", "args", "kwargs", "future", "submit_time")
+
+    def __init__(self, key: str, account: str, fn: Callable, args: tuple, kwargs: dict):
+        self.key = key
+        self.account = account
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.submit_time = time.monotonic()
+
+
+class FairSyncScheduler:
+    """
+    云资源同步调度器，接口与 ThreadPoolExecutor.submit 兼容
+    1. 每个账号一个队列，按账号已占用的工作时长(虚拟时间)公平出队，大账号不会饿死其他账号
+    2. 任务耗时按最近几次执行的 EWMA 估算，作为出队权重
+    3. 同一账号同一资源的任务已在排队/执行时直接复用其 Future，不会重叠执行
+    """
+
+    def __init__(self, max_workers: int = CLOUD_SYNC_WORKERS, default_cost: float = 1.0, alpha: float = 0.3):
+        self._default_cost = default_cost
+        self._alpha = alpha
+        self._queues: Dict[str, Deque[_SyncJob]] = {}
+        self._vtime: Dict[str, float] = {}
+        self._cost: Dict[str, float] = {}
+        self._inflight: Dict[str, _SyncJob] = {}
+        self._running = 0
+        self._stats = dict(submitted=0, coalesced=0, finished=0, failed=0, total_wait=0.0)
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"cloud-sync-{i}", daemon=True) for i in range(max_workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    @staticmethod
+    def _job_identity(fn: Callable, args: tuple) -> Tuple[str, str]:
+        """各云厂商以 submit(sync, config) 提交，config中带有账号和资源类型"""
+        config = args[0] if args and isinstance(args[0], dict) else {}
+        account = f"{fn.__module__}:{config.get('account_id') or 'all'}"
+        return f"{account}:{config.get('type', getattr(fn, '__name__', ''))}", account
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        key, account = self._job_identity(fn, args)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if key in self._inflight:
+                self._stats["coalesced"] += 1
+                return self._inflight[key].future
+            job = _SyncJob(key, account, fn, args, kwargs)
+            if account not in self._queues:
+                self._queues[account] = deque()
+                # 新账号从当前最小虚拟时间开始，不会因为历史欠账抢占其他账号
+                self._vtime[account] = min(self._vtime.values(), default=0.0)
+            self._queues[account].append(job)
+            self._inflight[key] = job
+            self._stats["submitted"] += 1
+            self._cond.notify()
+        return job.future
+
+    def _next_job(self) -> Optional[_SyncJob]:
+        candidates = [account for account, queue in self._queues.items() if queue]
+        if not candidates:
+            return None
+        account = min(candidates, key=lambda a: self._vtime[a])
+        job = self._queues[account].popleft()
+        self._vtime[account] += self._cost.get(job.key, self._default_cost)
+        return job
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._shutdown:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running += 1
+                self._stats["total_wait"] += time.monotonic() - job.submit_time
+
+            start, failed = time.monotonic(), False
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+            except BaseException as err:
+                failed = True
+                job.future.set_exception(err)
+                logging.error(f"云资源同步任务失败 {job.key}: {err}")
+            finally:
+                duration = time.monotonic() - start
+                with self._cond:
+                    self._running -= 1
+                    self._stats["finished"] += 1
+                    self._stats["failed"] += int(failed)
+                    self._inflight.pop(job.key, None)
+                    last = self._cost.get(job.key, duration)
+                    self._cost[job.key] = self._alpha * duration + (1 - self._alpha) * last
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度、等待时长等调度指标"""
+        with self._cond:
+            started = self._stats["finished"] + self._running
+            return dict(
+                self._stats,
+                running=self._running,
+                queue_depth=sum(len(q) for q in self._queues.values()),
+                account_queue_depth={a: len(q) for a, q in self._queues.items() if q},
+                avg_wait=round(self._stats["total_wait"] / started, 2) if started else 0,
+                oldest_wait=round(max(
+                    (time.monotonic() - q[0].submit_time for q in self._queues.values() if q), default=0), 2),
+            )
+
+    def shutdown(self, wait: bool = False) -> None:
+        with self._cond:
+            self._shutdown = True
+            if not wait:
+                for queue in self._queues.values():
+                    while queue:
+                        job = queue.popleft()
+                        job.future.cancel()
+                        self._inflight.pop(job.key, None)
+            self._cond.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
 
 
 class GlobalThreadPoolManager:
@@ -18,13 +162,13 @@ class GlobalThreadPoolManager:
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super(GlobalThreadPoolManager, cls).__new__(cls)
-                cls._instance._cloud_executor = ThreadPoolExecutor(max_workers=10)
+                cls._instance._cloud_executor = FairSyncScheduler(max_workers=CLOUD_SYNC_WORKERS)
                 cls._instance._general_executor = ThreadPoolExecutor(max_workers=5)
             return cls._instance
 
     @property
     def cloud_executor(self):
-        """云资源同步专用线程池"""
+        """云资源同步专用调度器"""
         return self._cloud_executor
 
     @property
@@ -42,5 +186,38 @@ class GlobalThreadPoolManager:
 global_executors = GlobalThreadPoolManager()
 
 
+def get_region_concurrency(conf: Dict[str, Any], default: int = DEFAULT_REGION_CONCURRENCY) -> int:
+    """获取账号的区域并发数，未配置时使用云厂商默认值"""
+    try:
+        return max(int(conf.get("region_concurrency") or default), 1)
+    except (TypeError, ValueError):
+        return default
+
+
+def run_region_tasks(func: Callable[[str], Any], regions: List[str], max_workers: int) -> None:
+    """
+    区域级并发执行同步任务，单个区域失败不影响其他区域
+    :param func: 接收region的同步函数
+    :param regions: 区域列表
+    :param max_workers: 最大并发数
+    """
+    regions = [region for region in regions if region]
+    if max_workers <= 1 or len(regions) <= 1:
+        for region in regions:
+            try:
+                func(region)
+            except Exception as err:
+                logging.error(f"区域同步任务失败, region={region}, {err}")
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(regions)), thread_name_prefix="region-sync") as executor:
+        futures = {executor.submit(func, region): region for region in regions}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as err:
+                logging.error(f"区域同步任务失败, region={futures[future]}, {err}")
+
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
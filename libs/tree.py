@@ -7,53 +7,56 @@ Date   :  2023/1/27 11:02
 Desc   :  Tree build
 """
 
+from collections import defaultdict
 from typing import *
 
 
 class Tree:
+    """
+    一次遍历按 (node_type, parent_node, grand_node) 建立子节点索引，构建复杂度O(n)
+    """
+
     def __init__(self, data):
         self._data = data
+        self._children: Dict[tuple, List[dict]] = defaultdict(list)
+        for node in data:
+            self._children[self.node_key(node)].append(node)
+        for childs in self._children.values():
+            childs.sort(key=lambda s: s['node_sort'])  # 升序
+
+    @staticmethod
+    def node_key(node) -> tuple:
+        """节点在父节点下的索引键"""
+        if node["node_type"] == 2:
+            return 2, node["parent_node"], None
+        if node["node_type"] == 3:
+            return 3, node["parent_node"], node["grand_node"]
+        return node["node_type"], None, None
+
+    @staticmethod
+    def child_key(node) -> Optional[tuple]:
+        """节点的子节点索引键"""
+        if node["node_type"] == 0:
+            return 1, None, None
+        if node["node_type"] == 1:
+            return 2, node["title"], None
+        if node["node_type"] == 2:
+            return 3, node["title"], node["parent_node"]
+        return None
 
     def get_root_node(self) -> dict:
-        root_node = list(filter(lambda node: node["node_type"] == 0, self._data))[0]
-        return root_node
+        return next(node for node in self._data if node["node_type"] == 0)
 
     def get_child(self, node, parent_node=None):
-        items = []  # type: List[Any]
-        if node["node_type"] == 0:
-            childs = list(
-                filter(
-                    lambda n: n["node_type"] == 1, self._data
-                )
-            )
-            childs = sorted(childs, key=lambda s: s['node_sort'], reverse=False)  # 升序
-
-        elif node["node_type"] == 1:
-            childs = list(
-                filter(
-                    lambda n: n["node_type"] == 2 and n["parent_node"] == node["title"],
-                    self._data
-                )
-            )
-            childs = sorted(childs, key=lambda s: s['node_sort'], reverse=False)  # 升序
-
-        elif node["node_type"] == 2:
-            childs = list(filter(
-                lambda n: n["node_type"] == 3 and n["parent_node"] == node["title"] and n["grand_node"] == node[
-                    "parent_node"], self._data))
-            # for i in childs: i['grand_node'] = node['parent_node']  ### 强行加了爷爷的名字
-            childs = sorted(childs, key=lambda s: s['node_sort'], reverse=False)  # 升序
-
-        else:
-            childs = []
+        key = self.child_key(node)
+        childs = self._children.get(key, []) if key else []
         for child in childs:
             child["children"] = self.get_child(child, node)
             # 2023年3月7日 为了让最后一级支持异步加载
             if not child["children"]:
                 child["children"] = []
                 child["loading"] = False
-            items.append(child)
-        return items
+        return list(childs)
 
     def build(self):
         root_node = self.get_root_node()
@@ -13,15 +13,17 @@ from typing import *
 import concurrent
 from websdk2.tools import RedisLock
 from concurrent.futures import ThreadPoolExecutor
-from models.models_utils import sync_log_task, get_cloud_config
+from functools import partial
+from models.models_utils import sync_log_task, get_cloud_config, sync_with_watermark
 from libs.volc import mapping, DEFAULT_CLOUD_NAME
+from libs.thread_pool import run_region_tasks, get_region_concurrency
 from libs.mycrypt import mc
 from libs import deco
 
 
 def sync(data: Dict[str, Any]) -> None:
     """
-    火山云统一资产入库，云厂商用for，产品用并发，地区用for
+    火山云统一资产入库，云厂商用for，产品用并发，地区按账号配置并发
     """
     obj, cloud_type, account_id = data.get("obj"), data.get("type"), data.get("account_id")
 
@@ -35,20 +37,22 @@ def sync(data: Dict[str, Any]) -> None:
 
 def sync_regions(conf: Dict[str, str], obj: Callable, cloud_type: str) -> None:
     region_list = conf["region"].split(",")
-    for region in region_list:
-        sync_region(conf, region, obj, cloud_type)
+    run_region_tasks(partial(sync_region, conf, obj=obj, cloud_type=cloud_type), region_list,
+                     max_workers=get_region_concurrency(conf))
 
 
 def sync_region(conf: Dict[str, str], region: str, obj: Callable, cloud_type: str) -> None:
     logging.info(f"同步开始, 信息：「{DEFAULT_CLOUD_NAME}」-「{cloud_type}」-「{region}」.")
 
     start_time = time.time()
-    is_success, msg = obj(
+    client = obj(
         access_id=conf["access_id"],
         access_key=mc.my_decrypt(conf["access_key"]),
         account_id=conf["account_id"],
         region=region,
-    ).sync_cmdb()
+    )
+    # 支持增量的资源按水位增量同步，每N次做一次全量对账
+    is_success, msg = sync_with_watermark(client, conf, DEFAULT_CLOUD_NAME, cloud_type, region)
     end_time = time.time()
 
     sync_consum = "%.2f" % (end_time - start_time)
@@ -16,7 +16,9 @@ from volcenginesdkecs import ECSApi, DescribeInstancesRequest
 from volcenginesdkvpc import DescribeNetworkInterfaceAttributesRequest
 
 from models import AssetServerModels
-from models.models_utils import server_task, mark_expired, mark_expired_by_sync, server_task_batch
+from libs.rate_limit import rate_limiter
+from models.models_utils import server_task, mark_expired, mark_expired_by_sync, server_task_batch, \
+    stream_upsert_task
 from libs.volc.volc_vpc import VolCVPC
 
 
@@ -70,7 +72,8 @@ class VolCECS:
             instances_request = DescribeInstancesRequest()
             instances_request.next_token = next_token
             instances_request.max_results = self.page_size
-            resp = self.api_instance.describe_instances(instances_request)
+            resp = rate_limiter.call(self.cloud_name, self._account_id, 'DescribeInstances',
+                                     self.api_instance.describe_instances, instances_request)
             return resp
         except ApiException as e:
             logging.error(f"火山云云服务器调用异常.describe_instances: {self._account_id} -- {e}")
@@ -95,24 +98,24 @@ class VolCECS:
             logging.error(f"火山云网卡详情调用异常.get_describe_network_interface_detail: {self._account_id} -- {e}")
             return None
 
-    def get_all_ecs(self):
-        ecs_list = []
+    def get_all_ecs(self) -> Generator[List[dict], None, None]:
+        """
+        按next_token分页获取ECS，每次返回一页
+        """
         next_token = ''
         while True:
             data = self.get_describe_info(next_token)
+            # 请求失败时中断同步，避免分页被截断后误标记过期
             if data is None:
-                break
+                raise RuntimeError(f'火山云获取ECS信息失败, next_token={next_token}')
 
-            ecs_list.extend(map(self.format_data, data.instances))
+            yield list(map(self.format_data, data.instances))
             next_token = data.next_token
-            # logging.info(f"Fetched {len(data.instances)} instances, Next token: {next_token}")
 
             # Break the loop if there is no next token
             if not next_token:
                 break
 
-        return ecs_list
-
     def format_data(self, data) -> Dict[str, str]:
         """
         处理数据
@@ -175,20 +178,9 @@ class VolCECS:
         资产信息更新到DB
         :return:
         """
-        all_ecs_list: List[dict] = self.get_all_ecs()
-        if not all_ecs_list:
-            return False, "ECS列表为空"
-        # 更新资源
-        ret_state, ret_msg = server_task_batch(account_id=self._account_id,
-                                         cloud_name=cloud_name,
-                                         rows=all_ecs_list)
-        # 标记过期
-        # mark_expired(resource_type=resource_type, account_id=self._account_id)
-        instance_ids = [ecs['instance_id'] for ecs in all_ecs_list]
-        mark_expired_by_sync(cloud_name=cloud_name, account_id=self._account_id, resource_type=resource_type,
-                             instance_ids=instance_ids, region=self._region)
-
-        return ret_state, ret_msg
+        return stream_upsert_task(resource_type, 'ECS', cloud_name, self._account_id, self.get_all_ecs(),
+                                  region=self._region)
+
 
 if __name__ == '__main__':
     pass
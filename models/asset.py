@@ -6,7 +6,8 @@ Author  : shenshuo
 Date    : 2023/2/15 14:59
 Desc    : 基础资产Models
 """
-from sqlalchemy import Column, String, Integer, Boolean, JSON, TEXT, UniqueConstraint, Date, Enum
+from sqlalchemy import Column, String, Integer, Boolean, JSON, TEXT, UniqueConstraint, Date, Enum, Index
+from sqlalchemy.dialects.mysql import VARBINARY
 from sqlalchemy.ext.declarative import declarative_base
 
 from libs.utils import human_date
@@ -49,6 +50,8 @@ class AssetBaseModel(TimeBaseModel, Base):
     zone = Column('zone', String(120), comment='可用区id')  # 位置信息
     is_expired = Column('is_expired', Boolean(), default=False, comment='True表示已过期')
     ext_info = Column('ext_info', JSON(), comment='扩展字段存JSON')
+    sync_hash = Column('sync_hash', String(32), comment='同步数据指纹，未变化时跳过写入')
+    sync_generation = Column('sync_generation', Integer, index=True, comment='最近一次同步到该资产的同步代数')
 
 
 class AssetServerModels(AssetBaseModel):
@@ -150,6 +153,35 @@ class AssetUserFieldModels(TimeBaseModel):
     )
 
 
+class AssetSearchIndexModels(TimeBaseModel):
+    """全局搜索索引，每个资产一行，content为ngram全文索引"""
+    __tablename__ = 't_asset_search_index'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    asset_type = Column('asset_type', String(32), nullable=False, comment='资产类型')
+    asset_id = Column('asset_id', Integer, nullable=False, comment='资产ID')
+    content = Column('content', TEXT(), comment='名称/IP/实例ID/地址/扩展字段拼接的检索内容')
+    __table_args__ = (
+        UniqueConstraint('asset_type', 'asset_id', name='search_asset_key'),
+        Index('idx_search_content', 'content', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
+
+
+class AssetIPIndexModels(TimeBaseModel):
+    """IP索引，多网卡/多IP拆成多行，ip_value为打包后的二进制地址，便于网段范围查询"""
+    __tablename__ = 't_asset_ip_index'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    asset_type = Column('asset_type', String(32), nullable=False, comment='资产类型')
+    asset_id = Column('asset_id', Integer, nullable=False, comment='资产ID')
+    ip_type = Column('ip_type', String(16), nullable=False, comment='inner/outer')
+    ip = Column('ip', String(64), nullable=False, comment='IP地址')
+    ip_version = Column('ip_version', Integer, nullable=False, default=4, comment='4/6')
+    ip_value = Column('ip_value', VARBINARY(16), nullable=False, comment='打包后的IP地址')
+    __table_args__ = (
+        Index('idx_ip_value', 'ip_version', 'ip_value'),
+        Index('idx_ip_asset', 'asset_type', 'asset_id'),
+    )
+
+
 class AssetVPCModels(AssetBaseModel):
     """VPC"""
     __tablename__ = 't_asset_vpc'  # VPC
@@ -82,6 +82,17 @@ class DynamicGroupModels(BizBaseModel):
     )
 
 
+class DynamicGroupMemberModels(TimeBaseModel):
+    __tablename__ = 't_dynamic_group_member'  # 动态分组/权限分组成员，按分组条件物化
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    exec_uuid = Column('exec_uuid', String(100), nullable=False, comment='分组查询ID')
+    asset_id = Column('asset_id', Integer, nullable=False, index=True, comment='主机ID')
+
+    __table_args__ = (
+        UniqueConstraint('exec_uuid', 'asset_id', name='exec_uuid_and_asset_id_unique'),
+    )
+
+
 class DynamicRulesModels(TimeBaseModel):
     __tablename__ = 't_dynamic_rules'  # 动态规则
 
@@ -7,7 +7,7 @@ Date    : 2023/2/15 14:59
 Desc    : 云配置
 """
 
-from sqlalchemy import Column, String, Integer, Text, DateTime, Boolean
+from sqlalchemy import Column, String, Integer, Text, DateTime, Boolean, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from models.base import TimeBaseModel
@@ -29,9 +29,46 @@ class CloudSettingModels(TimeBaseModel):
     account_file = Column('account_file', Text(), comment='IAM角色访问密钥文件')
     is_enable = Column('is_enable', Boolean(), default=False, comment='是否开启')
     interval = Column(Integer, nullable=False, default=30, comment='同步间隔(单位：minutes)')
+    region_concurrency = Column(Integer, default=5, comment='区域并发同步数，受云厂商API限流约束')
+    full_sync_cycles = Column(Integer, default=6, server_default='6',
+                              comment='增量同步N次后执行一次全量对账，0表示只做全量')
     detail = Column('detail', Text(), comment='备注')
 
 
+class CloudSyncWatermarkModels(TimeBaseModel):
+    __tablename__ = 't_cloud_sync_watermark'  # 增量同步水位
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cloud_name = Column('cloud_name', String(120), nullable=False, comment='云厂商Name')
+    account_id = Column('account_id', String(120), nullable=False, comment='AccountUUID')
+    sync_type = Column('sync_type', String(120), nullable=False, comment='资源类型')
+    sync_region = Column('sync_region', String(120), nullable=False, default='', comment='区域')
+    watermark = Column('watermark', DateTime(), comment='上次成功同步的开始时间(UTC)')
+    last_full_time = Column('last_full_time', DateTime(), comment='上次全量同步时间')
+    delta_count = Column('delta_count', Integer, default=0, comment='上次全量后的增量同步次数')
+    __table_args__ = (
+        UniqueConstraint('cloud_name', 'account_id', 'sync_type', 'sync_region', name='sync_watermark_key'),
+    )
+
+
+class CloudSyncGenerationModels(TimeBaseModel):
+    __tablename__ = 't_cloud_sync_generation'  # 同步代数，每次同步一条，id即代数
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cloud_name = Column('cloud_name', String(120), nullable=False, comment='云厂商Name')
+    account_id = Column('account_id', String(120), nullable=False, comment='AccountUUID')
+    sync_type = Column('sync_type', String(120), nullable=False, comment='资源类型')
+    sync_region = Column('sync_region', String(120), nullable=False, default='', comment='区域')
+    sync_state = Column('sync_state', String(20), default='running', comment='running/success/failed')
+    appeared = Column('appeared', Integer, default=0, comment='新增资产数')
+    changed = Column('changed', Integer, default=0, comment='变更资产数')
+    unchanged = Column('unchanged', Integer, default=0, comment='未变更资产数')
+    vanished = Column('vanished', Integer, default=0, comment='本次未同步到的资产数')
+    expired = Column('expired', Integer, default=0, comment='本次标记过期的资产数')
+    end_time = Column('end_time', DateTime(), comment='结束时间')
+    __table_args__ = (
+        Index('idx_sync_generation_scope', 'cloud_name', 'account_id', 'sync_type', 'sync_region'),
+    )
+
+
 class SyncLogModels(Base):
     __tablename__ = 't_sync_log'  # server 资产同步Log
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -7,26 +7,30 @@ Date    : 2023/2/15 14:59
 Desc    : 操作Models公共方法
 """
 import json
+import hashlib
 import datetime
 import logging
 from typing import *
 
 import pymysql
-from sqlalchemy.sql import or_
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy import Table, MetaData, Column, String, func, exists
+from sqlalchemy.sql import or_, and_, null
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from websdk2.db_context import DBContextV2 as DBContext
-from websdk2.model_utils import model_to_dict, insert_or_update
-from websdk2.client import AcsClient
-from websdk2.api_set import api_set
+from websdk2.model_utils import model_to_dict
 from websdk2.configs import configs
 
 from settings import settings
-from models.cloud import SyncLogModels, CloudSettingModels
+from models.cloud import SyncLogModels, CloudSettingModels, CloudSyncWatermarkModels, CloudSyncGenerationModels
 from models.asset import AssetServerModels, AssetMySQLModels, AssetRedisModels, AssetLBModels, AssetVPCModels, \
     AssetVSwitchModels, AssetEIPModels, SecurityGroupModels, AssetImagesModels, AssetNatModels, AssetClusterModels, \
     AssetMongoModels
 from models.event import CloudEventsModels
 from models import asset_mapping
+from libs.agent_registry import agent_registry
+from services.search_index_service import update_search_index
+from services.ip_index_service import update_ip_index
+from services.dynamic_group_service import update_dynamic_group_members
 
 if configs.can_import: configs.import_dict(**settings)
 
@@ -52,6 +56,7 @@ def mark_expired(resource_type: Optional[str], account_id: Optional[str]):
         
 def mark_expired_by_sync(cloud_name: str, account_id: str, resource_type: str, instance_ids: list, region=None):
     """根据同步结果标记过期状态
+    本次同步到的实例ID写入会话级临时表，未同步/过期均为集合UPDATE，不加载ORM对象
     Args:
         cloud_name: 云服务商名称
         account_id: 账号ID
@@ -63,46 +68,42 @@ def mark_expired_by_sync(cloud_name: str, account_id: str, resource_type: str, i
         logging.error(f"标记过期，资源类型错误，类型={resource_type}")
         return
 
+    resource_model = asset_mapping.get(resource_type)
+    scope_filter = [resource_model.cloud_name == cloud_name, resource_model.account_id == account_id]
+    # 如果指定了region，添加region过滤条件
+    if region:
+        scope_filter.append(resource_model.region == region)
+
+    seen_table = Table('tmp_sync_seen_ids', MetaData(), Column('instance_id', String(120), primary_key=True),
+                       prefixes=['TEMPORARY'])
     try:
         with DBContext('w', None, True, **settings) as session:
-            resource_model = asset_mapping.get(resource_type)
-            
-            # 基础过滤条件
-            base_filter = [
-                resource_model.cloud_name == cloud_name,
-                resource_model.account_id == account_id,
-                resource_model.is_expired.is_(False),
-                resource_model.state != '未同步',
-                ~resource_model.instance_id.in_(instance_ids)
-            ]
-            # 如果指定了region，添加region过滤条件
-            if region:
-                base_filter.append(resource_model.region == region)
-            
-            # 将不在当前同步列表中的资源标记为未同步
-            unsync_resources = session.query(resource_model).filter(*base_filter).all()
-            
-            for resource in unsync_resources:
-                resource.state = '未同步'
-                # 更新ext_info中的state字段
-                if hasattr(resource, 'ext_info') and resource.ext_info:
-                    if isinstance(resource.ext_info, dict):
-                        resource.ext_info['state'] = '未同步'
-                        flag_modified(resource, 'ext_info')
-            
+            # 临时表只在当前连接可见，同一事务内使用
+            conn = session.connection()
+            seen_table.drop(conn, checkfirst=True)
+            seen_table.create(conn)
+            for chunk in chunked(list(set(instance_ids)), UPSERT_CHUNK_SIZE):
+                conn.execute(seen_table.insert(), [dict(instance_id=i) for i in chunk])
+
+            # 将不在当前同步列表中的资源标记为未同步，清空指纹，重新同步到时完整写入
+            not_seen = ~exists().where(seen_table.c.instance_id == resource_model.instance_id)
+            session.query(resource_model).filter(
+                *scope_filter, resource_model.is_expired.is_(False), resource_model.state != '未同步', not_seen
+            ).update({
+                resource_model.state: '未同步',
+                resource_model.sync_hash: None,
+                # ext_info为NULL时JSON_SET仍返回NULL
+                resource_model.ext_info: func.json_set(resource_model.ext_info, '$.state', '未同步'),
+            }, synchronize_session=False)
+
             # 将7天未同步的资源标记为过期
             seven_days_ago = datetime.datetime.now() - datetime.timedelta(days=7)
-            expire_filter = [
-                resource_model.cloud_name == cloud_name,
-                resource_model.account_id == account_id,
-                resource_model.update_time <= seven_days_ago,
-                resource_model.is_expired == False,
+            session.query(resource_model).filter(
+                *scope_filter, resource_model.update_time <= seven_days_ago, resource_model.is_expired.is_(False),
                 resource_model.state == '未同步'
-            ]
-            if region:
-                expire_filter.append(resource_model.region == region)
-            session.query(resource_model).filter(*expire_filter).update({resource_model.is_expired: True})
+            ).update({resource_model.is_expired: True}, synchronize_session=False)
 
+            seen_table.drop(conn)
             session.commit()
     except Exception as e:
         logging.error(f"标记过期状态失败: {e}")
@@ -181,19 +182,73 @@ def sync_log_task(data: Dict[str, str]):
         db_session.commit()
 
 
-def get_all_agent_info() -> dict:
-    agent_info = {}
+# 增量同步水位回退时长，覆盖云厂商变更事件的投递延迟
+WATERMARK_OVERLAP = datetime.timedelta(minutes=15)
+# 增量同步N次后执行一次全量对账，与CloudSettingModels.full_sync_cycles默认值一致
+DEFAULT_FULL_SYNC_CYCLES = 6
+
+
+def sync_with_watermark(client: Any, conf: Dict[str, Any], cloud_name: str, sync_type: str,
+                        region: str) -> Tuple[bool, str]:
+    """
+    按水位选择增量/全量同步
+    客户端实现了 sync_cmdb_incremental(since) 且未到全量对账周期时只拉取水位之后变更的资源，
+    否则执行 sync_cmdb 全量同步，成功后推进水位
+    水位按UTC存储(不带时区)，与云厂商审计接口的时间一致，不受容器TZ影响
+    """
+    # 未配置(NULL)按默认周期，只有显式配置0才只做全量
+    full_sync_cycles = conf.get("full_sync_cycles")
+    full_sync_cycles = DEFAULT_FULL_SYNC_CYCLES if full_sync_cycles is None else int(full_sync_cycles)
+    account_id = conf["account_id"]
+    region = region or ""
+    start_time = datetime.datetime.now()
+    watermark = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    since, delta_count = None, 0
     try:
-        client = AcsClient()
-        resp = client.do_action_v2(**api_set.get_agent_list)
-        if resp.status_code != 200:
-            logging.error(f"获取agent列表失败，状态码={resp.status_code}")
-            return {}
-        agent_info = resp.json()
+        with DBContext('r', None, None, **settings) as session:
+            mark = session.query(
+                CloudSyncWatermarkModels.watermark, CloudSyncWatermarkModels.delta_count
+            ).filter(
+                CloudSyncWatermarkModels.cloud_name == cloud_name, CloudSyncWatermarkModels.account_id == account_id,
+                CloudSyncWatermarkModels.sync_type == sync_type, CloudSyncWatermarkModels.sync_region == region
+            ).first()
+            if mark:
+                since, delta_count = mark[0], mark[1] or 0
     except Exception as err:
-        logging.error(f"获取失败，{err}")
+        logging.error(f"获取同步水位失败，执行全量同步 {cloud_name}-{account_id}-{sync_type}-{region}: {err}")
+
+    # 水位晚于当前时间(升级前按本地时间写入的水位)时做一次全量同步重新对齐
+    is_delta = bool(hasattr(client, "sync_cmdb_incremental") and since and since <= watermark
+                    and full_sync_cycles > 0 and delta_count < full_sync_cycles)
+    if is_delta:
+        is_succ, msg = client.sync_cmdb_incremental(since=since - WATERMARK_OVERLAP)
+    else:
+        is_succ, msg = client.sync_cmdb()
+    if not is_succ:
+        return is_succ, msg
 
-    return agent_info
+    try:
+        with DBContext('w', None, True, **settings) as session:
+            session.execute(mysql_insert(CloudSyncWatermarkModels).values(
+                cloud_name=cloud_name, account_id=account_id, sync_type=sync_type, sync_region=region,
+                watermark=watermark, last_full_time=None if is_delta else start_time,
+                delta_count=1 if is_delta else 0, create_time=start_time, update_time=start_time
+            ).on_duplicate_key_update(
+                watermark=watermark,
+                update_time=start_time,
+                delta_count=CloudSyncWatermarkModels.delta_count + 1 if is_delta else 0,
+                last_full_time=CloudSyncWatermarkModels.last_full_time if is_delta else start_time,
+            ))
+            session.commit()
+    except Exception as err:
+        logging.error(f"更新同步水位失败 {cloud_name}-{account_id}-{sync_type}-{region}: {err}")
+    return is_succ, msg
+
+
+def get_all_agent_info() -> dict:
+    """Agent列表走共享缓存，避免每批主机写入都全量拉取"""
+    return agent_registry.get_all()
 
 
 def server_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -276,94 +331,351 @@ def server_task_batch(cloud_name: str, account_id: str, rows: list) -> Tuple[boo
         Tuple[bool, str]: (是否成功, 消息)
     """
     ret_state, ret_msg = True, f"{cloud_name}-{account_id}-server task写入数据库完成"
-    
+
     try:
-        all_agent_info = get_all_agent_info()
-        with DBContext('w', None, True, **settings) as db_session:
-            # 获取所有实例ID
-            instance_ids = [row['instance_id'] for row in rows]
-            
-            # 批量查询现有记录
-            existing_records = {
-                record.instance_id: record 
-                for record in db_session.query(AssetServerModels).filter(
-                    AssetServerModels.instance_id.in_(instance_ids)
-                ).all()
-            }
-            
-            # 准备批量更新和插入的数据
-            to_update = []
-            to_insert = []
-            
-            for info in rows:
-                instance_id = info['instance_id']
-                region = info.get('region')
-                inner_ip = info.get('inner_ip')
-                
-                if instance_id in existing_records:
-                    # 准备更新数据
-                    record = existing_records[instance_id]
-                    agent_info = all_agent_info.get(record.agent_id, {})
-                    
-                    update_data = {
-                        'id': record.id,  # 需要包含主键
-                        'cloud_name': cloud_name,
-                        'account_id': account_id,
-                        'name': info.get('name'),
-                        'region': region,
-                        'zone': info.get('zone'),
-                        'state': info.get('state'),
-                        'outer_ip': info.get('outer_ip'),
-                        'inner_ip': inner_ip,
-                        'vpc_id': info.get('vpc_id'),
-                        'is_expired': False,
-                        'ext_info': info
-                    }
-                    if agent_info:
-                        update_data['agent_info'] = agent_info
-                    
-                    to_update.append(update_data)
-                else:
-                    # 准备插入数据
-                    to_insert.append({
-                        'cloud_name': cloud_name,
-                        'account_id': account_id,
-                        'instance_id': instance_id,
-                        'state': info.get('state'),
-                        'name': info.get('name'),
-                        'region': region,
-                        'zone': info.get('zone'),
-                        'vpc_id': info.get('vpc_id'),
-                        'inner_ip': inner_ip,
-                        'outer_ip': info.get('outer_ip'),
-                        'agent_id': "0",
-                        'ext_info': info,
-                        'is_expired': False
-                    })
-            
-            # 批量更新
-            if to_update:
-                try:
-                    db_session.bulk_update_mappings(AssetServerModels, to_update)
-                except Exception as err:
-                    logging.error(f"批量更新失败: {err}")
-            
-            # 批量插入
-            if to_insert:
-                try:
-                    db_session.bulk_insert_mappings(AssetServerModels, to_insert)
-                except pymysql.err.IntegrityError as err:
-                    logging.error(f"批量插入失败: {err}")
-            
-            db_session.commit()
-            
+        counts = bulk_upsert('server', cloud_name, account_id, rows)
+        ret_msg = f"{ret_msg}, 新增:{counts['inserted']}, 更新:{counts['updated']}, 未变更:{counts['unchanged']}"
+        update_server_agent_info([row['instance_id'] for row in rows if row.get('instance_id')])
     except Exception as err:
         ret_state, ret_msg = False, f"{cloud_name}-{account_id}-server task写入数据库失败:{err}"
         logging.error(ret_msg)
-    
+
+    return ret_state, ret_msg
+
+
+def update_server_agent_info(instance_ids: List[str]):
+    """只更新agent上报信息有变化的主机"""
+    all_agent_info = get_all_agent_info()
+    if not all_agent_info:
+        return
+    with DBContext('w', None, True, **settings) as db_session:
+        for chunk in chunked(instance_ids, UPSERT_CHUNK_SIZE):
+            bound_servers = db_session.query(
+                AssetServerModels.id, AssetServerModels.agent_id, AssetServerModels.agent_info
+            ).filter(AssetServerModels.instance_id.in_(chunk), AssetServerModels.agent_id != "0").all()
+            to_update = [
+                dict(id=server_id, agent_info=all_agent_info[agent_id])
+                for server_id, agent_id, agent_info in bound_servers
+                if all_agent_info.get(agent_id) and all_agent_info[agent_id] != agent_info
+            ]
+            if to_update:
+                db_session.bulk_update_mappings(AssetServerModels, to_update)
+        db_session.commit()
+
+
+# 批量入库每批处理的行数
+UPSERT_CHUNK_SIZE = 500
+
+# 批量入库支持的资源类型 -> Models，在asset_mapping基础上补充镜像和维护事件
+upsert_model_mapping = {**asset_mapping, 'image': AssetImagesModels, 'event': CloudEventsModels}
+
+# 资源类型 -> {字段名: 取值}，取值为row中的key，或接收row返回值的函数
+upsert_column_mapping: Dict[str, Dict[str, Union[str, Callable[[dict], Any]]]] = {
+    'server': dict(name='name', region='region', zone='zone', state='state', outer_ip='outer_ip',
+                   inner_ip='inner_ip', vpc_id='vpc_id', ext_info=lambda row: row),
+    'mysql': dict(region='region', zone='zone', name='name', state='state', db_class='db_class',
+                  db_engine='db_engine', db_version='db_version', db_address='db_address',
+                  ext_info=lambda row: row),
+    'redis': dict(region='region', zone='zone', name='name', state='state', instance_class='instance_class',
+                  instance_arch='instance_arch', instance_type='instance_type',
+                  instance_version='instance_version', instance_address='instance_address',
+                  ext_info=lambda row: row),
+    'lb': dict(name='name', type='type', region='region', zone='zone', endpoint_type='endpoint_type',
+               lb_vip='lb_vip', dns_name='dns_name', state='status', ext_info='ext_info'),
+    'vpc': dict(vpc_name='vpc_name', region='region', cidr_block_v4='cidr_block_v4',
+                cidr_block_v6='cidr_block_v6', vpc_router='vpc_router', vpc_switch='vpc_switch',
+                is_default=lambda row: row.get('is_default', False)),
+    'vswitch': dict(vpc_id='vpc_id', vpc_name=lambda row: row.get('vpc_name', ''), region='region', zone='zone',
+                    name='name', address_count='address_count', cidr_block_v4='cidr_block_v4',
+                    cidr_block_v6='cidr_block_v6', route_id='route_id',
+                    is_default=lambda row: row.get('is_default', False)),
+    'eip': dict(name='name', address='address', region='region', binding_instance_id='binding_instance_id',
+                binding_instance_type='binding_instance_type', state='state', bandwidth='bandwidth',
+                internet_charge_type='internet_charge_type', charge_type=lambda row: row.get('charge_type', False)),
+    'security_group': dict(region='region', vpc_id='vpc_id', security_group_name='security_group_name',
+                           security_info='security_info', ref_info='ref_info', description='description'),
+    'image': dict(region='region', name='name', image_type='image_type', image_size='image_size',
+                  os_platform='os_platform', os_name='os_name', state='state', arch='arch',
+                  description='description'),
+    'event': dict(region='region', event_service='event_service', event_type='event_type',
+                  event_status='event_status', event_instance_id='event_instance_id',
+                  event_instance_name='event_instance_name', event_start_time='event_start_time',
+                  event_end_time='event_end_time', event_detail='event_detail'),
+    'nat': dict(region='region', name='name', network_type='network_type', network_interface_id='network_interface_id',
+                charge_type='charge_type', outer_ip='outer_ip', zone='zone', description='description', spec='spec',
+                subnet_id='subnet_id', project_name='project_name', vpc_id='vpc_id', state='state'),
+    'cluster': dict(region='region', name='name', inner_ip='inner_ip', outer_ip='outer_ip', zone='zone',
+                    description='description', version='version', vpc_id='vpc_id', total_node='total_node',
+                    total_running_node='total_running_node', tags='tags', state='state', ext_info='ext_info',
+                    cluster_type='cluster_type'),
+    'mongodb': dict(region='region', name='name', db_class='db_class', db_version='db_version',
+                    db_address='db_address', subnet_id='subnet_id', vpc_id='vpc_id', project_name='project_name',
+                    state='state', tags='tags', zone='zone', storage_type='storage_type'),
+}
+
+# 只在新增时写入、更新时保留原值的字段
+upsert_insert_only: Dict[str, Dict[str, Any]] = {
+    'server': dict(agent_id="0"),
+}
+
+
+def chunked(rows: list, size: int) -> Generator[list, None, None]:
+    """按固定大小切分列表"""
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def map_upsert_row(resource_type: str, row: dict) -> Dict[str, Any]:
+    """按upsert_column_mapping把同步数据转换为待写入的字段"""
+    return {column: getter(row) if callable(getter) else row.get(getter)
+            for column, getter in upsert_column_mapping[resource_type].items()}
+
+
+def row_fingerprint(value: dict) -> str:
+    """规范化后的行数据指纹，用于判断资产是否发生变化"""
+    payload = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def bulk_upsert(resource_type: str, cloud_name: str, account_id: str, rows: List[dict],
+                key: str = 'instance_id', generation: Optional[int] = None) -> Dict[str, int]:
+    """批量写入资产，每批一次查询 + 一条 INSERT ... ON DUPLICATE KEY UPDATE
+    指纹未变化的行只刷新update_time/is_expired，不重写数据
+    Args:
+        resource_type: 资源类型，对应upsert_column_mapping
+        cloud_name: 云服务商名称
+        account_id: 账号ID
+        rows: 资产信息列表
+        key: 唯一键字段
+        generation: 同步代数，写入的每一行都打上该代数
+    Returns:
+        Dict[str, int]: inserted/updated/unchanged 计数
+    """
+    resource_model = upsert_model_mapping[resource_type]
+    insert_only = upsert_insert_only.get(resource_type, {})
+    key_column = getattr(resource_model, key)
+    has_hash = hasattr(resource_model, 'sync_hash')
+    has_expired = hasattr(resource_model, 'is_expired')
+    stamp_generation = generation is not None and hasattr(resource_model, 'sync_generation')
+    counts = dict(inserted=0, updated=0, unchanged=0)
+
+    # 按唯一键去重，后出现的覆盖前面的
+    unique_rows = list({row[key]: row for row in rows if row and row.get(key)}.values())
+    if not unique_rows:
+        return counts
+
+    now = datetime.datetime.now()
+    changed_keys: List[str] = []
+    with DBContext('w', None, True, **settings) as session:
+        for chunk in chunked(unique_rows, UPSERT_CHUNK_SIZE):
+            hash_column = resource_model.sync_hash if has_hash else null()
+            exist_map = {
+                _key: (_id, _hash) for _key, _id, _hash in session.query(
+                    key_column, resource_model.id, hash_column
+                ).filter(key_column.in_([row[key] for row in chunk])).all()
+            }
+
+            values, touch_ids = [], []
+            for row in chunk:
+                value = {'cloud_name': cloud_name, 'account_id': account_id, **map_upsert_row(resource_type, row)}
+                fingerprint = row_fingerprint(value)
+                exist_id, exist_hash = exist_map.get(row[key], (None, None))
+                if has_hash and exist_id and exist_hash == fingerprint:
+                    touch_ids.append(exist_id)
+                    continue
+
+                # 已存在的行带上主键，使其命中 ON DUPLICATE KEY
+                value.update({'id': exist_id, key: row[key], 'create_time': now, 'update_time': now, **insert_only})
+                if has_expired:
+                    value['is_expired'] = False
+                if has_hash:
+                    value['sync_hash'] = fingerprint
+                if stamp_generation:
+                    value['sync_generation'] = generation
+                values.append(value)
+                changed_keys.append(row[key])
+                counts['updated' if exist_id else 'inserted'] += 1
+
+            if values:
+                stmt = mysql_insert(resource_model).values(values)
+                session.execute(stmt.on_duplicate_key_update(**{
+                    column: stmt.inserted[column] for column in values[0]
+                    if column not in ('id', 'create_time') and column not in insert_only
+                }))
+            if touch_ids:
+                touch_data = {resource_model.update_time: now}
+                if has_expired:
+                    touch_data[resource_model.is_expired] = False
+                if stamp_generation:
+                    touch_data[resource_model.sync_generation] = generation
+                session.query(resource_model).filter(resource_model.id.in_(touch_ids)).update(
+                    touch_data, synchronize_session=False)
+                counts['unchanged'] += len(touch_ids)
+        session.commit()
+    # 指纹未变化的行检索内容、IP和分组成员也不会变化，只更新新增/变化的行
+    if key == 'instance_id':
+        update_search_index(resource_type, changed_keys)
+        update_ip_index(resource_type, changed_keys)
+        update_dynamic_group_members(resource_type, changed_keys)
+        # 地址变化影响exporter注册
+        if changed_keys:
+            notify_consul(resource_type)
+    return counts
+
+
+def notify_consul(resource_type: str) -> None:
+    """标记consul待同步，consul模块延迟导入且异常只记录日志，不影响资产同步"""
+    try:
+        from libs.consul_registry import CONSUL_ASSET_TYPES, mark_consul_dirty
+        if resource_type in CONSUL_ASSET_TYPES:
+            mark_consul_dirty(resource_type)
+    except Exception as err:
+        logging.error(f"标记consul待同步失败 {resource_type} {err}")
+
+
+def upsert_task(resource_type: str, task_name: str, cloud_name: str, account_id: str, rows: list,
+                key: str = 'instance_id') -> Tuple[bool, str]:
+    """
+    各资源 *_task 的统一入口，返回值与原写入函数保持一致
+    """
+    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-{task_name}写入数据库完成"
+    try:
+        counts = bulk_upsert(resource_type, cloud_name, account_id, rows, key=key)
+        ret_msg = f"{ret_msg}, 新增:{counts['inserted']}, 更新:{counts['updated']}, 未变更:{counts['unchanged']}"
+    except Exception as err:
+        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-{task_name}写入数据库失败:{err}"
+        logging.error(ret_msg)
     return ret_state, ret_msg
 
 
+# 超过多少天的同步都未同步到的资产标记为过期，与原按update_time判断的7天保持一致
+EXPIRE_AFTER_DAYS = 7
+
+
+def start_sync_generation(cloud_name: str, account_id: str, resource_type: str,
+                          region: Optional[str] = None) -> Optional[int]:
+    """开始一次同步，返回单调递增的同步代数，失败返回None"""
+    try:
+        with DBContext('w', None, True, **settings) as session:
+            generation = CloudSyncGenerationModels(cloud_name=cloud_name, account_id=account_id,
+                                                   sync_type=resource_type, sync_region=region or '',
+                                                   sync_state='running')
+            session.add(generation)
+            session.commit()
+            return generation.id
+    except Exception as err:
+        logging.error(f"创建同步代数失败 {cloud_name}-{account_id}-{resource_type}-{region}: {err}")
+        return None
+
+
+def finish_sync_generation(generation: Optional[int], sync_state: str, **counts) -> None:
+    """记录同步结果和新增/变更/消失计数"""
+    if not generation:
+        return
+    try:
+        with DBContext('w', None, True, **settings) as session:
+            session.query(CloudSyncGenerationModels).filter(CloudSyncGenerationModels.id == generation).update(
+                dict(sync_state=sync_state, end_time=datetime.datetime.now(), **counts), synchronize_session=False)
+            session.commit()
+    except Exception as err:
+        logging.error(f"更新同步代数失败 {generation}: {err}")
+
+
+def mark_expired_by_generation(cloud_name: str, account_id: str, resource_type: str, generation: int,
+                               region: Optional[str] = None) -> Dict[str, int]:
+    """按同步代数标记过期，代数小于本次的为未同步，最近一次同步到的时间早于EXPIRE_AFTER_DAYS天的为过期
+    Returns:
+        Dict[str, int]: vanished/expired 计数
+    """
+    resource_model = asset_mapping.get(resource_type)
+    scope_filter = [resource_model.cloud_name == cloud_name, resource_model.account_id == account_id]
+    if region:
+        scope_filter.append(resource_model.region == region)
+    stale = or_(resource_model.sync_generation.is_(None), resource_model.sync_generation < generation)
+
+    with DBContext('w', None, True, **settings) as session:
+        vanished = session.query(resource_model).filter(
+            *scope_filter, stale, resource_model.is_expired.is_(False), resource_model.state != '未同步'
+        ).update({
+            resource_model.state: '未同步',
+            resource_model.sync_hash: None,
+            resource_model.ext_info: func.json_set(resource_model.ext_info, '$.state', '未同步'),
+        }, synchronize_session=False)
+
+        # 窗口内的第一个同步代数，代数早于它的资产超过EXPIRE_AFTER_DAYS天未同步到，标记为过期
+        # 与同步间隔无关；升级前没有代数的资产仍按update_time判断
+        expire_before = datetime.datetime.now() - datetime.timedelta(days=EXPIRE_AFTER_DAYS)
+        threshold = session.query(func.min(CloudSyncGenerationModels.id)).filter(
+            CloudSyncGenerationModels.cloud_name == cloud_name, CloudSyncGenerationModels.account_id == account_id,
+            CloudSyncGenerationModels.sync_type == resource_type,
+            CloudSyncGenerationModels.sync_region == (region or ''),
+            CloudSyncGenerationModels.create_time >= expire_before
+        ).scalar() or generation
+        expired = session.query(resource_model).filter(
+            *scope_filter, or_(and_(resource_model.sync_generation.is_(None),
+                                    resource_model.update_time <= expire_before),
+                               resource_model.sync_generation < threshold),
+            resource_model.is_expired.is_(False), resource_model.state == '未同步'
+        ).update({resource_model.is_expired: True}, synchronize_session=False)
+        session.commit()
+    return dict(vanished=vanished, expired=expired)
+
+
+def stream_upsert_task(resource_type: str, task_name: str, cloud_name: str, account_id: str,
+                       pages: Iterable[Iterable[dict]], region: Optional[str] = None) -> Tuple[bool, str]:
+    """逐页写入资产，每页到达即入库，同时增量收集实例ID用于标记过期
+    Args:
+        resource_type: 资源类型，对应upsert_column_mapping
+        task_name: 日志中的任务名称
+        cloud_name: 云服务商名称
+        account_id: 账号ID
+        pages: 分页迭代器，每次返回一页资产信息
+        region: 区域
+    Returns:
+        Tuple[bool, str]: (是否成功, 消息)
+    """
+    counts = dict(inserted=0, updated=0, unchanged=0)
+    seen_ids: Set[str] = set()
+    generation = start_sync_generation(cloud_name, account_id, resource_type, region)
+    try:
+        for page in pages:
+            rows = [row for row in page if row and row.get('instance_id')]
+            if not rows:
+                continue
+            for k, v in bulk_upsert(resource_type, cloud_name, account_id, rows, generation=generation).items():
+                counts[k] += v
+            seen_ids.update(row['instance_id'] for row in rows)
+    except Exception as err:
+        # 分页中断时不标记过期，避免把未拉取到的资产误标为未同步
+        ret_msg = f"{cloud_name}-{account_id}-{task_name}写入数据库失败, 已写入:{len(seen_ids)}, 错误:{err}"
+        logging.error(ret_msg)
+        finish_sync_generation(generation, 'failed', appeared=counts['inserted'], changed=counts['updated'],
+                               unchanged=counts['unchanged'])
+        return False, ret_msg
+
+    if not seen_ids:
+        finish_sync_generation(generation, 'failed')
+        return False, f"{task_name}列表为空"
+
+    if resource_type == 'server':
+        update_server_agent_info(list(seen_ids))
+
+    expire_counts = dict(vanished=0, expired=0)
+    if generation:
+        try:
+            expire_counts = mark_expired_by_generation(cloud_name, account_id, resource_type, generation, region)
+        except Exception as err:
+            logging.error(f"按同步代数标记过期失败 {cloud_name}-{account_id}-{resource_type}-{region}: {err}")
+    else:
+        mark_expired_by_sync(cloud_name=cloud_name, account_id=account_id, resource_type=resource_type,
+                             instance_ids=list(seen_ids), region=region)
+    finish_sync_generation(generation, 'success', appeared=counts['inserted'], changed=counts['updated'],
+                           unchanged=counts['unchanged'], **expire_counts)
+    return True, (f"{cloud_name}-{account_id}-{task_name}写入数据库完成, "
+                  f"新增:{counts['inserted']}, 更新:{counts['updated']}, 未变更:{counts['unchanged']}, "
+                  f"未同步:{expire_counts['vanished']}")
+
+
 def mysql_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
     """
     mysql资产写入数据库
@@ -372,98 +684,18 @@ def mysql_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-mysql task写入数据库完成"
-    try:
-        with DBContext('w', None, True, **settings) as db_session:
-            for __info in rows:
-                instance_id = __info['instance_id']
-                exist_id = db_session.query(AssetMySQLModels.id).filter(
-                    AssetMySQLModels.instance_id == instance_id).first()
-                if exist_id:
-                    try:
-                        db_session.query(AssetMySQLModels).filter(
-                            AssetMySQLModels.instance_id == instance_id
-                        ).update({
-                            AssetMySQLModels.cloud_name: cloud_name,
-                            AssetMySQLModels.account_id: account_id,
-                            AssetMySQLModels.region: __info.get('region'),
-                            AssetMySQLModels.zone: __info.get('zone'),
-                            AssetMySQLModels.is_expired: False,
-                            AssetMySQLModels.ext_info: __info,
-                            AssetMySQLModels.name: __info.get('name'),
-                            AssetMySQLModels.state: __info.get('state'),
-                            AssetMySQLModels.db_class: __info.get('db_class'),
-                            AssetMySQLModels.db_engine: __info.get('db_engine'),
-                            AssetMySQLModels.db_version: __info.get('db_version'),
-                            AssetMySQLModels.db_address: __info.get('db_address')
-                        })
-                    except Exception as err:
-                        logging.error(f"mysql sync task err {err}")
-                else:
-                    db_session.add(AssetMySQLModels(
-                        cloud_name=cloud_name, account_id=account_id, instance_id=instance_id,
-                        region=__info.get('region'), zone=__info.get('zone'), is_expired=False, ext_info=__info,
-                        # up base, down self models data
-                        name=__info.get('name'), state=__info.get('state'),
-                        db_class=__info.get('db_class'), db_engine=__info.get('db_engine'),
-                        db_version=__info.get('db_version'), db_address=__info.get('db_address')
-                    ))
-            db_session.commit()
-    except Exception as err:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-mysql task写入数据库失败:{err}"
-        logging.error(ret_msg)
-    return ret_state, ret_msg
+    return upsert_task('mysql', 'mysql task', cloud_name, account_id, rows)
 
 
 def redis_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
     """
+    redis资产写入数据库
     :param cloud_name:
     :param account_id:
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-redis task写入数据库完成"
-    try:
-        with DBContext('w', None, True, **settings) as db_session:
-            for __info in rows:
-                instance_id = __info['instance_id']
-                exist_id = db_session.query(AssetRedisModels.id).filter(
-                    AssetRedisModels.instance_id == instance_id
-                ).first()
-                if exist_id:
-                    db_session.query(AssetRedisModels).filter(
-                        AssetRedisModels.instance_id == instance_id
-                    ).update({
-                        AssetRedisModels.cloud_name: cloud_name,
-                        AssetRedisModels.account_id: account_id,
-                        AssetRedisModels.region: __info.get('region'),
-                        AssetRedisModels.zone: __info.get('zone'),
-                        AssetRedisModels.is_expired: False,
-                        AssetRedisModels.ext_info: __info,
-                        AssetRedisModels.name: __info.get('name'),
-                        AssetRedisModels.state: __info.get('state'),
-                        AssetRedisModels.instance_class: __info.get('instance_class'),
-                        AssetRedisModels.instance_arch: __info.get('instance_arch'),
-                        AssetRedisModels.instance_type: __info.get('instance_type'),
-                        AssetRedisModels.instance_version: __info.get('instance_version'),
-                        AssetRedisModels.instance_address: __info.get('instance_address')
-                    })
-                else:
-                    db_session.add(AssetRedisModels(
-                        cloud_name=cloud_name, account_id=account_id, instance_id=instance_id,
-                        region=__info.get('region'), zone=__info.get('zone'), is_expired=False, ext_info=__info,
-                        # up base, down self models data
-                        name=__info.get('name'), state=__info.get('state'),
-                        instance_class=__info.get('instance_class'), instance_arch=__info.get('instance_arch'),
-                        instance_type=__info.get('instance_type'), instance_version=__info.get('instance_version'),
-                        instance_address=__info.get('instance_address')
-                    ))
-            db_session.commit()
-    except Exception as err:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-redis task写入数据库失败:{err}"
-    return ret_state, ret_msg
+    return upsert_task('redis', 'redis task', cloud_name, account_id, rows)
 
 
 def lb_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -474,41 +706,7 @@ def lb_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-lb task写入数据库完成"
-    try:
-        with DBContext("w", None, True, **settings) as db_session:
-            for row in rows:
-                instance_id = row.get("instance_id")
-                exist_id = db_session.query(AssetLBModels.id).filter(
-                    AssetLBModels.account_id == account_id, AssetLBModels.instance_id == instance_id
-                ).first()
-                if not exist_id:
-                    db_session.add(AssetLBModels(
-                        name=row.get("name"), cloud_name=cloud_name, type=row.get("type"), account_id=account_id,
-                        instance_id=row.get("instance_id"), region=row.get("region"), zone=row.get("zone"),
-                        endpoint_type=row.get("endpoint_type"), lb_vip=row.get("lb_vip"), dns_name=row.get("dns_name"),
-                        is_expired=False, state=row.get("status"), ext_info=row.get("ext_info")
-                    ))
-                else:
-                    db_session.query(AssetLBModels).filter(
-                        AssetLBModels.account_id == account_id,
-                        AssetLBModels.instance_id == instance_id
-                    ).update({
-                        AssetLBModels.type: row.get("type"),
-                        AssetLBModels.region: row.get("region"),
-                        AssetLBModels.zone: row.get("zone"),
-                        AssetLBModels.lb_vip: row.get("lb_vip"),
-                        AssetLBModels.state: row.get("status"),
-                        AssetLBModels.is_expired: False,
-                        AssetLBModels.instance_id: row.get("instance_id"),
-                        AssetLBModels.endpoint_type: row.get("endpoint_type"),
-                        AssetLBModels.dns_name: row.get("dns_name"),
-                        AssetLBModels.ext_info: row.get("ext_info")
-                    })
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-lb task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('lb', 'lb task', cloud_name, account_id, rows)
 
 
 def vpc_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -519,30 +717,7 @@ def vpc_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-vpc task写入数据库完成"
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(AssetVPCModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 vpc_name=row.get('vpc_name'),
-                                                 region=row.get('region'),
-                                                 cidr_block_v4=row.get('cidr_block_v4'),
-                                                 cidr_block_v6=row.get('cidr_block_v6'),
-                                                 vpc_router=row.get('vpc_router'),
-                                                 vpc_switch=row.get('vpc_switch'),
-                                                 is_default=row.get('is_default', False)
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-vpc task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('vpc', 'vpc task', cloud_name, account_id, rows)
 
 
 def vswitch_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -553,33 +728,7 @@ def vswitch_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, st
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-vswitch task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(AssetVSwitchModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 vpc_id=row.get('vpc_id'),
-                                                 vpc_name=row.get('vpc_name', ''),
-                                                 region=row.get('region'), zone=row.get('zone'),
-                                                 name=row.get('name'),
-                                                 address_count=row.get('address_count'),
-                                                 cidr_block_v4=row.get('cidr_block_v4'),
-                                                 cidr_block_v6=row.get('cidr_block_v6'),
-                                                 route_id=row.get('route_id'),
-                                                 is_default=row.get('is_default', False)
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-vswitch  task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('vswitch', 'vswitch task', cloud_name, account_id, rows)
 
 
 def eip_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -590,33 +739,7 @@ def eip_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-eip task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(AssetEIPModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 name=row.get('name'),
-                                                 address=row.get('address'),
-                                                 region=row.get('region'),
-                                                 binding_instance_id=row.get('binding_instance_id'),
-                                                 binding_instance_type=row.get('binding_instance_type'),
-                                                 state=row.get('state'),
-                                                 bandwidth=row.get('bandwidth'),
-                                                 internet_charge_type=row.get('internet_charge_type'),
-                                                 charge_type=row.get('charge_type', False)
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-eip  task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('eip', 'eip task', cloud_name, account_id, rows)
 
 
 def security_group_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -627,30 +750,7 @@ def security_group_task(cloud_name: str, account_id: str, rows: list) -> Tuple[b
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-安全组task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(SecurityGroupModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 region=row.get('region'),
-                                                 vpc_id=row.get('vpc_id'),
-                                                 security_group_name=row.get('security_group_name'),
-                                                 security_info=row.get('security_info'),
-                                                 ref_info=row.get('ref_info'),
-                                                 description=row.get('description'),
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-安全组task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('security_group', '安全组task', cloud_name, account_id, rows)
 
 
 def image_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -661,33 +761,7 @@ def image_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-系统镜像task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(AssetImagesModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 region=row.get('region'),
-                                                 name=row.get('name'),
-                                                 image_type=row.get('image_type'),
-                                                 image_size=row.get('image_size'),
-                                                 os_platform=row.get('os_platform'),
-                                                 os_name=row.get('os_name'),
-                                                 state=row.get('state'),
-                                                 arch=row.get('arch'),
-                                                 description=row.get('description')
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-系统镜像task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('image', '系统镜像task', cloud_name, account_id, rows)
 
 
 def cloud_event_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -698,33 +772,7 @@ def cloud_event_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-维护事件task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                event_id = row.get("event_id")
-                try:
-                    session.add(insert_or_update(CloudEventsModels, f"event_id='{event_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 event_id=event_id,
-                                                 region=row.get('region'),
-                                                 event_service=row.get('event_service'),
-                                                 event_type=row.get('event_type'),
-                                                 event_status=row.get('event_status'),
-                                                 event_instance_id=row.get('event_instance_id'),
-                                                 event_instance_name=row.get('event_instance_name'),
-                                                 event_start_time=row.get('event_start_time'),
-                                                 event_end_time=row.get('event_end_time'),
-                                                 event_detail=row.get('event_detail')
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-维护事件task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('event', '维护事件task', cloud_name, account_id, rows, key='event_id')
 
 
 def nat_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -735,38 +783,7 @@ def nat_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-NAT网关task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(AssetNatModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 region=row.get('region'),
-                                                 name=row.get('name'),
-                                                 network_type=row.get('network_type'),
-                                                 network_interface_id=row.get('network_interface_id'),
-                                                 charge_type=row.get('charge_type'),
-                                                 outer_ip=row.get('outer_ip'),
-                                                 zone=row.get('zone'),
-                                                 description=row.get('description'),
-                                                 spec=row.get('spec'),
-                                                 subnet_id=row.get('subnet_id'),
-                                                 project_name=row.get('project_name'),
-                                                 vpc_id=row.get('vpc_id'),
-                                                 state=row.get('state'),
-                                                 update_time=datetime.datetime.now(),
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-NAT网关task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('nat', 'NAT网关task', cloud_name, account_id, rows)
 
 
 def cluster_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -777,39 +794,7 @@ def cluster_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, st
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-集群task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(AssetClusterModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 region=row.get('region'),
-                                                 name=row.get('name'),
-                                                 inner_ip=row.get('inner_ip'),
-                                                 outer_ip=row.get('outer_ip'),
-                                                 zone=row.get('zone'),
-                                                 description=row.get('description'),
-                                                 version=row.get('version'),
-                                                 vpc_id=row.get('vpc_id'),
-                                                 total_node=row.get('total_node'),
-                                                 total_running_node=row.get('total_running_node'),
-                                                 tags=row.get('tags'),
-                                                 state=row.get('state'),
-                                                 update_time=datetime.datetime.now(),
-                                                 ext_info=row.get('ext_info'),
-                                                 cluster_type=row.get('cluster_type'),
-                                                 ))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-集群task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('cluster', '集群task', cloud_name, account_id, rows)
 
 
 def mongodb_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, str]:
@@ -820,36 +805,7 @@ def mongodb_task(cloud_name: str, account_id: str, rows: list) -> Tuple[bool, st
     :param rows:
     :return:
     """
-    # 定义返回
-    ret_state, ret_msg = True, f"{cloud_name}-{account_id}-MongoDB task写入数据库完成"
-
-    try:
-        with DBContext("w", None, True, **settings) as session:
-            for row in rows:
-                if not row: continue
-                instance_id = row.get("instance_id")
-                try:
-                    session.add(insert_or_update(AssetMongoModels, f"instance_id='{instance_id}'",
-                                                 cloud_name=cloud_name, account_id=account_id,
-                                                 instance_id=instance_id,
-                                                 region=row.get('region'),
-                                                 name=row.get('name'),
-                                                 db_class=row.get('db_class'),
-                                                 db_version=row.get('db_version'),
-                                                 db_address=row.get('db_address'),
-                                                 subnet_id=row.get('subnet_id'),
-                                                 vpc_id=row.get('vpc_id'),
-                                                 project_name=row.get('project_name'),
-                                                 state=row.get('state'),
-                                                 tags=row.get('tags'),
-                                                 zone=row.get('zone'),
-                                                 update_time=datetime.datetime.now(),
-                                                 storage_type=row.get('storage_type')))
-                except Exception as err:
-                    logging.error(err)
-    except Exception as error:
-        ret_state, ret_msg = False, f"{cloud_name}-{account_id}-MongoDB task写入数据库失败,错误行:{row},详细信息:{error}"
-    return ret_state, ret_msg
+    return upsert_task('mongodb', 'MongoDB task', cloud_name, account_id, rows)
 
 
 
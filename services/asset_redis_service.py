@@ -14,6 +14,7 @@ from websdk2.db_context import DBContextV2 as DBContext
 from models.asset import AssetRedisModels as redisModel
 from websdk2.sqlalchemy_pagination import paginate
 from websdk2.model_utils import CommonOptView
+from services.search_index_service import update_search_index
 
 opt_obj = CommonOptView(redisModel)
 
@@ -131,4 +132,5 @@ def add_redis(data: dict) -> dict:
     except Exception as err:
         return dict(code=-10, msg=f'添加失败 {err}')
 
+    update_search_index('redis', [instance_id])
     return dict(code=0, msg='添加成功')
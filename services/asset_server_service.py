@@ -12,13 +12,16 @@ from shortuuid import uuid
 from sqlalchemy import or_, func
 from typing import *
 from websdk2.db_context import DBContextV2 as DBContext
-from models.asset import AssetServerModels, AgentBindStatus
+from models.asset import AssetServerModels, AgentBindStatus, AssetIPIndexModels
 from models.tree import TreeAssetModels
 from models.agent import AgentModels
 from websdk2.sqlalchemy_pagination import paginate
 from websdk2.model_utils import CommonOptView, insert_or_update, queryset_to_list
 
 from services import CommonResponse
+from services.dynamic_group_service import refresh_server_members
+from services.search_index_service import update_search_index, refresh_search_index
+from services.ip_index_service import has_ip_index
 
 # from websdk2.model_utils import insert_or_update
 
@@ -117,7 +120,9 @@ def mark_server(data: dict) -> dict:
         if not exist_id:
             return {"code": 3, "msg": f"name: {name} 不存在"}
 
+        server_ids = [server_id for server_id, in session.query(AssetServerModels.id).filter_by(**filter_map)]
         session.query(AssetServerModels).filter_by(**filter_map).update({AssetServerModels.is_product: is_product})
+    refresh_server_members(server_ids)
     return dict(code=0, msg='标记成功')
 
 
@@ -168,6 +173,7 @@ def add_server(server: dict):
     except Exception as err:
         return dict(code=-2, msg=f'批量添加失败 {err}')
 
+    update_search_index('server', [instance_id])
     return dict(code=0, msg='批量添加成功')
 
 
@@ -182,6 +188,7 @@ def add_server_batch(data: dict):
         logging.error(f'server_list error: {server_list}')
         return {"code": 1, "msg": "server_list格式不正确"}
 
+    instance_ids = []
     for server in server_list:
         if not isinstance(server, dict):
             return {"code": 1, "msg": "server类型错误"}
@@ -214,11 +221,13 @@ def add_server_batch(data: dict):
                                                  agent_bind_status=server.get('agent_bind_status', 0),
                                                  ext_info=ext_info, is_expired=False  # 新机器标记正常))
                                                  ))
+                    instance_ids.append(instance_id)
                 except Exception as err:
                     print(err)
         except Exception as err:
             print(err)
 
+    update_search_index('server', instance_ids)
     return dict(code=0, msg='批量添加成功')
 
 
@@ -235,6 +244,7 @@ def patch_server_batch(data: dict):
                     {AssetServerModels.outer_biz_addr: outer_biz_addr})
         else:
             return dict(code=-1, msg='缺少必要参数')
+    refresh_server_members([host.get('id') for host in hosts])
     return dict(code=0, msg='修改成功')
 
 
@@ -245,7 +255,10 @@ def delete_server(data: dict) -> dict:
     # 根据name删除，回收使用 不做过期校验
     if name:
         with DBContext("w", None, True) as session:
+            server_ids = [server_id for server_id, in session.query(AssetServerModels.id).filter(
+                AssetServerModels.name == name)]
             session.query(AssetServerModels).filter(AssetServerModels.name == name).delete(synchronize_session=False)
+        refresh_search_index('server', server_ids)
         return dict(code=0, msg='不做过期校验')
 
     if not hosts:
@@ -260,6 +273,8 @@ def delete_server(data: dict) -> dict:
         else:
             session.query(AssetServerModels).filter(AssetServerModels.id.in_(host_ids)).delete(
                 synchronize_session=False)
+    refresh_server_members(host_ids)
+    refresh_search_index('server', host_ids)
     return dict(code=0, msg='删除成功')
 
     # hosts_state = list(filter(lambda x: x["state"] == "运行中", hosts))
@@ -290,8 +305,10 @@ def check_delete(data: dict, asset_type) -> bool:
 
 
 def get_unique_servers():
-    """查询唯一的inner_ip -> server 映射"""
+    """查询唯一的inner_ip -> server 映射，多网卡主机的每个内网IP分别参与匹配"""
     with DBContext("r") as session:
+        if has_ip_index(session):
+            return _get_unique_servers_by_ip_index(session)
         subquery = (
             session.query(
                 AssetServerModels.inner_ip,
@@ -322,6 +339,23 @@ def get_unique_servers():
         return {server.inner_ip: server for server in servers}
 
 
+def _get_unique_servers_by_ip_index(session) -> Dict[str, AssetServerModels]:
+    """按IP索引分组，只对应一台运行中主机的内网IP"""
+    subquery = (
+        session.query(AssetIPIndexModels.ip, func.max(AssetIPIndexModels.asset_id).label("max_id"))
+        .join(AssetServerModels, AssetServerModels.id == AssetIPIndexModels.asset_id)
+        .filter(AssetIPIndexModels.asset_type == "server", AssetIPIndexModels.ip_type == "inner")
+        .filter(AssetServerModels.is_expired.is_(False))
+        .filter(AssetServerModels.state == "运行中")
+        .group_by(AssetIPIndexModels.ip)
+        .having(func.count(func.distinct(AssetIPIndexModels.asset_id)) == 1)
+        .subquery()
+    )
+    rows = session.query(subquery.c.ip, AssetServerModels).join(
+        AssetServerModels, AssetServerModels.id == subquery.c.max_id).all()
+    return {ip: server for ip, server in rows}
+
+
 def bind_main_agent(data: dict) -> dict:
     """
     绑定主agent
@@ -9,7 +9,7 @@ Desc    : 解释一下吧
 """
 from typing import *
 from websdk2.db_context import DBContextV2 as DBContext
-from models.cloud import CloudSettingModels, SyncLogModels
+from models.cloud import CloudSettingModels, SyncLogModels, CloudSyncGenerationModels
 from websdk2.utils.date_format import date_format_to8
 from websdk2.model_utils import CommonOptView, queryset_to_list
 from libs.mycrypt import mc
@@ -38,6 +38,22 @@ def get_cloud_sync_log(account_id) -> dict:
     return dict(msg='获取成功', code=0, data=sync_log_list)
 
 
+def get_cloud_sync_audit(**params) -> dict:
+    """按同步代数查看每次同步新增/变更/消失的资产数"""
+    page_size = int(params.get('page_size', 50))
+    page_number = int(params.get('page_number', 1))
+    with DBContext('r', None, None) as session:
+        query = session.query(CloudSyncGenerationModels)
+        for field in ('cloud_name', 'account_id', 'sync_type', 'sync_region', 'sync_state'):
+            if params.get(field):
+                query = query.filter(getattr(CloudSyncGenerationModels, field) == params[field])
+        count = query.count()
+        generation_info = query.order_by(-CloudSyncGenerationModels.id).offset(
+            (page_number - 1) * page_size).limit(page_size)
+        generation_list: List[dict] = queryset_to_list(generation_info)
+    return dict(msg='获取成功', code=0, count=count, data=generation_list)
+
+
 def update_cloud_settings(data: dict) -> dict:
     access_key = data.get('access_key', None).strip()
     if data.get('cloud_name').strip().lower() == 'gcp':
@@ -7,17 +7,25 @@ Date    : 2023/3/27 11:02
 Desc    : 动态分组逻辑处理
 """
 
+import json
+import hashlib
 import logging
-from collections import namedtuple
+import datetime
+import threading
+from collections import namedtuple, defaultdict
 from typing import *
 from shortuuid import uuid
-from sqlalchemy import or_, text
+from sqlalchemy import or_, and_, func, case
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from websdk2.sqlalchemy_pagination import paginate
 from websdk2.db_context import DBContextV2 as DBContext
 from websdk2.model_utils import CommonOptView, model_to_dict
-from models.business import DynamicGroupModels
+from websdk2.cache_context import cache_conn
+from websdk2.tools import convert
+from models.business import DynamicGroupModels, DynamicGroupMemberModels, PermissionGroupModels
 from models.tree import TreeAssetModels
 from models.asset import AssetServerModels
+from libs.thread_pool import global_executors
 
 opt_obj = CommonOptView(DynamicGroupModels)
 
@@ -70,6 +78,10 @@ def add_dynamic_group_for_api(data: dict) -> dict:
     if data.get('dynamic_group_type') == 'normal':
         if not new_data.get('dynamic_group_rules').get('items'):
             return {"code": 1, "msg": "条件不能为空"}
+        try:
+            compile_rules(new_data['dynamic_group_rules']['items'])
+        except DynamicRuleError as error:
+            return {"code": 1, "msg": f"条件规则错误，{error}"}
     else:
         if not new_data.get('biz_id'):
             return {"code": 1, "msg": "业务ID 不能为空"}
@@ -85,6 +97,7 @@ def add_dynamic_group_for_api(data: dict) -> dict:
     except Exception as error:
         logging.error(error)
         return {"code": 1, "msg": str(error)}
+    global_executors.general_executor.submit(refresh_dynamic_group, exec_uuid=new_data['exec_uuid'])
 
     return {"code": 0, "msg": "添加成功"}
 
@@ -107,6 +120,10 @@ def update_dynamic_group_for_api(data: dict) -> dict:
     if data.get('dynamic_group_type') == 'normal':
         if not new_data.get('dynamic_group_rules').get('items'):
             return {"code": 1, "msg": "条件不能为空"}
+        try:
+            compile_rules(new_data['dynamic_group_rules']['items'])
+        except DynamicRuleError as error:
+            return {"code": 1, "msg": f"条件规则错误，{error}"}
     else:
         if not new_data.get('biz_id'):
             return {"code": 1, "msg": "业务ID 不能为空"}
@@ -117,6 +134,7 @@ def update_dynamic_group_for_api(data: dict) -> dict:
     except Exception as error:
         logging.error(error)
         return {"code": 1, "msg": str(error)}
+    global_executors.general_executor.submit(refresh_dynamic_group, id=data.get('id'))
     return {"code": 0, "msg": "更新成功"}
 
 
@@ -161,6 +179,7 @@ def get_dynamic_group_for_use_api(**params) -> dict:
 
 def preview_dynamic_group_for_api(exec_uuid_list: list) -> dict:
     res_list = []
+    rule_errors = []
 
     with DBContext('r') as session:
         for exec_id in exec_uuid_list:
@@ -168,19 +187,17 @@ def preview_dynamic_group_for_api(exec_uuid_list: list) -> dict:
             if not group_info:
                 return dict(code=-1, msg='动态分组ID不存在', data=[])
 
-            if group_info.dynamic_group_type == 'normal':
-                # 获取主机信息
-                is_success, result = get_dynamic_hosts_v2(model_to_dict(group_info))
-                if not is_success or not result:
-                    logging.error(f"normal {exec_id} 没有发现主机信息")
+            group_dict = model_to_dict(group_info)
+            # 规则中有不支持的字段/条件时不再静默返回空，在结果中提示
+            rule_error = check_group_rules(group_dict)
+            if rule_error:
+                rule_errors.append(rule_error)
+                continue
 
-                res_list.extend(result)
-            elif group_info.dynamic_group_type == 'biz':
-                is_success, result = get_dynamic_hosts_for_biz(model_to_dict(group_info))
-                if not is_success or not result:
-                    logging.error(f"biz {exec_id} 没有发现主机信息")
-            else:
-                result = []
+            # 读取物化的分组成员
+            is_success, result = get_group_members(group_dict)
+            if not is_success or not result:
+                logging.error(f"{group_info.dynamic_group_type} {exec_id} 没有发现主机信息")
 
             res_list.extend(result)
 
@@ -205,6 +222,9 @@ def preview_dynamic_group_for_api(exec_uuid_list: list) -> dict:
             __asset = [Asset(*res) for res in __asset]
             server_list = [row._asdict() for row in __asset]
             __count = len(server_list)
+            if rule_errors:
+                return dict(msg='；'.join(rule_errors), code=0, data=server_list, count=__count,
+                            rule_errors=rule_errors)
             return dict(msg='获取成功', code=0, data=server_list, count=__count)
         except Exception as error:
             logging.error(f"{error} 获取主机失败")
@@ -278,6 +298,168 @@ def get_dynamic_hosts_for_biz(group_info: Optional[dict]) -> Tuple[bool, Union[l
     return True, server_list
 
 
+# 动态分组规则允许查询的主机字段，query_name 只能取以下字段
+dynamic_rule_columns = {
+    'name': AssetServerModels.name,
+    'instance_id': AssetServerModels.instance_id,
+    'inner_ip': AssetServerModels.inner_ip,
+    'outer_ip': AssetServerModels.outer_ip,
+    'outer_biz_addr': AssetServerModels.outer_biz_addr,
+    'state': AssetServerModels.state,
+    'agent_id': AssetServerModels.agent_id,
+    'agent_status': AssetServerModels.agent_status,
+    'is_product': AssetServerModels.is_product,
+    'ownership': AssetServerModels.ownership,
+    'cloud_name': AssetServerModels.cloud_name,
+    'account_id': AssetServerModels.account_id,
+    'region': AssetServerModels.region,
+    'zone': AssetServerModels.zone,
+    'vpc_id': AssetServerModels.vpc_id,
+}
+
+LIKE_PREFIX = '{}%'  # v2规则 like 为前缀匹配，可以走索引
+LIKE_CONTAINS = '%{}%'  # v1规则 like 为包含匹配
+
+_rule_plan_cache: Dict[str, Tuple[str, Any]] = {}  # exec_uuid -> (规则指纹, 编译后的条件)
+_dynamic_hosts_cache: Dict[str, Tuple[str, tuple, list]] = {}  # exec_uuid -> (规则指纹, 主机表版本, 主机ID)
+_cache_lock = threading.Lock()
+CACHE_MAX_SIZE = 2000
+
+
+class DynamicRuleError(ValueError):
+    """动态分组规则不合法"""
+
+
+def compile_rule_item(item: dict, like_format: str = LIKE_PREFIX):
+    """单条规则 -> 参数化条件，字段和操作符都走白名单"""
+    query_name, query_conditions = item.get('query_name'), item.get('query_conditions')
+    column = dynamic_rule_columns.get(query_name)
+    if column is None:
+        raise DynamicRuleError(f"不支持的查询字段 {query_name}")
+    query_value = item.get('query_value')
+    query_value = '' if query_value is None else str(query_value)
+    if query_conditions == 'like':
+        return column.like(like_format.format(query_value))
+    if query_conditions == '=':
+        return column == query_value
+    if query_conditions == '!=':
+        return column != query_value
+    raise DynamicRuleError(f"不支持的查询条件 {query_conditions}")
+
+
+def compile_rules(rules: list, like_format: str = LIKE_PREFIX):
+    """
+    规则编译为 SQLAlchemy 条件，组内 AND，组间 OR
+    值全部以绑定参数传入，不再拼接SQL
+    """
+    groups = []
+    for rule in rules:
+        # 与原SQL一致，status 不参与匹配
+        items = rule if isinstance(rule, list) else [rule]
+        if items:
+            groups.append(and_(*[compile_rule_item(item, like_format) for item in items]))
+    if not groups:
+        raise DynamicRuleError("匹配规则为空")
+    return or_(*groups)
+
+
+def check_group_rules(group_info: dict) -> Optional[str]:
+    """检查已保存的通用型分组规则，返回错误信息，规则可用返回None"""
+    if group_info.get('dynamic_group_type') != 'normal':
+        return None
+    try:
+        compile_rules(group_info['dynamic_group_rules']['items'])
+    except (DynamicRuleError, TypeError, KeyError) as error:
+        return f"{group_info.get('dynamic_group_name')} 条件规则错误，{error}"
+    return None
+
+
+def get_rules_hash(rules: list, like_format: str) -> str:
+    return hashlib.md5(json.dumps([rules, like_format], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_rule_plan(exec_uuid: Optional[str], rules: list, like_format: str = LIKE_PREFIX) -> Tuple[str, Any]:
+    """按 exec_uuid 缓存编译结果，规则修改后指纹变化自动重新编译"""
+    rules_hash = get_rules_hash(rules, like_format)
+    if not exec_uuid:
+        return rules_hash, compile_rules(rules, like_format)
+    with _cache_lock:
+        cached = _rule_plan_cache.get(exec_uuid)
+        if cached and cached[0] == rules_hash:
+            return cached
+    plan = (rules_hash, compile_rules(rules, like_format))
+    with _cache_lock:
+        if len(_rule_plan_cache) >= CACHE_MAX_SIZE:
+            _rule_plan_cache.clear()
+        _rule_plan_cache[exec_uuid] = plan
+    return plan
+
+
+def get_server_version(session) -> tuple:
+    """
+    主机表版本：行数 + 最大ID + 最大更新时间，新增/删除/修改都会使版本变化
+    update_time 有索引，MAX 只读索引一端
+    """
+    the_model = AssetServerModels
+    count, max_id, max_update_time = session.query(func.count(the_model.id), func.max(the_model.id),
+                                                   func.max(the_model.update_time)).one()
+    return count, max_id, str(max_update_time)
+
+
+def invalidate_dynamic_hosts(*exec_uuids: str) -> None:
+    """清理动态分组主机缓存，不传则全部清理"""
+    with _cache_lock:
+        if not exec_uuids:
+            _rule_plan_cache.clear()
+            _dynamic_hosts_cache.clear()
+            return
+        for exec_uuid in exec_uuids:
+            _rule_plan_cache.pop(exec_uuid, None)
+            _dynamic_hosts_cache.pop(exec_uuid, None)
+
+
+def query_dynamic_hosts(group_info: dict, like_format: str = LIKE_PREFIX) -> Tuple[bool, list]:
+    """编译规则并查询主机ID，主机表版本未变化时直接返回缓存结果"""
+    try:
+        rules = group_info['dynamic_group_rules']['items']
+    except (TypeError, KeyError):
+        rules = []
+
+    if not rules:
+        logging.error(f"匹配规则出错")
+        return False, []
+
+    exec_uuid = group_info.get('exec_uuid')
+    try:
+        rules_hash, condition = get_rule_plan(exec_uuid, rules, like_format)
+    except DynamicRuleError as error:
+        logging.error(f"{exec_uuid} 动态分组规则错误 {error}")
+        return False, []
+
+    try:
+        with DBContext('r') as session:
+            version = get_server_version(session)
+            with _cache_lock:
+                cached = _dynamic_hosts_cache.get(exec_uuid) if exec_uuid else None
+            if cached and cached[0] == rules_hash and cached[1] == version:
+                return True, list(cached[2])
+
+            results = session.query(AssetServerModels.id).filter(condition).all()
+            server_list = [res[0] for res in results]
+    except Exception as error:
+        logging.error(f"{error}")
+        return False, []
+
+    # update_time 精度为秒，最近1秒内有变更时同一秒内可能还有写入，不缓存
+    latest = datetime.datetime.now() - datetime.timedelta(seconds=1)
+    if exec_uuid and version[2] < str(latest.replace(microsecond=0)):
+        with _cache_lock:
+            if len(_dynamic_hosts_cache) >= CACHE_MAX_SIZE:
+                _dynamic_hosts_cache.clear()
+            _dynamic_hosts_cache[exec_uuid] = (rules_hash, version, server_list)
+    return True, list(server_list)
+
+
 def get_dynamic_hosts(group_info: Optional[dict]) -> Tuple[bool, Union[list]]:
     """
     :param group_info:
@@ -299,42 +481,13 @@ def get_dynamic_hosts(group_info: Optional[dict]) -> Tuple[bool, Union[list]]:
             ]
         }
     }
-    根据动态分组ID获取主机信息
+    根据动态分组ID获取主机信息，规则之间为 OR，like 为包含匹配
     """
     if not isinstance(group_info, dict):
         logging.error(f"group_info类型错误")
         return False, []
 
-    # 根据规则查主机
-    try:
-        rules = group_info['dynamic_group_rules']['items']
-    except TypeError:
-        rules = []
-
-    if not rules:
-        logging.error(f"匹配规则出错")
-        return False, []
-
-    sql_string = """ SELECT id FROM t_asset_server WHERE name = ""\n """
-    # 查询条件
-    sql_conditions = ''
-    for rule in rules:
-        query_name = rule['query_name']
-        query_conditions = rule['query_conditions']
-        if query_conditions not in ['like', '=', '!=']: continue
-        query_value = f"%{rule['query_value']}%" if query_conditions == 'like' else f"{rule['query_value']}"
-        sql_conditions += f'or {query_name} {query_conditions} "{query_value}"\n'
-    # 拼接SQL
-    sql_string += sql_conditions
-    try:
-        with DBContext('r') as session:
-            results = session.execute(text(sql_string))
-            server_list = [res[0] for res in results]
-    except Exception as error:
-        logging.error(f"{error}")
-        return False, []
-
-    return True, server_list
+    return query_dynamic_hosts(group_info, LIKE_CONTAINS)
 
 
 def get_dynamic_hosts_v2(group_info: Optional[dict]) -> Tuple[bool, Union[list]]:
@@ -376,36 +529,293 @@ def get_dynamic_hosts_v2(group_info: Optional[dict]) -> Tuple[bool, Union[list]]
         },
         "modify_user": "None(None)"
     }
-    根据动态分组ID获取主机信息
+    根据动态分组ID获取主机信息，组内 AND，组间 OR，like 为前缀匹配
     """
     if not isinstance(group_info, dict):
         logging.error(f"group_info类型错误")
         return False, []
 
-    # 根据规则查主机
+    return query_dynamic_hosts(group_info, LIKE_PREFIX)
+
+
+DYNAMIC_GROUP_MEMBER_CHANNEL = "cmdb:dynamic_group_member_events"  # 分组成员变化事件
+DYNAMIC_GROUP_MEMBER_READY_KEY = "cmdb:dynamic_group_member:ready"  # 已物化的分组 exec_uuid -> 分组条件指纹
+MEMBER_CHUNK_SIZE = 1000
+MEMBER_CONDITION_BATCH = 100  # 单条SQL同时评估的分组数
+
+
+def get_group_fingerprint(group_info: dict) -> str:
+    """分组条件指纹，条件变化后需要全量重算成员"""
+    keys = ('dynamic_group_type', 'dynamic_group_rules', 'biz_id', 'env_name', 'region_name', 'module_name')
+    return hashlib.md5(json.dumps([group_info.get(k) for k in keys], sort_keys=True,
+                                  default=str).encode('utf-8')).hexdigest()
+
+
+def evaluate_group(group_info: dict) -> Tuple[bool, list]:
+    """按分组条件实时计算成员，权限分组没有类型字段，按业务型处理"""
+    group_type = group_info.get('dynamic_group_type', 'biz')
+    if group_type == 'normal':
+        return get_dynamic_hosts_v2(group_info)
+    if group_type == 'biz':
+        return get_dynamic_hosts_for_biz(group_info)
+    return True, []
+
+
+def mark_group_ready(exec_uuid: str, fingerprint: str) -> None:
     try:
-        rules = group_info['dynamic_group_rules']['items']
-    except TypeError:
-        rules = []
+        cache_conn().hset(DYNAMIC_GROUP_MEMBER_READY_KEY, exec_uuid, fingerprint)
+    except Exception as err:
+        logging.error(f"写入分组物化标记失败 {err}")
+
+
+def clear_group_ready(*exec_uuids: str) -> None:
+    if not exec_uuids:
+        return
+    try:
+        cache_conn().hdel(DYNAMIC_GROUP_MEMBER_READY_KEY, *exec_uuids)
+    except Exception as err:
+        logging.error(f"清理分组物化标记失败 {err}")
+
+
+def apply_member_changes(session, changes: Dict[str, Tuple[set, set]]) -> None:
+    """写入成员增减，新增使用 INSERT IGNORE，与并发重算互不冲突"""
+    now = datetime.datetime.now()
+    for exec_uuid, (added, removed) in changes.items():
+        added, removed = sorted(added), sorted(removed)
+        for i in range(0, len(added), MEMBER_CHUNK_SIZE):
+            session.execute(mysql_insert(DynamicGroupMemberModels).prefix_with('IGNORE').values([
+                dict(exec_uuid=exec_uuid, asset_id=asset_id, create_time=now, update_time=now)
+                for asset_id in added[i:i + MEMBER_CHUNK_SIZE]
+            ]))
+        for i in range(0, len(removed), MEMBER_CHUNK_SIZE):
+            session.query(DynamicGroupMemberModels).filter(
+                DynamicGroupMemberModels.exec_uuid == exec_uuid,
+                DynamicGroupMemberModels.asset_id.in_(removed[i:i + MEMBER_CHUNK_SIZE])
+            ).delete(synchronize_session=False)
+
+
+def publish_member_changes(changes: Dict[str, Tuple[set, set]]) -> None:
+    """发布分组成员变化，下游订阅 DYNAMIC_GROUP_MEMBER_CHANNEL 即可，无需轮询"""
+    changes = {exec_uuid: change for exec_uuid, change in changes.items() if change[0] or change[1]}
+    if not changes:
+        return
+    event_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        pipe = cache_conn().pipeline()
+        for exec_uuid, (added, removed) in changes.items():
+            pipe.publish(DYNAMIC_GROUP_MEMBER_CHANNEL, json.dumps(
+                dict(exec_uuid=exec_uuid, added=sorted(added), removed=sorted(removed), time=event_time)))
+        pipe.execute()
+    except Exception as err:
+        logging.error(f"发布分组成员变化失败 {err}")
+
+
+def refresh_group_members(group_info: dict) -> Tuple[bool, list]:
+    """全量重算单个分组的成员，只写入差异"""
+    exec_uuid = group_info.get('exec_uuid')
+    fingerprint = get_group_fingerprint(group_info)
+    is_success, result = evaluate_group(group_info)
+    if not is_success or not exec_uuid:
+        return is_success, result
+
+    asset_ids = set(result)
+    with DBContext('w', None, True) as session:
+        current = {asset_id for asset_id, in session.query(DynamicGroupMemberModels.asset_id).filter(
+            DynamicGroupMemberModels.exec_uuid == exec_uuid)}
+        changes = {exec_uuid: (asset_ids - current, current - asset_ids)}
+        apply_member_changes(session, changes)
+        session.commit()
+    publish_member_changes(changes)
+    mark_group_ready(exec_uuid, fingerprint)
+    return True, list(asset_ids)
+
+
+def refresh_dynamic_group(**filter_map) -> None:
+    """分组新增/修改后重算成员"""
+    try:
+        with DBContext('r') as session:
+            group = session.query(DynamicGroupModels).filter_by(**filter_map).first()
+            group_info = model_to_dict(group) if group else None
+        if group_info:
+            refresh_group_members(group_info)
+    except Exception as err:
+        logging.error(f"重算动态分组成员出错 {filter_map} {err}")
+
+
+def get_group_members(group_info: dict) -> Tuple[bool, list]:
+    """
+    读取物化的分组成员
+    分组未物化或分组条件已变化时全量重算一次，Redis不可用时退化为实时计算
+    """
+    exec_uuid = group_info.get('exec_uuid')
+    if not exec_uuid:
+        return evaluate_group(group_info)
+    try:
+        ready = cache_conn().hget(DYNAMIC_GROUP_MEMBER_READY_KEY, exec_uuid)
+    except Exception as err:
+        logging.error(f"读取分组物化标记失败 {err}")
+        return evaluate_group(group_info)
+
+    if not ready or convert(ready) != get_group_fingerprint(group_info):
+        return refresh_group_members(group_info)
+
+    with DBContext('r') as session:
+        members = session.query(DynamicGroupMemberModels.asset_id).filter(
+            DynamicGroupMemberModels.exec_uuid == exec_uuid).all()
+    return True, [asset_id for asset_id, in members]
+
+
+def get_normal_group_conditions(session) -> List[Tuple[str, Any]]:
+    """全部通用型分组的编译条件"""
+    conditions = []
+    for exec_uuid, rules in session.query(DynamicGroupModels.exec_uuid, DynamicGroupModels.dynamic_group_rules).filter(
+            DynamicGroupModels.dynamic_group_type == 'normal'):
+        try:
+            conditions.append((exec_uuid, get_rule_plan(exec_uuid, rules['items'])[1]))
+        except (DynamicRuleError, TypeError, KeyError) as error:
+            logging.error(f"{exec_uuid} 动态分组规则错误 {error}")
+    return conditions
 
-    if not rules:
-        logging.error(f"匹配规则出错")
-        return False, []
 
-    # 构建每个子条件的SQL语句
-    sub_queries = [
-        " AND ".join(f"{item['query_name']} {item['query_conditions']} '{item['query_value']}%'"
-                     if item['query_conditions'] == 'like' else f"{item['query_name']} {item['query_conditions']} '{item['query_value']}'"
-                     for item in rule) for rule in rules]
-    # 拼接多个条件的SQL语句
-    sql_string = f"SELECT id FROM t_asset_server WHERE 1=1 AND ({' OR '.join(f'({subquery})' for subquery in sub_queries)});"
+def refresh_server_members(server_ids: Iterable[int]) -> None:
+    """
+    主机变化后只对变化的主机重新评估全部通用型分组
+    每批主机一条SQL同时计算所有分组条件，再与现有成员比对
+    """
+    server_ids = sorted({server_id for server_id in server_ids if server_id})
+    if not server_ids:
+        return
 
     try:
+        changes = _refresh_server_members(server_ids)
+    except Exception as err:
+        logging.error(f"更新动态分组成员出错 {err}")
+        return
+    publish_member_changes(changes)
+
+
+def _refresh_server_members(server_ids: List[int]) -> Dict[str, Tuple[set, set]]:
+    changes: Dict[str, Tuple[set, set]] = {}
+    with DBContext('w', None, True) as session:
+        groups = get_normal_group_conditions(session)
+        if not groups:
+            return changes
+        group_ids = [exec_uuid for exec_uuid, _ in groups]
+        for i in range(0, len(server_ids), MEMBER_CHUNK_SIZE):
+            chunk = server_ids[i:i + MEMBER_CHUNK_SIZE]
+            matched, current = defaultdict(set), defaultdict(set)
+            for j in range(0, len(groups), MEMBER_CONDITION_BATCH):
+                batch = groups[j:j + MEMBER_CONDITION_BATCH]
+                rows = session.query(AssetServerModels.id, *[case((condition, 1), else_=0)
+                                                             for _, condition in batch]).filter(
+                    AssetServerModels.id.in_(chunk))
+                for row in rows:
+                    for (exec_uuid, _), hit in zip(batch, row[1:]):
+                        if hit:
+                            matched[exec_uuid].add(row[0])
+            for exec_uuid, asset_id in session.query(DynamicGroupMemberModels.exec_uuid,
+                                                     DynamicGroupMemberModels.asset_id).filter(
+                    DynamicGroupMemberModels.asset_id.in_(chunk), DynamicGroupMemberModels.exec_uuid.in_(group_ids)):
+                current[exec_uuid].add(asset_id)
+
+            for exec_uuid in group_ids:
+                added, removed = matched[exec_uuid] - current[exec_uuid], current[exec_uuid] - matched[exec_uuid]
+                if added or removed:
+                    change = changes.setdefault(exec_uuid, (set(), set()))
+                    change[0].update(added)
+                    change[1].update(removed)
+        apply_member_changes(session, changes)
+        session.commit()
+    return changes
+
+
+def update_dynamic_group_members(resource_type: str, instance_ids: List[str]) -> None:
+    """同步写入后按实例ID增量维护分组成员，只处理主机"""
+    if resource_type != 'server' or not instance_ids:
+        return
+    try:
+        server_ids = []
         with DBContext('r') as session:
-            results = session.execute(text(sql_string))
-            server_list = [res[0] for res in results]
-    except Exception as error:
-        logging.error(f"{error}")
-        return False, []
+            for i in range(0, len(instance_ids), MEMBER_CHUNK_SIZE):
+                server_ids.extend(server_id for server_id, in session.query(AssetServerModels.id).filter(
+                    AssetServerModels.instance_id.in_(instance_ids[i:i + MEMBER_CHUNK_SIZE])))
+        refresh_server_members(server_ids)
+    except Exception as err:
+        logging.error(f"更新动态分组成员出错 {err}")
+
+
+def update_dynamic_group_members_by_agents(agent_ids: Iterable[str]) -> None:
+    """Agent状态变化后增量维护分组成员"""
+    agent_ids = list(agent_ids)
+    if not agent_ids:
+        return
+    try:
+        server_ids = []
+        with DBContext('r') as session:
+            for i in range(0, len(agent_ids), MEMBER_CHUNK_SIZE):
+                server_ids.extend(server_id for server_id, in session.query(AssetServerModels.id).filter(
+                    AssetServerModels.agent_id.in_(agent_ids[i:i + MEMBER_CHUNK_SIZE])))
+        refresh_server_members(server_ids)
+    except Exception as err:
+        logging.error(f"更新动态分组成员出错 {err}")
+
+
+def refresh_biz_members(*biz_ids: str) -> None:
+    """服务树变化后重算对应业务的业务型分组和权限分组"""
+    biz_ids = {str(biz_id) for biz_id in biz_ids if biz_id}
+    if not biz_ids:
+        return
+    try:
+        with DBContext('r') as session:
+            groups = [model_to_dict(group) for group in session.query(DynamicGroupModels).filter(
+                DynamicGroupModels.dynamic_group_type == 'biz', DynamicGroupModels.biz_id.in_(biz_ids))]
+            groups.extend(model_to_dict(group) for group in session.query(PermissionGroupModels).filter(
+                PermissionGroupModels.biz_id.in_(biz_ids)))
+        for group_info in groups:
+            refresh_group_members(group_info)
+    except Exception as err:
+        logging.error(f"更新业务分组成员出错 {biz_ids} {err}")
 
-    return True, server_list
\ No newline at end of file
+
+def async_refresh_biz_members(*biz_ids: str) -> None:
+    if biz_ids:
+        global_executors.general_executor.submit(refresh_biz_members, *biz_ids)
+
+
+def rebuild_dynamic_group_members() -> None:
+    """全量对账，补齐未走增量的写入（过期标记、手工SQL等），并清理已删除分组的成员"""
+    with DBContext('r') as session:
+        groups = [model_to_dict(group) for group in session.query(DynamicGroupModels)]
+        groups.extend(model_to_dict(group) for group in session.query(PermissionGroupModels))
+        member_groups = {exec_uuid for exec_uuid, in session.query(DynamicGroupMemberModels.exec_uuid).distinct()}
+
+    for group_info in groups:
+        rule_error = check_group_rules(group_info)
+        if rule_error:
+            logging.error(f"{group_info.get('exec_uuid')} {rule_error}，请修改分组规则")
+            continue
+        try:
+            refresh_group_members(group_info)
+        except Exception as err:
+            logging.error(f"重算分组成员出错 {group_info.get('exec_uuid')} {err}")
+
+    orphans = list(member_groups - {group_info.get('exec_uuid') for group_info in groups})
+    if orphans:
+        with DBContext('w', None, True) as session:
+            session.query(DynamicGroupMemberModels).filter(DynamicGroupMemberModels.exec_uuid.in_(orphans)).delete(
+                synchronize_session=False)
+        clear_group_ready(*orphans)
+    logging.info(f"动态分组成员对账完成 分组:{len(groups)} 清理:{len(orphans)}")
+
+
+def del_dynamic_group_for_api(data: dict) -> dict:
+    """删除动态分组，同时清理物化的成员"""
+    with DBContext('r') as session:
+        group_info = session.query(DynamicGroupModels.exec_uuid).filter(DynamicGroupModels.id == data.get('id')).first()
+    res = opt_obj.handle_delete(data)
+    if group_info and res.get('code') == 0:
+        with DBContext('w', None, True) as session:
+            session.query(DynamicGroupMemberModels).filter(
+                DynamicGroupMemberModels.exec_uuid == group_info.exec_uuid).delete(synchronize_session=False)
+        clear_group_ready(group_info.exec_uuid)
+    return res
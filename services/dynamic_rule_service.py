@@ -17,6 +17,9 @@ from models.business import DynamicRulesModels, BizModels
 from websdk2.model_utils import GetInsertOrUpdateObj
 from models import TreeAssetModels
 from models.tree import TreeModels
+from services.tree_count_service import invalidate_biz_counts
+from services.dynamic_group_service import async_refresh_biz_members
+from libs.consul_registry import mark_consul_dirty
 from models import asset_mapping, des_rule_type_mapping, operator_list
 from websdk2.model_utils import CommonOptView
 
@@ -190,6 +193,11 @@ def del_relational_asset(data: dict) -> dict:
     asset_set = set([i.get('id') for i in asset_list])  ### 正则匹配数据的资产ID集合
 
     with DBContext('w', None, True) as session:
+        biz_ids = [biz_id for biz_id, in session.query(TreeAssetModels.biz_id).filter(
+            TreeAssetModels.asset_id.in_(asset_set)).distinct()]
         session.query(TreeAssetModels).filter(
             TreeAssetModels.asset_id.in_(asset_set)).delete(synchronize_session=False)
+    invalidate_biz_counts(*biz_ids)
+    async_refresh_biz_members(*biz_ids)
+    mark_consul_dirty('tree_asset')
     return dict(code=0, msg=f"删除关联关系 {len(asset_set)} 条")
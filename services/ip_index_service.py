@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Date    : 2026/10/18
+Desc    : IP索引，资产IP拆分后入库，进程内基数树支持精确和网段查询
+"""
+import ipaddress
+import logging
+import re
+import threading
+import time
+from typing import *
+
+from websdk2.db_context import DBContextV2 as DBContext
+from websdk2.model_utils import queryset_to_list
+
+from libs.ip_radix import IPRadixTree, parse_ip
+from libs.thread_pool import global_executors
+from models.asset import AssetEIPModels, AssetIPIndexModels, AssetServerModels
+
+# 资产类型 -> (Models, {ip_type: 字段})
+ip_index_mapping: Dict[str, Tuple[Any, Dict[str, str]]] = {
+    'server': (AssetServerModels, {'inner': 'inner_ip', 'outer': 'outer_ip'}),
+    'eip': (AssetEIPModels, {'outer': 'address'}),
+}
+
+IP_INDEX_CHUNK_SIZE = 500
+IP_TREE_TTL = 60  # 进程内基数树重建间隔(秒)
+IP_TREE_RETRY = 10  # 重建失败后的重试间隔(秒)
+
+_ip_tree: Optional[IPRadixTree] = None
+_ip_tree_built_at = 0.0  # 上次重建时间，失败时前移以控制重试间隔
+_ip_tree_init_lock = threading.Lock()  # 首次构建，其他线程等待同一次构建
+_ip_tree_rebuild_lock = threading.Lock()  # 同一时刻只有一个线程重建
+
+
+def split_ips(value: Any) -> List[str]:
+    """多网卡主机IP以逗号等分隔，拆分并过滤非法地址"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [ip for item in value for ip in split_ips(item)]
+    return [str(ip_obj) for ip_obj in map(parse_ip, re.split(r'[,;\s]+', str(value))) if ip_obj]
+
+
+def build_ip_rows(asset_type: str, asset: Any) -> List[dict]:
+    _, fields = ip_index_mapping[asset_type]
+    rows = []
+    for ip_type, field in fields.items():
+        for ip in dict.fromkeys(split_ips(getattr(asset, field, None))):
+            ip_obj = ipaddress.ip_address(ip)
+            rows.append(dict(asset_type=asset_type, asset_id=asset.id, ip_type=ip_type, ip=ip,
+                             ip_version=ip_obj.version, ip_value=ip_obj.packed))
+    return rows
+
+
+def save_ip_index(session, asset_type: str, assets: List[Any]) -> int:
+    """先删后插，资产IP变化时旧地址一并清理"""
+    if not assets:
+        return 0
+    session.query(AssetIPIndexModels).filter(
+        AssetIPIndexModels.asset_type == asset_type,
+        AssetIPIndexModels.asset_id.in_([asset.id for asset in assets])).delete(synchronize_session=False)
+    rows = [row for asset in assets for row in build_ip_rows(asset_type, asset)]
+    if rows:
+        session.bulk_insert_mappings(AssetIPIndexModels, rows)
+    return len(rows)
+
+
+def update_ip_index(asset_type: str, instance_ids: List[str]) -> None:
+    """同步写入后按实例ID更新IP索引"""
+    if asset_type not in ip_index_mapping or not instance_ids:
+        return
+    model, _ = ip_index_mapping[asset_type]
+    try:
+        with DBContext('w', None, True) as session:
+            for i in range(0, len(instance_ids), IP_INDEX_CHUNK_SIZE):
+                assets = session.query(model).filter(
+                    model.instance_id.in_(instance_ids[i:i + IP_INDEX_CHUNK_SIZE])).all()
+                save_ip_index(session, asset_type, assets)
+            session.commit()
+    except Exception as err:
+        logging.error(f"更新IP索引失败 {asset_type}: {err}")
+
+
+def rebuild_ip_index() -> None:
+    """全量重建IP索引，清理已删除资产"""
+    for asset_type, (model, _) in ip_index_mapping.items():
+        count = 0
+        with DBContext('w', None, True) as session:
+            session.query(AssetIPIndexModels).filter(
+                AssetIPIndexModels.asset_type == asset_type).delete(synchronize_session=False)
+            last_id = 0
+            while True:
+                assets = session.query(model).filter(model.id > last_id).order_by(model.id).limit(
+                    IP_INDEX_CHUNK_SIZE).all()
+                if not assets:
+                    break
+                rows = [row for asset in assets for row in build_ip_rows(asset_type, asset)]
+                if rows:
+                    session.bulk_insert_mappings(AssetIPIndexModels, rows)
+                count += len(rows)
+                last_id = assets[-1].id
+            session.commit()
+        logging.info(f"重建IP索引完成 {asset_type}: {count}")
+
+
+def has_ip_index(session) -> bool:
+    return session.query(AssetIPIndexModels.id).limit(1).first() is not None
+
+
+def build_ip_tree() -> IPRadixTree:
+    tree = IPRadixTree()
+    with DBContext('r') as session:
+        for ip, asset_type, asset_id, ip_type in session.query(
+                AssetIPIndexModels.ip, AssetIPIndexModels.asset_type, AssetIPIndexModels.asset_id,
+                AssetIPIndexModels.ip_type).yield_per(5000):
+            tree.insert(ip, (asset_type, asset_id, ip_type, ip))
+    return tree
+
+
+def rebuild_ip_tree() -> Optional[IPRadixTree]:
+    """重建基数树后整体替换引用，查询方不加锁；失败时保留旧树，IP_TREE_RETRY后再重试"""
+    global _ip_tree, _ip_tree_built_at
+    if not _ip_tree_rebuild_lock.acquire(blocking=False):
+        return None
+    try:
+        # 排队期间其他线程可能已经重建
+        if _ip_tree is not None and time.time() - _ip_tree_built_at < IP_TREE_TTL:
+            return _ip_tree
+        tree = build_ip_tree()
+        _ip_tree, _ip_tree_built_at = tree, time.time()
+        return tree
+    except Exception as err:
+        _ip_tree_built_at = time.time() - IP_TREE_TTL + IP_TREE_RETRY
+        logging.error(f"重建IP基数树失败: {err}")
+        return None
+    finally:
+        _ip_tree_rebuild_lock.release()
+
+
+def get_ip_tree() -> IPRadixTree:
+    """进程内基数树，过期后在后台重建，重建期间继续使用旧树"""
+    tree = _ip_tree
+    if tree is not None:
+        if time.time() - _ip_tree_built_at >= IP_TREE_TTL and not _ip_tree_rebuild_lock.locked():
+            global_executors.general_executor.submit(rebuild_ip_tree)
+        return tree
+    with _ip_tree_init_lock:
+        if _ip_tree is None and time.time() - _ip_tree_built_at >= IP_TREE_TTL:
+            rebuild_ip_tree()
+    if _ip_tree is None:
+        raise RuntimeError("IP索引加载失败")
+    return _ip_tree
+
+
+def get_asset_ids_by_ip(ip: str, asset_type: str = 'server', ip_type: Optional[str] = 'inner') -> List[int]:
+    """根据IP精确查询资产ID，兼容多网卡主机"""
+    try:
+        return list({asset_id for _type, asset_id, _ip_type, _ in get_ip_tree().exact(ip)
+                     if _type == asset_type and (not ip_type or _ip_type == ip_type)})
+    except Exception as err:
+        logging.error(f"查询IP索引失败 {ip}: {err}")
+        return []
+
+
+def get_assets_in_subnet_by_api(**params) -> dict:
+    """查询网段内的资产"""
+    cidr = params.get('cidr')
+    asset_type = params.get('asset_type')
+    ip_type = params.get('ip_type')
+    if not cidr:
+        return dict(code=-1, msg='缺少网段参数cidr')
+    if asset_type and asset_type not in ip_index_mapping:
+        return dict(code=-1, msg=f'不支持的资产类型 {asset_type}')
+    try:
+        matched = get_ip_tree().in_network(cidr)
+    except ValueError:
+        return dict(code=-1, msg=f'网段格式错误 {cidr}')
+    except RuntimeError as err:
+        return dict(code=-2, msg=str(err))
+
+    asset_ips: Dict[str, Dict[int, List[str]]] = {}
+    for _type, asset_id, _ip_type, ip in matched:
+        if (asset_type and _type != asset_type) or (ip_type and _ip_type != ip_type):
+            continue
+        asset_ips.setdefault(_type, {}).setdefault(asset_id, []).append(ip)
+
+    data = {}
+    with DBContext('r') as session:
+        for _type, ips in asset_ips.items():
+            model, _ = ip_index_mapping[_type]
+            assets = queryset_to_list(session.query(model).filter(model.id.in_(list(ips))).all())
+            for asset in assets:
+                asset['matched_ips'] = ips.get(asset['id'], [])
+            data[_type] = assets
+    return dict(code=0, msg='获取成功', count=sum(len(i) for i in data.values()), data=data)
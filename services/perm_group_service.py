@@ -15,7 +15,7 @@ from websdk2.model_utils import CommonOptView, model_to_dict
 
 from models.business import PermissionGroupModels
 from models.asset import AssetServerModels
-from services.dynamic_group_service import get_dynamic_hosts_for_biz
+from services.dynamic_group_service import get_group_members
 
 opt_obj = CommonOptView(PermissionGroupModels)
 
@@ -138,7 +138,7 @@ def preview_perm_group_for_api(exec_uuid_list: list) -> dict:
             if not group_info:
                 return dict(code=-1, msg='权限分组ID不存在', data=[])
 
-            is_success, result = get_dynamic_hosts_for_biz(model_to_dict(group_info))
+            is_success, result = get_group_members(model_to_dict(group_info))
             if not is_success or not result:
                 logging.error(f"biz {exec_id} 没有发现主机信息")
             res_list.extend(result)
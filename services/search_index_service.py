@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Date    : 2026/10/18
+Desc    : 全局搜索索引，名称/IP/实例ID/地址和扩展字段拼接后写入ngram全文索引
+"""
+import json
+import logging
+from typing import *
+
+from sqlalchemy import exists, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.mysql import match
+from websdk2.db_context import DBContextV2 as DBContext
+
+from models.asset import (
+    AssetLBModels,
+    AssetMySQLModels,
+    AssetNatModels,
+    AssetRedisModels,
+    AssetSearchIndexModels,
+    AssetServerModels,
+)
+
+# 资产类型 -> (Models, 检索字段)，与原LIKE查询的字段保持一致
+# 解析记录由多处同步/手动接口写入，不建索引，检索时直接查表
+search_index_mapping: Dict[str, Tuple[Any, List[str]]] = {
+    'server': (AssetServerModels, ['name', 'instance_id', 'inner_ip', 'outer_ip']),
+    'mysql': (AssetMySQLModels, ['name', 'instance_id', 'db_address', 'ext_info']),
+    'redis': (AssetRedisModels, ['name', 'instance_id', 'instance_address', 'ext_info']),
+    'lb': (AssetLBModels, ['name', 'instance_id', 'dns_name', 'lb_vip', 'ext_info']),
+    'nat': (AssetNatModels, ['name', 'instance_id', 'outer_ip']),
+}
+
+SEARCH_INDEX_CHUNK_SIZE = 500
+SEARCH_CONTENT_MAX_LENGTH = 16000
+NGRAM_TOKEN_SIZE = 2  # 与MySQL ngram_token_size一致，短于该长度的关键字走LIKE
+
+
+def flatten_values(value: Any) -> Generator[str, None, None]:
+    """展开JSON字段中的所有标量值"""
+    if value is None or value == '':
+        return
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            yield value
+            return
+        if isinstance(parsed, (dict, list)):
+            yield from flatten_values(parsed)
+        else:
+            yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from flatten_values(v)
+    elif isinstance(value, (list, tuple, set)):
+        for v in value:
+            yield from flatten_values(v)
+    else:
+        yield str(value)
+
+
+def build_search_content(asset_type: str, asset: Any) -> str:
+    """拼接检索内容，按出现顺序去重"""
+    _, fields = search_index_mapping[asset_type]
+    tokens = dict.fromkeys(token.strip() for field in fields
+                           for token in flatten_values(getattr(asset, field, None)) if token and token.strip())
+    return " ".join(tokens)[:SEARCH_CONTENT_MAX_LENGTH]
+
+
+def save_search_index(session, asset_type: str, assets: Iterable[Any]) -> int:
+    values = [dict(asset_type=asset_type, asset_id=asset.id, content=build_search_content(asset_type, asset))
+              for asset in assets]
+    if not values:
+        return 0
+    stmt = mysql_insert(AssetSearchIndexModels).values(values)
+    session.execute(stmt.on_duplicate_key_update(content=stmt.inserted.content, update_time=func.now()))
+    return len(values)
+
+
+def update_search_index(asset_type: str, instance_ids: List[str]) -> None:
+    """同步写入后按实例ID更新索引，只处理新增/变化的资产"""
+    if asset_type not in search_index_mapping or not instance_ids:
+        return
+    model, _ = search_index_mapping[asset_type]
+    try:
+        with DBContext('w', None, True) as session:
+            for i in range(0, len(instance_ids), SEARCH_INDEX_CHUNK_SIZE):
+                assets = session.query(model).filter(
+                    model.instance_id.in_(instance_ids[i:i + SEARCH_INDEX_CHUNK_SIZE])).all()
+                save_search_index(session, asset_type, assets)
+            session.commit()
+    except Exception as err:
+        logging.error(f"更新搜索索引失败 {asset_type}: {err}")
+
+
+def refresh_search_index(asset_type: str, asset_ids: List[int]) -> None:
+    """手动新增/修改/删除资产后按资产ID刷新索引，已删除的资产同时删除索引"""
+    asset_ids = [asset_id for asset_id in asset_ids if asset_id]
+    if asset_type not in search_index_mapping or not asset_ids:
+        return
+    model, _ = search_index_mapping[asset_type]
+    try:
+        with DBContext('w', None, True) as session:
+            for i in range(0, len(asset_ids), SEARCH_INDEX_CHUNK_SIZE):
+                chunk = asset_ids[i:i + SEARCH_INDEX_CHUNK_SIZE]
+                assets = session.query(model).filter(model.id.in_(chunk)).all()
+                save_search_index(session, asset_type, assets)
+                deleted = set(chunk) - {asset.id for asset in assets}
+                if deleted:
+                    session.query(AssetSearchIndexModels).filter(
+                        AssetSearchIndexModels.asset_type == asset_type,
+                        AssetSearchIndexModels.asset_id.in_(deleted)
+                    ).delete(synchronize_session=False)
+            session.commit()
+    except Exception as err:
+        logging.error(f"刷新搜索索引失败 {asset_type}: {err}")
+
+
+def rebuild_search_index() -> None:
+    """全量重建索引，并清理已删除资产的索引"""
+    for asset_type, (model, _) in search_index_mapping.items():
+        count = 0
+        with DBContext('w', None, True) as session:
+            last_id = 0
+            while True:
+                assets = session.query(model).filter(model.id > last_id).order_by(model.id).limit(
+                    SEARCH_INDEX_CHUNK_SIZE).all()
+                if not assets:
+                    break
+                count += save_search_index(session, asset_type, assets)
+                last_id = assets[-1].id
+                session.commit()
+            session.query(AssetSearchIndexModels).filter(
+                AssetSearchIndexModels.asset_type == asset_type,
+                ~exists().where(model.id == AssetSearchIndexModels.asset_id)
+            ).delete(synchronize_session=False)
+            session.commit()
+        logging.info(f"重建搜索索引完成 {asset_type}: {count}")
+    # 清理已不建索引的类型
+    with DBContext('w', None, True) as session:
+        session.query(AssetSearchIndexModels).filter(
+            AssetSearchIndexModels.asset_type.notin_(list(search_index_mapping))
+        ).delete(synchronize_session=False)
+        session.commit()
+
+
+def has_search_index(session) -> bool:
+    return session.query(AssetSearchIndexModels.id).limit(1).first() is not None
+
+
+def search_asset_ids(session, value: str, limit: int = 10) -> Dict[str, List[int]]:
+    """
+    一次查询返回每种资产类型前limit个匹配的资产ID
+    ngram短语检索支持子串匹配
+    """
+    if len(value) >= NGRAM_TOKEN_SIZE:
+        phrase = value.replace('"', ' ')
+        condition = match(AssetSearchIndexModels.content, against=f'"{phrase}"').in_boolean_mode()
+    else:
+        condition = AssetSearchIndexModels.content.like(f'%{value}%')
+
+    ranked = session.query(
+        AssetSearchIndexModels.asset_type, AssetSearchIndexModels.asset_id,
+        func.row_number().over(partition_by=AssetSearchIndexModels.asset_type,
+                               order_by=AssetSearchIndexModels.asset_id.desc()).label('rn')
+    ).filter(condition).subquery()
+    rows = session.query(ranked.c.asset_type, ranked.c.asset_id).filter(ranked.c.rn <= limit).all()
+
+    result: Dict[str, List[int]] = {asset_type: [] for asset_type in search_index_mapping}
+    for asset_type, asset_id in rows:
+        # 重建前可能残留已不建索引的类型
+        if asset_type in result:
+            result[asset_type].append(asset_id)
+    return result
@@ -1,5 +1,7 @@
-from typing import List, Dict, Any
+import logging
+from typing import List, Dict, Any, Callable
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 
 from sqlalchemy import or_
 from websdk2.db_context import DBContextV2 as DBContext
@@ -7,7 +9,8 @@ from websdk2.sqlalchemy_pagination import paginate
 from models.business import BizModels
 from models import AssetServerModels, AssetMySQLModels, AssetRedisModels, AssetLBModels, TreeAssetModels, AssetNatModels
 from models.domain import DomainRecords
-from websdk2.model_utils import CommonOptView
+from websdk2.model_utils import CommonOptView, queryset_to_list
+from services.search_index_service import search_index_mapping, has_search_index, search_asset_ids
 
 opt_obj = CommonOptView(BizModels)
 
@@ -76,9 +79,40 @@ def get_asset_list(**params) -> dict:
     if not value:
         return dict(code=-1, msg='当前方法必须传入查询参数')
 
+    # 传入分页参数时按原方式分页查询，否则只取前N条，不做COUNT
+    if any(params.get(key) for key in SEARCH_PAGE_KEYS):
+        return get_asset_list_by_page(value, **params)
+
     page_size = 10  # 固定最多查询
     params['page_size'] = page_size
 
+    with DBContext('r') as session:
+        # 索引未建立时退回到逐表LIKE查询
+        if has_search_index(session):
+            # 解析记录不建索引，与索引查询并行直接查表
+            dns_future = _search_executor.submit(search_source, 'dns_data', value, page_size)
+            asset_ids = search_asset_ids(session, value, limit=page_size)
+            result = {f"{asset_type}_data": get_assets_by_ids(session, asset_type, ids)
+                      for asset_type, ids in asset_ids.items()}
+            result['tree_asset_data'] = get_tree_asset_data_by_server_ids(session, asset_ids.get('server', []),
+                                                                          params)
+            timeout_sources = []
+            try:
+                result['dns_data'] = dns_future.result(timeout=SEARCH_SOURCE_TIMEOUT)
+            except Exception as err:
+                logging.error(f"全局搜索 dns_data 查询出错 {err}")
+                result['dns_data'] = []
+                timeout_sources.append('dns_data')
+            return dict(msg='获取成功', code=0, timeout_sources=timeout_sources, **result)
+    return get_asset_list_by_like(value, page_size)
+
+
+SEARCH_PAGE_KEYS = ('page_number', 'page_size')
+
+
+def get_asset_list_by_page(value: str, **params) -> dict:
+    """分页查询各数据源，分页参数透传给paginate"""
+    params.setdefault('page_size', 10)
     with DBContext('r') as session:
         server_data = paginate(session.query(AssetServerModels).filter(_get_server_value(value)), **params)
         mysql_data = paginate(session.query(AssetMySQLModels).filter(_get_mysql_value(value)), **params)
@@ -86,23 +120,102 @@ def get_asset_list(**params) -> dict:
         lb_data = paginate(session.query(AssetLBModels).filter(_get_lb_value(value)), **params)
         dns_data = paginate(session.query(DomainRecords).filter(_get_dns_value(value)), **params)
         nat_data = paginate(session.query(AssetNatModels).filter(_get_nat_value(value)), **params)
-        tree_asset_data = get_tree_asset_data(session, value, params)
+        tree_page = paginate(_tree_asset_query(session, value), **dict(params, items_not_to_list=True))
+    TreeAsset = namedtuple('TreeAsset', ['biz_id', 'biz_en_name', 'biz_cn_name', 'env_name', 'region_name',
+                                         'module_name', 'inner_ip', 'is_enable'])
+    tree_asset_data = [TreeAsset(*item)._asdict() for item in tree_page.items]
     return dict(msg='获取成功', code=0, server_data=server_data.items, mysql_data=mysql_data.items,
                 redis_data=redis_data.items, lb_data=lb_data.items, dns_data=dns_data.items,
-                tree_asset_data=tree_asset_data, nat_data=nat_data.items)
+                tree_asset_data=tree_asset_data, nat_data=nat_data.items, timeout_sources=[])
 
 
-def get_tree_asset_data(session, value: str = None, params: dict = None) -> List[Dict[str, Any]]:
-    TreeAsset = namedtuple('TreeAsset', ['biz_id', 'biz_en_name', 'biz_cn_name', 'env_name', 'region_name',
-                                         'module_name', 'inner_ip', 'is_enable'])
-    params.update(items_not_to_list=True)
-    page = paginate(session.query(TreeAssetModels.biz_id, BizModels.biz_en_name, BizModels.biz_cn_name,
-                                  TreeAssetModels.env_name, TreeAssetModels.region_name, TreeAssetModels.module_name,
-                                  AssetServerModels.inner_ip, TreeAssetModels.is_enable).
-                    outerjoin(BizModels, BizModels.biz_id == TreeAssetModels.biz_id).
-                    outerjoin(AssetServerModels, AssetServerModels.id == TreeAssetModels.asset_id).
-                    filter(TreeAssetModels.asset_type == "server", _get_server_value(value)), **params)
+def search_index_ready() -> bool:
+    with DBContext('r') as session:
+        return has_search_index(session)
+
+
+def get_assets_by_ids(session, asset_type: str, ids: List[int]) -> List[dict]:
+    if not ids:
+        return []
+    model, _ = search_index_mapping[asset_type]
+    assets = {asset.id: asset for asset in session.query(model).filter(model.id.in_(ids))}
+    return queryset_to_list([assets[i] for i in ids if i in assets])
 
-    tree_asset_data = [TreeAsset(*item)._asdict() for item in page.items]
-    return tree_asset_data
 
+SEARCH_SOURCE_TIMEOUT = 3  # 单个数据源查询超时(秒)
+_search_executor = ThreadPoolExecutor(max_workers=14, thread_name_prefix="asset-search")
+
+
+def _tree_asset_query(session, value: str):
+    return session.query(TreeAssetModels.biz_id, BizModels.biz_en_name, BizModels.biz_cn_name,
+                         TreeAssetModels.env_name, TreeAssetModels.region_name, TreeAssetModels.module_name,
+                         AssetServerModels.inner_ip, TreeAssetModels.is_enable). \
+        outerjoin(BizModels, BizModels.biz_id == TreeAssetModels.biz_id). \
+        outerjoin(AssetServerModels, AssetServerModels.id == TreeAssetModels.asset_id). \
+        filter(TreeAssetModels.asset_type == "server", _get_server_value(value))
+
+
+# 数据源 -> 生成查询的函数
+search_source_mapping: Dict[str, Callable] = {
+    'server_data': lambda session, value: session.query(AssetServerModels).filter(_get_server_value(value)),
+    'mysql_data': lambda session, value: session.query(AssetMySQLModels).filter(_get_mysql_value(value)),
+    'redis_data': lambda session, value: session.query(AssetRedisModels).filter(_get_redis_value(value)),
+    'lb_data': lambda session, value: session.query(AssetLBModels).filter(_get_lb_value(value)),
+    'dns_data': lambda session, value: session.query(DomainRecords).filter(_get_dns_value(value)),
+    'nat_data': lambda session, value: session.query(AssetNatModels).filter(_get_nat_value(value)),
+    'tree_asset_data': _tree_asset_query,
+}
+
+
+def search_source(source: str, value: str, limit: int = 10, timeout: float = SEARCH_SOURCE_TIMEOUT) -> list:
+    """
+    单个数据源查询，独立读连接，只取前limit条不做COUNT，MySQL侧同样限制执行时间
+    """
+    with DBContext('r') as session:
+        query = search_source_mapping[source](session, value).prefix_with(
+            f"/*+ MAX_EXECUTION_TIME({int(timeout * 1000)}) */").limit(limit)
+        if source == 'tree_asset_data':
+            TreeAsset = namedtuple('TreeAsset', ['biz_id', 'biz_en_name', 'biz_cn_name', 'env_name', 'region_name',
+                                                 'module_name', 'inner_ip', 'is_enable'])
+            return [TreeAsset(*item)._asdict() for item in query.all()]
+        return queryset_to_list(query.all())
+
+
+def submit_search_sources(value: str, limit: int = 10) -> Dict[str, Future]:
+    """各数据源并发查询"""
+    return {source: _search_executor.submit(search_source, source, value, limit) for source in search_source_mapping}
+
+
+def get_asset_list_by_like(value: str, limit: int = 10, timeout: float = SEARCH_SOURCE_TIMEOUT) -> dict:
+    """
+    并发LIKE查询，超时或出错的数据源返回空列表并在timeout_sources中标出
+    """
+    futures = submit_search_sources(value, limit)
+    wait(futures.values(), timeout=timeout)
+    result, timeout_sources = {}, []
+    for source, future in futures.items():
+        try:
+            result[source] = future.result(timeout=0) if future.done() else None
+        except Exception as err:
+            logging.error(f"全局搜索 {source} 查询出错 {err}")
+            result[source] = None
+        if result[source] is None:
+            result[source] = []
+            timeout_sources.append(source)
+    return dict(msg='获取成功', code=0, timeout_sources=timeout_sources, **result)
+
+
+def get_tree_asset_data_by_server_ids(session, server_ids: List[int], params: dict) -> List[Dict[str, Any]]:
+    """根据索引命中的主机查询服务树挂载信息"""
+    if not server_ids:
+        return []
+    TreeAsset = namedtuple('TreeAsset', ['biz_id', 'biz_en_name', 'biz_cn_name', 'env_name', 'region_name',
+                                         'module_name', 'inner_ip', 'is_enable'])
+    items = session.query(TreeAssetModels.biz_id, BizModels.biz_en_name, BizModels.biz_cn_name,
+                          TreeAssetModels.env_name, TreeAssetModels.region_name, TreeAssetModels.module_name,
+                          AssetServerModels.inner_ip, TreeAssetModels.is_enable). \
+        outerjoin(BizModels, BizModels.biz_id == TreeAssetModels.biz_id). \
+        outerjoin(AssetServerModels, AssetServerModels.id == TreeAssetModels.asset_id). \
+        filter(TreeAssetModels.asset_type == "server", TreeAssetModels.asset_id.in_(server_ids)). \
+        limit(params.get('page_size', 10)).all()
+    return [TreeAsset(*item)._asdict() for item in items]
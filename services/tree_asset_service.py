@@ -14,6 +14,7 @@ from functools import lru_cache
 from sqlalchemy import func, or_, event, and_
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
 from websdk2.model_utils import model_to_dict, queryset_to_list
 from websdk2.db_context import DBContextV2 as DBContext
 from websdk2.sqlalchemy_pagination import paginate
@@ -26,6 +27,10 @@ from models.agent import AgentModels
 from models import asset_mapping as mapping
 from services.audit_service import audit_log
 from services.tree_service import generate_tree_message
+from services.tree_count_service import apply_count_changes, invalidate_biz_counts
+from services.ip_index_service import get_asset_ids_by_ip
+from services.dynamic_group_service import async_refresh_biz_members
+from libs.consul_registry import mark_consul_dirty
 from libs.api_gateway.jumpserver.asset_hosts import jms_asset_host_api
 from services.asset_server_service import _get_server_by_val, _models_to_list
 
@@ -326,6 +331,9 @@ def update_tree_leaf(data: dict) -> dict:
         else:
             return {"code": -2, "msg": "参数错误"}
 
+    invalidate_biz_counts(biz_id)
+    async_refresh_biz_members(biz_id)
+    mark_consul_dirty('tree_leaf')
     return {"code": 0, "msg": "变更成功"}
 
 
@@ -385,6 +393,9 @@ def del_tree_leaf(data: dict) -> dict:
                                              ).delete(synchronize_session=False)
         else:
             return {"code": -2, "msg": "参数错误"}
+    invalidate_biz_counts(biz_id)
+    async_refresh_biz_members(biz_id)
+    mark_consul_dirty('tree_leaf')
     return {"code": 0, "msg": "删除成功"}
 
 
@@ -869,6 +880,14 @@ def _get_biz_value(value: str = None):
     )
 
 
+def _get_inner_ip_value(model, inner_ip: str):
+    """内网IP精确匹配，多网卡主机通过IP索引匹配"""
+    asset_ids = get_asset_ids_by_ip(inner_ip) if inner_ip else []
+    if not asset_ids:
+        return model.inner_ip == inner_ip
+    return or_(model.inner_ip == inner_ip, model.id.in_(asset_ids))
+
+
 # 根据服务器内网IP查询主机拓扑
 def get_server_tree_for_api(**params: Dict[str, Any]) -> dict:
     asset_type = 'server'
@@ -879,7 +898,7 @@ def get_server_tree_for_api(**params: Dict[str, Any]) -> dict:
     with DBContext('r') as session:
         __info = session.query(TreeAssetModels).outerjoin(__model,
                                                           __model.id == TreeAssetModels.asset_id).filter(
-            _get_biz_value(biz_id), __model.inner_ip == inner_ip, TreeAssetModels.asset_type == asset_type,
+            _get_biz_value(biz_id), _get_inner_ip_value(__model, inner_ip), TreeAssetModels.asset_type == asset_type,
                                     TreeAssetModels.is_enable == 1).all()
 
     return dict(code=0, msg='获取成功', data=queryset_to_list(__info))
@@ -897,7 +916,7 @@ def get_biz_ids_by_server_ip(inner_ip: str, asset_type="server") -> List[int]:
     __model = mapping[asset_type]
     with DBContext('r') as session:
         query = session.query(TreeAssetModels.biz_id).outerjoin(__model, __model.id == TreeAssetModels.asset_id).filter(
-            __model.inner_ip == inner_ip,
+            _get_inner_ip_value(__model, inner_ip),
             TreeAssetModels.asset_type == asset_type,
             TreeAssetModels.is_enable == 1)
         __info = query.all()
@@ -970,9 +989,23 @@ def before_tree_asset_flush(session: Session, flush_context, instances) -> None:
             biz_ids.remove(tree_asset_instance.biz_id)
             agent.biz_ids = json.dumps(biz_ids, ensure_ascii=False)
 
+    def count_key(tree_asset_instance: TreeAssetModels, attr_values: Optional[dict] = None) -> tuple:
+        """
+        服务树数量缓存的计数维度，attr_values 为修改前的值
+        """
+        attr_values = attr_values or {}
+        return tuple(attr_values.get(attr, getattr(tree_asset_instance, attr))
+                     for attr in ('biz_id', 'env_name', 'region_name', 'module_name', 'asset_type'))
+
+    # 服务树数量变化、分组成员变化的业务，提交后再处理，回滚则丢弃
+    count_changes = session.info.setdefault('tree_count_changes', [])
+    member_biz_ids = session.info.setdefault('tree_member_biz_ids', set())
+
     # 处理新增的 TreeAssetModels 实例
     for new_instance in session.new:
         if isinstance(new_instance, TreeAssetModels):
+            count_changes.append((*count_key(new_instance), 1))
+            member_biz_ids.add(new_instance.biz_id)
             agent_and_biz_ids = get_agent_and_biz_ids(new_instance, "server", session)
             if agent_and_biz_ids:
                 agent, biz_ids = agent_and_biz_ids
@@ -981,12 +1014,40 @@ def before_tree_asset_flush(session: Session, flush_context, instances) -> None:
     # 处理更新的 TreeAssetModels 实例
     for updated_instance in session.dirty:
         if isinstance(updated_instance, TreeAssetModels):
-            pass
+            old_values = {}
+            for attr in ('biz_id', 'env_name', 'region_name', 'module_name', 'asset_type'):
+                history = get_history(updated_instance, attr)
+                if history.has_changes() and history.deleted:
+                    old_values[attr] = history.deleted[0]
+            if old_values:
+                count_changes.append((*count_key(updated_instance, old_values), -1))
+                count_changes.append((*count_key(updated_instance), 1))
+                member_biz_ids.update({old_values.get('biz_id', updated_instance.biz_id), updated_instance.biz_id})
 
     # 处理删除的 TreeAssetModels 实例
     for deleted_instance in session.deleted:
         if isinstance(deleted_instance, TreeAssetModels):
+            count_changes.append((*count_key(deleted_instance), -1))
+            member_biz_ids.add(deleted_instance.biz_id)
             agent_and_biz_ids = get_agent_and_biz_ids(deleted_instance, "server", session)
             if agent_and_biz_ids:
                 agent, biz_ids = agent_and_biz_ids
                 update_biz_ids_for_deleted_instance(deleted_instance, agent, biz_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def after_tree_asset_commit(session: Session) -> None:
+    """事务提交后增量更新服务树数量缓存，异步重算相关业务的分组成员"""
+    count_changes = session.info.pop('tree_count_changes', None)
+    if count_changes:
+        apply_count_changes(count_changes)
+    member_biz_ids = session.info.pop('tree_member_biz_ids', None)
+    if member_biz_ids:
+        async_refresh_biz_members(*member_biz_ids)
+        mark_consul_dirty('tree_asset')
+
+
+@event.listens_for(Session, "after_rollback")
+def after_tree_asset_rollback(session: Session) -> None:
+    session.info.pop('tree_count_changes', None)
+    session.info.pop('tree_member_biz_ids', None)
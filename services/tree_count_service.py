@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Date    : 2026/10/18
+Desc    : 服务树节点数量缓存，每个业务一个Redis Hash，资产挂载变化时增量更新，定时全量对账
+"""
+import json
+import logging
+from typing import *
+
+from sqlalchemy import func
+from websdk2.cache_context import cache_conn
+from websdk2.db_context import DBContextV2 as DBContext
+from websdk2.tools import convert
+
+from models.business import BizModels
+from models.tree import TreeAssetModels
+from services.tree_snapshot_service import bump_tree_version
+
+TREE_COUNT_KEY = "cmdb:tree_count:{biz_id}"
+TREE_COUNT_MARKER = "_v"  # 标记Hash已完整构建，区分空业务和未缓存
+
+# key存在时才累加，避免在未构建的Hash上累加出不完整的数据
+INCR_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    for i = 1, #ARGV, 2 do
+        redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return 1
+"""
+
+
+def get_tree_counts(session, biz_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    一次分组查询统计所有业务的节点数量
+    业务/环境只统计主机，集群/模块统计全部资产，与原 get_tree_count/get_env_count/get_node_info 口径一致
+    :return: biz_id -> {"biz": int, "env": {env: int}, "set": {(env, set): int}, "module": {(env, set, module): int}}
+    """
+    query = session.query(TreeAssetModels.biz_id, TreeAssetModels.env_name, TreeAssetModels.region_name,
+                          TreeAssetModels.module_name, TreeAssetModels.asset_type,
+                          func.count(TreeAssetModels.asset_id))
+    if biz_ids is not None:
+        query = query.filter(TreeAssetModels.biz_id.in_(biz_ids))
+    rows = query.group_by(TreeAssetModels.biz_id, TreeAssetModels.env_name, TreeAssetModels.region_name,
+                          TreeAssetModels.module_name, TreeAssetModels.asset_type).all()
+
+    counts: Dict[str, Dict[str, Any]] = {}
+    for _biz_id, _env_name, _set_name, _module_name, _asset_type, _count in rows:
+        for field, value in count_fields(_env_name, _set_name, _module_name, _asset_type, _count):
+            add_count(counts.setdefault(_biz_id, empty_counts()), field, value)
+    return counts
+
+
+def empty_counts() -> Dict[str, Any]:
+    return dict(biz=0, env={}, set={}, module={})
+
+
+def count_fields(env_name: str, set_name: str, module_name: str, asset_type: str,
+                 delta: int) -> List[Tuple[tuple, int]]:
+    """一条挂载关系影响的计数字段"""
+    fields = [(("set", env_name, set_name), delta), (("module", env_name, set_name, module_name), delta)]
+    if asset_type == 'server':
+        fields += [(("biz",), delta), (("env", env_name), delta)]
+    return fields
+
+
+def add_count(biz_counts: Dict[str, Any], field: tuple, value: int) -> None:
+    if field[0] == "biz":
+        biz_counts["biz"] += value
+        return
+    key = field[1] if field[0] == "env" else tuple(field[1:])
+    biz_counts[field[0]][key] = biz_counts[field[0]].get(key, 0) + value
+
+
+def encode_counts(biz_counts: Dict[str, Any]) -> Dict[str, int]:
+    mapping = {TREE_COUNT_MARKER: 1, json.dumps(["biz"]): biz_counts["biz"]}
+    mapping.update({json.dumps(["env", k]): v for k, v in biz_counts["env"].items()})
+    mapping.update({json.dumps(["set", *k]): v for k, v in biz_counts["set"].items()})
+    mapping.update({json.dumps(["module", *k]): v for k, v in biz_counts["module"].items()})
+    return mapping
+
+
+def decode_counts(mapping: Dict[str, str]) -> Dict[str, Any]:
+    biz_counts = empty_counts()
+    for field, value in mapping.items():
+        if field == TREE_COUNT_MARKER:
+            continue
+        add_count(biz_counts, tuple(json.loads(field)), int(value))
+    return biz_counts
+
+
+def save_biz_counts(redis_conn, counts: Dict[str, Dict[str, Any]]) -> None:
+    pipe = redis_conn.pipeline()
+    for biz_id, biz_counts in counts.items():
+        key = TREE_COUNT_KEY.format(biz_id=biz_id)
+        pipe.delete(key)
+        pipe.hset(key, mapping=encode_counts(biz_counts))
+    pipe.execute()
+
+
+def load_biz_counts(session, biz_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    从缓存读取业务节点数量，未缓存的业务查库后回写
+    """
+    try:
+        redis_conn = cache_conn()
+        pipe = redis_conn.pipeline()
+        for biz_id in biz_ids:
+            pipe.hgetall(TREE_COUNT_KEY.format(biz_id=biz_id))
+        cached = {biz_id: convert(value) for biz_id, value in zip(biz_ids, pipe.execute())}
+    except Exception as err:
+        logging.error(f"读取服务树数量缓存失败 {err}")
+        return get_tree_counts(session, biz_ids)
+
+    counts = {biz_id: decode_counts(value) for biz_id, value in cached.items() if value}
+    missing = [biz_id for biz_id in biz_ids if biz_id not in counts]
+    if missing:
+        db_counts = get_tree_counts(session, missing)
+        db_counts = {biz_id: db_counts.get(biz_id, empty_counts()) for biz_id in missing}
+        try:
+            save_biz_counts(redis_conn, db_counts)
+        except Exception as err:
+            logging.error(f"写入服务树数量缓存失败 {err}")
+        counts.update(db_counts)
+    return counts
+
+
+def apply_count_changes(changes: List[Tuple[str, str, str, str, str, int]]) -> None:
+    """
+    增量更新节点数量
+    :param changes: [(biz_id, env_name, region_name, module_name, asset_type, delta)]
+    """
+    per_biz: Dict[str, Dict[str, int]] = {}
+    for biz_id, env_name, set_name, module_name, asset_type, delta in changes:
+        biz_fields = per_biz.setdefault(biz_id, {})
+        for field, value in count_fields(env_name, set_name, module_name, asset_type, delta):
+            field = json.dumps(list(field))
+            biz_fields[field] = biz_fields.get(field, 0) + value
+    if not per_biz:
+        return
+    try:
+        redis_conn = cache_conn()
+        pipe = redis_conn.pipeline()
+        for biz_id, fields in per_biz.items():
+            args = [i for field, value in fields.items() if value for i in (field, value)]
+            if args:
+                pipe.eval(INCR_IF_EXISTS_SCRIPT, 1, TREE_COUNT_KEY.format(biz_id=biz_id), *args)
+        pipe.execute()
+    except Exception as err:
+        logging.error(f"更新服务树数量缓存失败 {err}")
+    bump_tree_version(*per_biz.keys())
+
+
+def invalidate_biz_counts(*biz_ids: str) -> None:
+    """批量UPDATE/DELETE无法逐行计算增量时直接失效，下次读取重建"""
+    biz_ids = [biz_id for biz_id in biz_ids if biz_id]
+    if not biz_ids:
+        return
+    try:
+        cache_conn().delete(*[TREE_COUNT_KEY.format(biz_id=biz_id) for biz_id in biz_ids])
+    except Exception as err:
+        logging.error(f"失效服务树数量缓存失败 {err}")
+    bump_tree_version(*biz_ids)
+
+
+def reconcile_tree_counts() -> None:
+    """全量重算所有业务的节点数量，修正增量更新的偏差"""
+    with DBContext('r') as session:
+        biz_ids = [biz_id for biz_id, in session.query(BizModels.biz_id).all()]
+        counts = get_tree_counts(session)
+    counts = {biz_id: counts.get(biz_id, empty_counts()) for biz_id in set(biz_ids) | set(counts)}
+    redis_conn = cache_conn()
+    pipe = redis_conn.pipeline()
+    for biz_id in counts:
+        pipe.hgetall(TREE_COUNT_KEY.format(biz_id=biz_id))
+    cached = dict(zip(counts.keys(), pipe.execute()))
+    # 只有数量有偏差的业务需要更新树快照
+    drifted = [biz_id for biz_id, biz_counts in counts.items()
+               if {k: int(v) for k, v in convert(cached[biz_id] or {}).items() if int(v)} !=
+               {k: v for k, v in encode_counts(biz_counts).items() if v}]
+    save_biz_counts(redis_conn, counts)
+    bump_tree_version(*drifted)
+    logging.info(f"服务树数量缓存对账完成, 业务数:{len(counts)}, 有偏差:{len(drifted)}")
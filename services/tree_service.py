@@ -18,6 +18,9 @@ from libs.tree import Tree
 from models.tree import TreeModels, TreeAssetModels
 from models.business import BizModels, SetTempModels
 from services.audit_service import audit_log
+from services.tree_count_service import load_biz_counts, invalidate_biz_counts
+from services.tree_snapshot_service import get_tree_versions, get_tree_etag, get_tree_snapshots, save_tree_snapshots, \
+    bump_tree_version
 from libs.utils import compare_dicts
 
 
@@ -138,6 +141,7 @@ def add_tree_by_api(data) -> dict:
             #                        node_sort=node_sort, parent_node=parent_node, expand=expand, detail=detail))
             audit_log_message = f"用户{create_user}创建服务树{_message}"
         session.commit()
+    bump_tree_version(biz_id)
     return {"code": 0, "msg": "success", "audit_log_message": audit_log_message}
 
 
@@ -201,6 +205,7 @@ def put_tree_by_api(data) -> dict:
                 TreeModels.node_sort: node_sort, TreeModels.expand: expand, TreeModels.detail: detail
             })
             session.commit()
+            invalidate_biz_counts(biz_id)
         except Exception as err:
             logging.error(f'Tree节点更新失败,{err}')
             return {"code": 1, "msg": f'Tree节点更新失败,{err},请确认名称是否重复'}
@@ -217,12 +222,17 @@ def patch_tree_by_api(data) -> dict:
     if tree_list:
         with DBContext('w', None, True) as session:
             session.bulk_update_mappings(TreeModels, tree_list)
+            biz_ids = [biz_id for biz_id, in session.query(TreeModels.biz_id).filter(
+                TreeModels.id.in_([tree.get('id') for tree in tree_list])).distinct()]
+        bump_tree_version(*biz_ids)
         return {"code": 0, "msg": "更新完成"}
     elif attr_key:
         with DBContext('w', None, True) as session:
             session.query(TreeModels).filter(TreeModels.id == tree_id).update(
                 {TreeModels.ext_info: func.json_set(TreeModels.ext_info, "$." + attr_key, attr_val)},
                 synchronize_session='fetch')
+            biz_id = session.query(TreeModels.biz_id).filter(TreeModels.id == tree_id).scalar()
+        bump_tree_version(biz_id)
         return {"code": 0, "msg": f"更新{attr_key}完成"}
     return {"code": 1, "msg": "缺少必要参数"}
 
@@ -277,20 +287,73 @@ def del_tree_by_api(data) -> dict:
         audit_log_message = f"用户{modify_user}删除服务树{_message}"
         # del TreeID
         session.query(TreeModels).filter(TreeModels.id == tree_id).delete(synchronize_session=False)
+    invalidate_biz_counts(biz_id)
 
     return {"code": 0, "msg": "节点删除成功", "audit_log_message": audit_log_message}
 
 
+def get_biz_data(session, biz_id: Optional[str] = None) -> Dict[str, str]:
+    if not biz_id:
+        return get_all_biz(session)
+    return {biz_id: get_biz_name(session=session, biz_id=biz_id)}
+
+
 def get_tree_by_api(**params) -> dict:
     biz_id = params.get('biz_id')
     with DBContext('r') as session:
-        if not biz_id:
-            tree_list = get_tree(session, get_all_biz(session))
-        else:
-            tree_list = get_tree(session, {biz_id: get_biz_name(session=session, biz_id=biz_id)})
+        tree_list = get_tree_cached(session, get_biz_data(session, biz_id), all_biz=not biz_id)
     return {"code": 0, "msg": "获取成功", "data": tree_list}
 
 
+def get_tree_etag_by_api(**params) -> Optional[str]:
+    """
+    树快照的ETag，只读取版本号，不构建树
+    """
+    with DBContext('r') as session:
+        biz_data = get_biz_data(session, params.get('biz_id'))
+    try:
+        versions = get_tree_versions(list(biz_data.keys()))
+    except Exception as err:
+        logging.error(f"获取服务树版本号失败 {err}")
+        return None
+    # 业务改名后根节点标题变化，名称也参与计算
+    return get_tree_etag({biz_id: f"{version}:{biz_data[biz_id]}" for biz_id, version in versions.items()})
+
+
+def get_tree_cached(session, biz_data: Dict[str, str], all_biz: bool = False) -> List[dict]:
+    """
+    优先读取版本号一致的快照，只重建有变化的业务树
+    """
+    try:
+        versions = get_tree_versions(list(biz_data.keys()))
+        snapshots = {biz_id: tree for biz_id, tree in get_tree_snapshots(versions).items()
+                     if tree.get('title') == biz_data[biz_id]}
+    except Exception as err:
+        logging.error(f"读取服务树快照失败 {err}")
+        return get_tree(session, biz_data, all_biz=all_biz)
+
+    missing = {biz_id: biz_name for biz_id, biz_name in biz_data.items() if biz_id not in snapshots}
+    if missing:
+        trees = dict(zip(missing.keys(), get_tree(session, missing, all_biz=all_biz and not snapshots)))
+        try:
+            save_tree_snapshots(trees, versions)
+        except Exception as err:
+            logging.error(f"写入服务树快照失败 {err}")
+        snapshots.update(trees)
+    return [snapshots[biz_id] for biz_id in biz_data]
+
+
+def warm_tree_snapshot(biz_ids: List[str]) -> None:
+    """变更后在后台重建快照"""
+    try:
+        with DBContext('r') as session:
+            biz_data = {biz_id: biz_name for biz_id, biz_name in session.query(
+                BizModels.biz_id, BizModels.biz_cn_name).filter(BizModels.biz_id.in_(biz_ids))}
+            get_tree_cached(session, biz_data)
+    except Exception as err:
+        logging.error(f"预热服务树快照失败 {err}")
+
+
 def get_tree_count(session, biz_id: Optional[str], asset_type: Optional[str] = 'server') -> Union[int]:
     """
     获取一个业务有多少主机数量
@@ -364,57 +427,75 @@ def get_all_biz(
     return {biz_id: biz_name for biz_id, biz_name in biz_list}
 
 
-def build_tree(session, biz_id: str, biz_name: str) -> Dict[str, Any]:
+def build_tree_from(biz_id: str, biz_name: str, tree_data: List[dict], biz_counts: Optional[dict] = None
+                    ) -> Dict[str, Any]:
     """
-    生成树
-    :return:
+    根据节点和数量统计生成树，不访问数据库
     """
-    biz_count: int = get_tree_count(biz_id=biz_id, session=session)
-    env_count: dict = get_env_count(biz_id=biz_id, session=session)
-    node_info: dict = get_node_info(biz_id=biz_id, session=session)
-    tree_data = session.query(TreeModels).filter(TreeModels.biz_id == biz_id).all()
+    biz_counts = biz_counts or dict(biz=0, env={}, set={}, module={})
     # 一级默认
-    the_tree: List[Dict[str, str]] = [
+    the_tree: List[Dict[str, Any]] = [
         {
             "biz_id": biz_id, "title": biz_name, "node_type": 0, "node_sort": 1, "parent_node": "Root", "expand": True,
-            "contextmenu": True, "children": [], "count": biz_count
+            "contextmenu": True, "children": [], "count": biz_counts['biz']
         }
     ]
-    for item in tree_data:
-        data_dict = model_to_dict(item)
-        data_dict['count'] = 0
+    for data_dict in tree_data:
         # 写入节点主机数量
-        try:
-            if data_dict['node_type'] == 1:
-                data_dict['count'] = env_count.get(data_dict['title'], 0)
-            elif data_dict['node_type'] == 2:
-                data_dict['count'] = sum(node_info[data_dict['parent_node']][data_dict['title']].values())
-            elif data_dict['node_type'] == 3:
-                data_dict['count'] = node_info[data_dict['grand_node']][data_dict['parent_node']][data_dict['title']]
-        except Exception as error:
-            logging.debug(f"获取节点主机数量失败: {error}")
-            # 这里没有数据的情况下会报错，不用管
-            pass
-        data_dict.pop('create_time')
-        data_dict.pop('update_time')
+        if data_dict['node_type'] == 1:
+            data_dict['count'] = biz_counts['env'].get(data_dict['title'], 0)
+        elif data_dict['node_type'] == 2:
+            data_dict['count'] = biz_counts['set'].get((data_dict['parent_node'], data_dict['title']), 0)
+        elif data_dict['node_type'] == 3:
+            data_dict['count'] = biz_counts['module'].get(
+                (data_dict['grand_node'], data_dict['parent_node'], data_dict['title']), 0)
+        else:
+            data_dict['count'] = 0
         the_tree.append(data_dict)
     return Tree(the_tree).build()
 
 
+def get_tree_nodes(session, biz_ids: Optional[List[str]] = None) -> Dict[str, List[dict]]:
+    """
+    一次查询所有业务的树节点，按业务分组
+    """
+    query = session.query(TreeModels)
+    if biz_ids is not None:
+        query = query.filter(TreeModels.biz_id.in_(biz_ids))
+    nodes: Dict[str, List[dict]] = {}
+    for item in query.all():
+        data_dict = model_to_dict(item)
+        data_dict.pop('create_time')
+        data_dict.pop('update_time')
+        nodes.setdefault(data_dict['biz_id'], []).append(data_dict)
+    return nodes
+
+
+def build_tree(session, biz_id: str, biz_name: str) -> Dict[str, Any]:
+    """
+    生成树
+    :return:
+    """
+    return get_tree(session, {biz_id: biz_name})[0]
+
+
 def get_tree(
         session,
-        biz_data: Dict[str, str]
+        biz_data: Dict[str, str],
+        all_biz: bool = False
 ) -> List[dict]:
     """
-    生成业务树信息返回前端
+    生成业务树信息返回前端，所有业务共用一次节点查询，节点数量读缓存
     :param session:
     :param biz_data:
+    :param all_biz: biz_data为全部业务时不拼接IN条件
     :return:
     """
-    tree_list: List[Dict[str, Any]] = []
-    for biz_id, biz_name in biz_data.items():
-        tree_list.append(build_tree(session, biz_id, biz_name))
-    return tree_list
+    biz_ids = None if all_biz else list(biz_data.keys())
+    tree_nodes = get_tree_nodes(session, biz_ids)
+    tree_counts = load_biz_counts(session, list(biz_data.keys()))
+    return [build_tree_from(biz_id, biz_name, tree_nodes.get(biz_id, []), tree_counts.get(biz_id))
+            for biz_id, biz_name in biz_data.items()]
 
 
 def get_tree_info_by_api(**params) -> dict:
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Date    : 2026/10/18
+Desc    : 服务树快照缓存，按业务缓存序列化后的树，树结构或节点数量变化时更新版本号
+"""
+import hashlib
+import json
+import logging
+from typing import *
+
+from shortuuid import uuid
+from websdk2.cache_context import cache_conn
+from websdk2.configs import configs
+from websdk2.tools import convert
+
+TREE_VERSION_KEY = "cmdb:tree_version:{biz_id}"
+TREE_SNAPSHOT_KEY = "cmdb:tree_snapshot:{biz_id}"
+TREE_SNAPSHOT_TTL = 86400  # 快照兜底过期时间(秒)
+
+
+def is_warm_on_write() -> bool:
+    """树变更后是否立即在后台重建快照"""
+    return str(configs.get("tree_snapshot_warm", "no")).lower() in ("yes", "true", "1")
+
+
+def get_tree_versions(biz_ids: List[str]) -> Dict[str, str]:
+    """
+    获取业务树版本号，版本号用随机串而不是自增数，Redis数据丢失后不会与旧快照碰撞
+    """
+    redis_conn = cache_conn()
+    pipe = redis_conn.pipeline()
+    for biz_id in biz_ids:
+        pipe.get(TREE_VERSION_KEY.format(biz_id=biz_id))
+    versions = {biz_id: convert(version) for biz_id, version in zip(biz_ids, pipe.execute())}
+
+    missing = [biz_id for biz_id, version in versions.items() if not version]
+    if missing:
+        pipe = redis_conn.pipeline()
+        for biz_id in missing:
+            pipe.set(TREE_VERSION_KEY.format(biz_id=biz_id), uuid(), nx=True)
+            pipe.get(TREE_VERSION_KEY.format(biz_id=biz_id))
+        result = pipe.execute()
+        versions.update({biz_id: convert(version) for biz_id, version in zip(missing, result[1::2])})
+    return versions
+
+
+def get_tree_etag(versions: Dict[str, str]) -> str:
+    payload = ",".join(f"{biz_id}:{versions[biz_id]}" for biz_id in sorted(versions))
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def get_tree_snapshots(versions: Dict[str, str]) -> Dict[str, dict]:
+    """读取与当前版本号一致的快照"""
+    biz_ids = list(versions.keys())
+    pipe = cache_conn().pipeline()
+    for biz_id in biz_ids:
+        pipe.get(TREE_SNAPSHOT_KEY.format(biz_id=biz_id))
+    snapshots = {}
+    for biz_id, value in zip(biz_ids, pipe.execute()):
+        if not value:
+            continue
+        snapshot = json.loads(convert(value))
+        if snapshot.get('version') == versions[biz_id]:
+            snapshots[biz_id] = snapshot['data']
+    return snapshots
+
+
+def save_tree_snapshots(trees: Dict[str, dict], versions: Dict[str, str]) -> None:
+    """快照带上构建前读取的版本号，构建期间发生变更时下次读取自然失效"""
+    pipe = cache_conn().pipeline()
+    for biz_id, tree in trees.items():
+        pipe.set(TREE_SNAPSHOT_KEY.format(biz_id=biz_id),
+                 json.dumps(dict(version=versions[biz_id], data=tree), default=str), ex=TREE_SNAPSHOT_TTL)
+    pipe.execute()
+
+
+def bump_tree_version(*biz_ids: str) -> None:
+    """树结构或节点数量变化后更新版本号"""
+    biz_ids = [biz_id for biz_id in set(biz_ids) if biz_id]
+    if not biz_ids:
+        return
+    try:
+        pipe = cache_conn().pipeline()
+        for biz_id in biz_ids:
+            pipe.set(TREE_VERSION_KEY.format(biz_id=biz_id), uuid())
+        pipe.execute()
+    except Exception as err:
+        logging.error(f"更新服务树版本号失败 {err}")
+        return
+
+    if is_warm_on_write():
+        # 延迟导入，避免与tree_service互相引用
+        from libs.thread_pool import global_executors
+        from services.tree_service import warm_tree_snapshot
+        global_executors.general_executor.submit(warm_tree_snapshot, biz_ids)
@@ -56,6 +56,7 @@ asset_change_notify = {}
 JMS_API_BASE_URL = os.getenv("JMS_API_BASE_URL", "")
 JMS_API_KEY_ID = os.getenv("JMS_API_KEY_ID", "")
 JMS_API_KEY_SECRET = os.getenv("JMS_API_KEY_SECRET", "")
+JMS_POOL_SIZE = os.getenv("CMDB_JMS_POOL_SIZE", 20)  # 每个组织的长连接池大小
 
 # 内网交换机配置
 SWITCH_COMMUNITY = os.getenv("SWITCH_COMMUNITY", "")  # 交换机 公共团体字符串
@@ -71,6 +72,17 @@ KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "")
 # Sync GCP to CMDB
 GCP_SYNC = os.getenv("GCP_SYNC", "no")
 
+# 云资源同步模式: local 在API进程内同步; queue 只入队，由 --service=worker 进程执行
+SYNC_MODE = os.getenv("CMDB_SYNC_MODE", "local")
+SYNC_WORKER_PROCESSES = os.getenv("CMDB_SYNC_WORKER_PROCESSES", 2)
+
+# 服务树变更后是否立即在后台重建树快照
+TREE_SNAPSHOT_WARM = os.getenv("CMDB_TREE_SNAPSHOT_WARM", "no")
+
+# consul exporter 扩展类型(JSON)，内置 server/mysql/redis/domain
+# e.g: '{"mongodb": {"address": "items", "field": "db_address", "port": 27017}}'
+CONSUL_EXPORTERS = os.getenv("CMDB_CONSUL_EXPORTERS", "")
+
 # 服务树告警忽略配置. e.g: "item1,,,item2,,,item3"
 INGORE_TREE_ALERT_KEYWORDS = os.getenv("IGNORE_TREE_ALERT_ITEMS", "tke-,,,node-00,,,as-tke-,,,k8s-")
 
@@ -97,6 +109,11 @@ settings = dict(
     ignore_tree_alert_keywords=INGORE_TREE_ALERT_KEYWORDS,
     kafka_topic=KAFKA_TOPIC,
     gcp_sync=GCP_SYNC,
+    sync_mode=SYNC_MODE,
+    sync_worker_processes=SYNC_WORKER_PROCESSES,
+    tree_snapshot_warm=TREE_SNAPSHOT_WARM,
+    consul_exporters=CONSUL_EXPORTERS,
+    jms_pool_size=JMS_POOL_SIZE,
     app_name="cmdb",
     databases={
         const.DEFAULT_DB_KEY: {
@@ -12,6 +12,7 @@ from websdk2.program import MainProgram
 from settings import settings as app_settings
 from cmdb.applications import Application as CmdbApp
 from libs.registration import Registration
+from libs.sync_worker import SyncWorker
 
 define("service", default='cmdb', help="start service flag", type=str)
 
@@ -24,6 +25,8 @@ class MyProgram(MainProgram):
             self.__app = CmdbApp(**settings)
         elif service in ['init']:
             self.__app = Registration(**settings)
+        elif service == 'worker':
+            self.__app = SyncWorker(**settings)
         super(MyProgram, self).__init__(progressid)
         self.__app.start_server()
 
@@ -34,3 +37,4 @@ if __name__ == '__main__':
 # python3 startup.py --service=init
 # python3 db_sync.py
 # python3 startup.py --service=cmdb --port=8899
+# python3 startup.py --service=worker  # CMDB_SYNC_MODE=queue 时执行云资源同步
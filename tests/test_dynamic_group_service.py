@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Desc    : 动态分组规则编译，与原拼接SQL的匹配结果逐条对照
+"""
+
+import pytest
+from sqlalchemy import create_engine, insert, select, text
+
+from models.asset import AssetServerModels
+from services.dynamic_group_service import LIKE_CONTAINS, LIKE_PREFIX, DynamicRuleError, compile_rules
+
+servers = [
+    dict(id=1, name='web-prod-01', inner_ip='10.0.0.1', state='运行中', region='cn-hangzhou', is_product=1),
+    dict(id=2, name='web-prod-02', inner_ip='10.0.0.2', state='已停止', region='cn-hangzhou', is_product=1),
+    dict(id=3, name='db-prod-01', inner_ip='10.0.1.1', state='运行中', region='cn-shanghai', is_product=1),
+    dict(id=4, name='web-test-01', inner_ip='192.168.1.1', state='运行中', region=None, is_product=0),
+    dict(id=5, name='cache-web-01', inner_ip='192.168.1.2', state='运行中', region='cn-beijing', is_product=0),
+]
+
+
+def legacy_v1_sql(rules):
+    """原 get_dynamic_hosts 的SQL，双引号字符串改为单引号以兼容SQLite"""
+    sql_string = """ SELECT id FROM t_asset_server WHERE name = ''\n """
+    sql_conditions = ''
+    for rule in rules:
+        query_name = rule['query_name']
+        query_conditions = rule['query_conditions']
+        if query_conditions not in ['like', '=', '!=']:
+            continue
+        query_value = f"%{rule['query_value']}%" if query_conditions == 'like' else f"{rule['query_value']}"
+        sql_conditions += f"or {query_name} {query_conditions} '{query_value}'\n"
+    return sql_string + sql_conditions
+
+
+def legacy_v2_sql(rules):
+    """原 get_dynamic_hosts_v2 的SQL"""
+    def sub_query(item):
+        if item['query_conditions'] == 'like':
+            return f"{item['query_name']} {item['query_conditions']} '{item['query_value']}%'"
+        return f"{item['query_name']} {item['query_conditions']} '{item['query_value']}'"
+
+    sub_queries = [" AND ".join(sub_query(item) for item in rule) for rule in rules]
+    return f"SELECT id FROM t_asset_server WHERE 1=1 AND ({' OR '.join(f'({subquery})' for subquery in sub_queries)});"
+
+
+def rule(query_name, query_conditions, query_value, status=1):
+    return dict(query_name=query_name, query_conditions=query_conditions, query_value=query_value, status=status)
+
+
+@pytest.fixture(scope='module')
+def engine():
+    engine = create_engine('sqlite://')
+    AssetServerModels.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(AssetServerModels), [dict(server, cloud_name='aliyun', account_id='a1',
+                                                      instance_id=f'i-{server["id"]}') for server in servers])
+    return engine
+
+
+def query_ids(engine, sql=None, condition=None):
+    with engine.connect() as conn:
+        if sql is not None:
+            return sorted(row[0] for row in conn.execute(text(sql)))
+        return sorted(row[0] for row in conn.execute(select(AssetServerModels.id).where(condition)))
+
+
+v1_cases = [
+    ([rule('name', 'like', 'prod')], [1, 2, 3]),
+    ([rule('name', 'like', 'web')], [1, 2, 4, 5]),  # v1 为包含匹配
+    ([rule('name', 'like', 'db'), rule('inner_ip', '=', '192.168.1.2')], [3, 5]),  # 规则之间 OR
+    ([rule('state', '!=', '运行中')], [2]),
+    ([rule('region', '!=', 'cn-hangzhou')], [3, 5]),  # NULL 不参与 != 匹配
+    ([rule('is_product', '=', 1)], [1, 2, 3]),
+    ([rule('name', 'like', 'test', status=0)], [4]),  # 原SQL不判断 status
+]
+
+v2_cases = [
+    ([[rule('name', 'like', 'web')]], [1, 2, 4]),  # v2 为前缀匹配
+    ([[rule('name', 'like', 'web'), rule('state', '=', '运行中')]], [1, 4]),  # 组内 AND
+    ([[rule('name', 'like', 'web'), rule('region', '=', 'cn-hangzhou')],
+      [rule('name', 'like', 'db')]], [1, 2, 3]),  # 组间 OR
+    ([[rule('inner_ip', 'like', '10.0.'), rule('state', '!=', '运行中')]], [2]),
+    ([[rule('region', '!=', 'cn-shanghai')]], [1, 2, 5]),
+    ([[rule('is_product', '=', 0), rule('name', 'like', 'cache', status=0)]], [5]),  # 原SQL不判断 status
+]
+
+
+@pytest.mark.parametrize('rules, expected', v1_cases)
+def test_v1_matches_legacy_sql(engine, rules, expected):
+    assert query_ids(engine, sql=legacy_v1_sql(rules)) == expected
+    assert query_ids(engine, condition=compile_rules(rules, LIKE_CONTAINS)) == expected
+
+
+@pytest.mark.parametrize('rules, expected', v2_cases)
+def test_v2_matches_legacy_sql(engine, rules, expected):
+    assert query_ids(engine, sql=legacy_v2_sql(rules)) == expected
+    assert query_ids(engine, condition=compile_rules(rules, LIKE_PREFIX)) == expected
+
+
+def test_values_are_bound_parameters(engine):
+    rules = [[rule('name', '=', "x' OR '1'='1")]]
+    assert query_ids(engine, condition=compile_rules(rules)) == []
+
+
+@pytest.mark.parametrize('rules', [
+    [[rule('hostname', '=', 'web')]],
+    [[rule('name; DROP TABLE t_asset_server', '=', 'web')]],
+    [[rule('name', 'in', 'web')]],
+    [[rule('name', 'like', 'web')], [rule('name', 'regexp', 'web')]],
+    [],
+    [[]],
+])
+def test_invalid_rules(rules):
+    with pytest.raises(DynamicRuleError):
+        compile_rules(rules)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Desc    : 导入冒烟测试，模块级错误会导致API和所有同步任务无法启动
+"""
+
+import importlib
+
+import pytest
+
+
+@pytest.mark.parametrize('module_name', [
+    'libs.consul_registry',
+    'models.models_utils',
+])
+def test_import(module_name):
+    importlib.import_module(module_name)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Desc    : IP基数树的精确查询和网段包含查询，结果与 ipaddress 逐个判断对照
+"""
+
+import ipaddress
+
+import pytest
+
+from libs.ip_radix import IPRadixTree, parse_ip
+
+IPV4_ADDRESSES = ['10.0.0.1', '10.0.0.255', '10.0.1.7', '10.0.127.9', '10.0.128.1', '10.1.0.1', '10.255.255.255',
+                  '11.0.0.1', '172.16.5.4', '172.31.255.1', '172.32.0.1', '192.168.1.1', '0.0.0.0']
+IPV6_ADDRESSES = ['2001:db8::1', '2001:db8::ffff', '2001:db8:0:1::1', '2001:db8:8000::1', '2001:db9::1', 'fe80::1',
+                  '::1']
+
+
+@pytest.fixture
+def tree():
+    ip_tree = IPRadixTree()
+    for ip in IPV4_ADDRESSES + IPV6_ADDRESSES:
+        ip_tree.insert(ip, ip)
+    return ip_tree
+
+
+def expected_in_network(cidr):
+    network = ipaddress.ip_network(cidr, strict=False)
+    return sorted(ip for ip in IPV4_ADDRESSES + IPV6_ADDRESSES if ipaddress.ip_address(ip) in network)
+
+
+@pytest.mark.parametrize('cidr', [
+    '10.0.0.0/8', '10.0.0.0/16', '10.0.0.0/24', '10.0.0.1/32',
+    # 非整字节前缀
+    '10.0.0.0/17', '10.0.128.0/17', '10.0.0.0/9', '172.16.0.0/12', '10.0.0.0/23', '10.0.0.0/31',
+    '10.0.0.0/25', '10.0.0.128/25', '192.168.1.0/30', '8.0.0.0/5', '0.0.0.0/0',
+    # 非网络地址，按所在网段处理
+    '10.0.1.7/20',
+])
+def test_ipv4_in_network(tree, cidr):
+    assert sorted(tree.in_network(cidr)) == expected_in_network(cidr)
+
+
+@pytest.mark.parametrize('cidr', [
+    '2001:db8::/32', '2001:db8::/33', '2001:db8:8000::/33', '2001:db8::/48', '2001:db8::/64', '2001:db8::/121',
+    '2001:db8::/127', '2001:db8::1/128', '2001:db8::/31', 'fe80::/10', '::/0', '::1/128',
+])
+def test_ipv6_in_network(tree, cidr):
+    assert sorted(tree.in_network(cidr)) == expected_in_network(cidr)
+
+
+def test_versions_are_separate(tree):
+    assert '::1' not in tree.in_network('0.0.0.0/0')
+    assert '0.0.0.0' not in tree.in_network('::/0')
+
+
+def test_exact(tree):
+    assert tree.exact('10.0.0.1') == ['10.0.0.1']
+    assert tree.exact('2001:db8::1') == ['2001:db8::1']
+    assert tree.exact('2001:0db8:0000::0001') == ['2001:db8::1']
+    assert tree.exact('10.0.0.2') == []
+    assert tree.exact('not-an-ip') == []
+
+
+def test_multiple_values_per_ip():
+    ip_tree = IPRadixTree()
+    ip_tree.insert('10.0.0.1', ('server', 1))
+    ip_tree.insert('10.0.0.1', ('eip', 2))
+    assert sorted(ip_tree.exact('10.0.0.1')) == [('eip', 2), ('server', 1)]
+    assert ip_tree.size == 2
+
+
+def test_invalid_input():
+    ip_tree = IPRadixTree()
+    assert ip_tree.insert('10.0.0.256', 'x') is False
+    assert ip_tree.insert('', 'x') is False
+    assert ip_tree.size == 0
+    with pytest.raises(ValueError):
+        ip_tree.in_network('10.0.0.0/33')
+    assert parse_ip(' 10.0.0.1 ') == ipaddress.ip_address('10.0.0.1')
+    assert parse_ip(None) is None
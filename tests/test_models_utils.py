@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Desc    : 批量入库字段映射，与原 *_task 写入函数逐字段对照
+"""
+
+import pytest
+
+from models.models_utils import map_upsert_row, upsert_column_mapping
+
+# 原 *_task 写入的字段(cloud_name/account_id/唯一键/is_expired/update_time 由 bulk_upsert 统一处理)
+legacy_columns = {
+    'server': {'name', 'region', 'zone', 'state', 'outer_ip', 'inner_ip', 'vpc_id', 'ext_info'},
+    'mysql': {'region', 'zone', 'ext_info', 'name', 'state', 'db_class', 'db_engine', 'db_version', 'db_address'},
+    'redis': {'region', 'zone', 'ext_info', 'name', 'state', 'instance_class', 'instance_arch', 'instance_type',
+              'instance_version', 'instance_address'},
+    'lb': {'name', 'type', 'region', 'zone', 'endpoint_type', 'lb_vip', 'dns_name', 'state', 'ext_info'},
+    'vpc': {'vpc_name', 'region', 'cidr_block_v4', 'cidr_block_v6', 'vpc_router', 'vpc_switch', 'is_default'},
+    'vswitch': {'vpc_id', 'vpc_name', 'region', 'zone', 'name', 'address_count', 'cidr_block_v4', 'cidr_block_v6',
+                'route_id', 'is_default'},
+    'eip': {'name', 'address', 'region', 'binding_instance_id', 'binding_instance_type', 'state', 'bandwidth',
+            'internet_charge_type', 'charge_type'},
+    'security_group': {'region', 'vpc_id', 'security_group_name', 'security_info', 'ref_info', 'description'},
+    'image': {'region', 'name', 'image_type', 'image_size', 'os_platform', 'os_name', 'state', 'arch',
+              'description'},
+    'event': {'region', 'event_service', 'event_type', 'event_status', 'event_instance_id', 'event_instance_name',
+              'event_start_time', 'event_end_time', 'event_detail'},
+    'nat': {'region', 'name', 'network_type', 'network_interface_id', 'charge_type', 'outer_ip', 'zone',
+            'description', 'spec', 'subnet_id', 'project_name', 'vpc_id', 'state'},
+    'cluster': {'region', 'name', 'inner_ip', 'outer_ip', 'zone', 'description', 'version', 'vpc_id', 'total_node',
+                'total_running_node', 'tags', 'state', 'ext_info', 'cluster_type'},
+    'mongodb': {'region', 'name', 'db_class', 'db_version', 'db_address', 'subnet_id', 'vpc_id', 'project_name',
+                'state', 'tags', 'zone', 'storage_type'},
+}
+
+
+@pytest.mark.parametrize('resource_type', sorted(legacy_columns))
+def test_columns_match_legacy_writer(resource_type):
+    assert set(upsert_column_mapping[resource_type]) == legacy_columns[resource_type]
+
+
+@pytest.mark.parametrize('resource_type', sorted(legacy_columns))
+def test_plain_columns_copied_from_row(resource_type):
+    row = {column: f'{column}-value' for column in legacy_columns[resource_type]}
+    row.update(instance_id='i-1', status='status-value')
+    value = map_upsert_row(resource_type, row)
+    for column, getter in upsert_column_mapping[resource_type].items():
+        if isinstance(getter, str) and getter == column:
+            assert value[column] == row[column]
+
+
+@pytest.mark.parametrize('resource_type', ['server', 'mysql', 'redis'])
+def test_ext_info_is_whole_row(resource_type):
+    row = dict(instance_id='i-1', name='host', extra='x')
+    assert map_upsert_row(resource_type, row)['ext_info'] == row
+
+
+def test_lb_state_from_status():
+    value = map_upsert_row('lb', dict(instance_id='lb-1', status='active', ext_info={'a': 1}))
+    assert value['state'] == 'active'
+    assert value['ext_info'] == {'a': 1}
+
+
+@pytest.mark.parametrize('resource_type, column, default', [
+    ('vpc', 'is_default', False),
+    ('vswitch', 'is_default', False),
+    ('vswitch', 'vpc_name', ''),
+    ('eip', 'charge_type', False),
+])
+def test_legacy_defaults(resource_type, column, default):
+    assert map_upsert_row(resource_type, dict(instance_id='i-1'))[column] == default
+
+
+def test_missing_fields_are_none():
+    value = map_upsert_row('mysql', dict(instance_id='i-1'))
+    assert value['db_address'] is None
+    assert value['name'] is None
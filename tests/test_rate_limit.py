@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Desc    : 云厂商API令牌桶限流
+"""
+
+from http import HTTPStatus
+
+import pytest
+
+from libs import rate_limit
+from libs.rate_limit import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    """替换rate_limit模块中的time，sleep只推进时间
+    速率取2的幂，等待时长可以精确表示，避免浮点误差导致的极小等待
+    """
+
+    def __init__(self):
+        self.now = 1024.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', fake)
+    return fake
+
+
+class ThrottleError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def test_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert clock.sleeps == []
+
+
+def test_waits_for_refill_after_burst(clock):
+    bucket = TokenBucket(rate=8, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert bucket.acquire() == pytest.approx(0.125)
+    assert sum(clock.sleeps) == pytest.approx(0.125)
+
+
+def test_refill_capped_at_capacity(clock):
+    bucket = TokenBucket(rate=8, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 64
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() > 0
+
+
+def test_sustained_rate(clock):
+    bucket = TokenBucket(rate=4, capacity=1)
+    start = clock.now
+    for _ in range(11):
+        bucket.acquire()
+    assert clock.now - start == pytest.approx(2.5)
+
+
+def test_slow_down_and_recover(clock):
+    bucket = TokenBucket(rate=8, capacity=8)
+    bucket.slow_down()
+    assert bucket.rate == 4
+    for _ in range(10):
+        bucket.slow_down()
+    assert bucket.rate == 1  # 下限为初始速率的1/8
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rate == 8
+
+
+def test_slow_down_drains_tokens(clock):
+    bucket = TokenBucket(rate=16, capacity=5)
+    bucket.slow_down()
+    assert bucket.acquire() == pytest.approx(0.125)
+
+
+def test_call_retries_throttled(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit.random, 'uniform', lambda a, b: b)
+    limiter = RateLimiter()
+    errors = [ThrottleError('Throttling'), ThrottleError('Throttling')]
+
+    def api():
+        if errors:
+            raise errors.pop()
+        return 'ok'
+
+    assert limiter.call('aliyun', 'acc', 'DescribeInstances', api) == 'ok'
+    stats = limiter.stats()['aliyun:acc:DescribeInstances']
+    assert stats['calls'] == 3
+    assert stats['throttled'] == 2
+    assert stats['retried'] == 2
+    assert stats['failed'] == 0
+
+
+def test_call_gives_up_after_max_retries(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit.random, 'uniform', lambda a, b: b)
+    monkeypatch.setitem(rate_limit.DEFAULT_RATE_LIMITS, 'qcloud', (8, 8))
+    limiter = RateLimiter()
+
+    def api():
+        raise ThrottleError('RequestLimitExceeded')
+
+    with pytest.raises(ThrottleError):
+        limiter.call('qcloud', 'acc', 'DescribeInstances', api)
+    stats = limiter.stats()['qcloud:acc:DescribeInstances']
+    assert stats['calls'] == rate_limit.MAX_RETRIES + 1
+    assert stats['failed'] == 1
+
+
+def test_call_raises_other_errors_immediately(clock):
+    limiter = RateLimiter()
+
+    def api():
+        raise ThrottleError('InvalidParameter')
+
+    with pytest.raises(ThrottleError):
+        limiter.call('aliyun', 'acc', 'DescribeInstances', api)
+    assert limiter.stats()['aliyun:acc:DescribeInstances']['calls'] == 1
+
+
+def test_buckets_per_account_and_api():
+    limiter = RateLimiter()
+    bucket = limiter.get_bucket('aws', 'a', 'DescribeInstances')
+    assert limiter.get_bucket('aws', 'a', 'DescribeInstances') is bucket
+    assert limiter.get_bucket('aws', 'b', 'DescribeInstances') is not bucket
+    assert limiter.get_bucket('aws', 'a', 'LookupEvents').rate == 2
+
+
+def test_http_status_code_is_throttled():
+    # 谷歌云api_core异常的code为HTTPStatus
+    limiter = RateLimiter()
+    assert rate_limit.get_error_code(ThrottleError(HTTPStatus.TOO_MANY_REQUESTS)) == '429'
+    assert limiter.is_throttled('gcp', ThrottleError(HTTPStatus.TOO_MANY_REQUESTS))
+    assert not limiter.is_throttled('gcp', ThrottleError(HTTPStatus.NOT_FOUND))
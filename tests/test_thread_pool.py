@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Desc    : 云资源同步调度器的公平出队与任务合并
+"""
+
+import threading
+
+import pytest
+
+from libs.thread_pool import FairSyncScheduler
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def scheduler():
+    executor = FairSyncScheduler(max_workers=1)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+def block_worker(scheduler):
+    """占住唯一的工作线程，让后续任务全部排队"""
+    started, release = threading.Event(), threading.Event()
+
+    def blocker(config):
+        started.set()
+        release.wait(TIMEOUT)
+
+    future = scheduler.submit(blocker, dict(account_id='blocker', type='server'))
+    assert started.wait(TIMEOUT)
+    return release, future
+
+
+def test_accounts_interleave(scheduler):
+    order = []
+
+    def sync(config):
+        order.append((config['account_id'], config['type']))
+
+    release, blocker = block_worker(scheduler)
+    futures = [scheduler.submit(sync, dict(account_id='big', type=f'type-{i}')) for i in range(4)]
+    futures += [scheduler.submit(sync, dict(account_id='small', type=f'type-{i}')) for i in range(2)]
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(TIMEOUT)
+
+    assert order == [('big', 'type-0'), ('small', 'type-0'), ('big', 'type-1'), ('small', 'type-1'),
+                     ('big', 'type-2'), ('big', 'type-3')]
+
+
+def test_expensive_account_yields(scheduler):
+    """耗时更长的账号按虚拟时间让出，其他账号先执行"""
+    order = []
+
+    def sync(config):
+        order.append(config['account_id'])
+
+    key, _ = scheduler._job_identity(sync, (dict(account_id='slow', type='server'),))
+    scheduler._cost[key] = 10.0
+    release, blocker = block_worker(scheduler)
+    futures = [scheduler.submit(sync, dict(account_id='slow', type='server'))]
+    futures += [scheduler.submit(sync, dict(account_id='fast', type=f'type-{i}')) for i in range(3)]
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(TIMEOUT)
+
+    assert order == ['slow', 'fast', 'fast', 'fast']
+    # 再次排队时慢账号的虚拟时间已远超其他账号
+    release, blocker = block_worker(scheduler)
+    futures = [scheduler.submit(sync, dict(account_id='slow', type='server')),
+               scheduler.submit(sync, dict(account_id='fast', type='type-0'))]
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(TIMEOUT)
+    assert order[-2:] == ['fast', 'slow']
+
+
+def test_duplicate_submit_coalesced(scheduler):
+    calls = []
+
+    def sync(config):
+        calls.append(config['type'])
+        return len(calls)
+
+    release, blocker = block_worker(scheduler)
+    first = scheduler.submit(sync, dict(account_id='acc', type='server'))
+    second = scheduler.submit(sync, dict(account_id='acc', type='server'))
+    other = scheduler.submit(sync, dict(account_id='acc', type='mysql'))
+    assert first is second
+    assert other is not first
+    release.set()
+    blocker.result(TIMEOUT)
+    first.result(TIMEOUT)
+    other.result(TIMEOUT)
+
+    assert sorted(calls) == ['mysql', 'server']
+    assert scheduler.stats()['coalesced'] == 1
+    # 执行结束后可以再次提交
+    third = scheduler.submit(sync, dict(account_id='acc', type='server'))
+    assert third is not first
+    assert third.result(TIMEOUT) == 3
+
+
+def test_failure_sets_exception(scheduler):
+    def sync(config):
+        raise ValueError('boom')
+
+    future = scheduler.submit(sync, dict(account_id='acc', type='server'))
+    with pytest.raises(ValueError):
+        future.result(TIMEOUT)
+    stats = scheduler.stats()
+    assert stats['failed'] == 1
+    assert stats['queue_depth'] == 0
+
+
+def test_shutdown_cancels_queued(scheduler):
+    release, blocker = block_worker(scheduler)
+    queued = scheduler.submit(lambda config: None, dict(account_id='acc', type='server'))
+    scheduler.shutdown(wait=False)
+    assert queued.cancelled()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(lambda config: None, dict(account_id='acc', type='mysql'))
+    release.set()
+    blocker.result(TIMEOUT)